@@ -619,11 +619,19 @@ def _localize(args):
     print("Localize - Parameters:")
     print("{:<8} {:<15} {:<10}".format("No", "Label", "Value"))
 
-    if args.fit_method == "lq-gpu":
-        if gausslq.gpufit_installed:
-            print("GPUfit installed")
+    if args.fit_method == "lq-gpu" or args.fit_method == "lq-gpu-3d":
+        if args.fit_backend == "auto":
+            if gausslq.gpufit_installed:
+                args.fit_backend = "gpufit"
+            else:
+                args.fit_backend = "cpu"
+        if args.fit_backend == "gpufit":
+            if gausslq.gpufit_installed:
+                print("GPUfit installed")
+            else:
+                raise Exception("GPUfit not installed. Aborting.")
         else:
-            raise Exception("GPUfit not installed. Aborting.")
+            print("Using the CPU implementation of GPUfit")
 
     for index, element in enumerate(vars(args)):
         print(
@@ -732,7 +740,15 @@ def _localize(args):
             print("Processing {}, File {} of {}".format(path, i+1, len(paths)))
             print("------------------------------------------")
             movie, info = load_movie(path)
-            current, futures = identify_async(movie, min_net_gradient, box)
+            if args.fit_method == "avg":
+                # ROI photometry is measured during identification
+                current, futures = identify_async(
+                    movie, min_net_gradient, box, camera_info=camera_info
+                )
+            else:
+                current, futures = identify_async(
+                    movie, min_net_gradient, box
+                )
             n_frames = len(movie)
             while current[0] < n_frames:
                 print(
@@ -753,7 +769,9 @@ def _localize(args):
                 locs = gausslq.locs_from_fits(ids, theta, box, args.gain)
             elif args.fit_method == "lq-gpu" or args.fit_method == "lq-gpu-3d":
                 spots = get_spots(movie, ids, box, camera_info)
-                theta = gausslq.fit_spots_gpufit(spots)
+                theta = gausslq.fit_spots_gpufit(
+                    spots, backend=args.fit_backend
+                )
                 em = camera_info["gain"] > 1
                 locs = gausslq.locs_from_fits_gpufit(ids, theta, box, em)
             elif args.fit_method == "mle":
@@ -775,9 +793,9 @@ def _localize(args):
                 )
 
             elif args.fit_method == "avg":
-                spots = get_spots(movie, ids, box, camera_info)
-                theta = avgroi.fit_spots_parallel(spots, asynch=False)
-                locs = avgroi.locs_from_fits(ids, theta, box, args.gain)
+                locs = avgroi.locs_from_photometry(
+                    ids, ids.photons, ids.bg, box, args.gain
+                )
 
             else:
                 print("This should never happen...")
@@ -829,7 +847,7 @@ def _localize(args):
 def _render(args):
     from .lib import locs_glob_map
     from .render import render
-    from os.path import splitext
+    from os.path import dirname, splitext
     from matplotlib.pyplot import imsave
     from os import startfile
     from os.path import isdir
@@ -849,9 +867,26 @@ def _render(args):
         scaling,
         cmap,
         silent,
+        tiled,
     ):
         if blur_method == "none":
             blur_method = None
+        if tiled:
+            out_path = render_tiled(
+                locs,
+                info,
+                path,
+                oversampling,
+                blur_method,
+                min_blur_width,
+                vmin,
+                vmax,
+                scaling,
+                cmap,
+            )
+            if not silent:
+                startfile(out_path)
+            return
         N, image = render(
             locs,
             info,
@@ -873,6 +908,62 @@ def _render(args):
         if not silent:
             startfile(out_path)
 
+    def render_tiled(
+        locs,
+        info,
+        path,
+        oversampling,
+        blur_method,
+        min_blur_width,
+        vmin,
+        vmax,
+        scaling,
+        cmap,
+    ):
+        import tempfile
+        import numpy as np
+        from matplotlib.pyplot import get_cmap
+        from . import io, render
+
+        viewport = [(0, 0), (info[0]["Height"], info[0]["Width"])]
+        shape = render.image_shape(viewport, oversampling)
+        base, ext = splitext(path)
+        out_path = base + ".tif"
+        lut = get_cmap(cmap)(np.linspace(0, 1, 256))[:, :3]
+        lut = np.uint8(np.round(255 * lut))
+        # The float image is kept in a temporary file next to the output
+        with tempfile.TemporaryFile(dir=dirname(out_path)) as file:
+            image = np.memmap(file, dtype=np.float32, mode="w+", shape=shape)
+            N, image_max = render.render_tiled(
+                locs,
+                info,
+                image,
+                oversampling,
+                viewport,
+                blur_method=blur_method,
+                min_blur_width=min_blur_width,
+            )
+            if scaling == "yes":
+                vmin_ = vmin * image_max / 100
+                vmax_ = vmax * image_max / 100
+            else:
+                vmin_, vmax_ = vmin, vmax
+            # An empty image or equal limits would divide by zero
+            if vmax_ == vmin_:
+                vmax_ = vmin_ + 1 / (10 ** 6)
+            with io.TiledTiffWriter(out_path, *shape) as tif:
+                for y in tqdm(
+                    range(0, shape[0], tif.tile_size),
+                    desc="Writing image",
+                    unit="rows of tiles",
+                ):
+                    block = image[y : y + tif.tile_size]
+                    block = (block - vmin_) / (vmax_ - vmin_)
+                    block = np.clip(256 * block, 0, 255).astype(np.uint8)
+                    tif.write(lut[block], y, 0)
+            del image
+        return out_path
+
     settings = load_user_settings()
     cmap = args.cmap
     if cmap is None:
@@ -901,6 +992,7 @@ def _render(args):
                         args.scaling,
                         cmap,
                         True,
+                        args.tiled,
                     ),
                 )
 
@@ -917,10 +1009,45 @@ def _render(args):
                 args.scaling,
                 cmap,
                 args.silent,
+                args.tiled,
             ),
         )
 
 
+def _zstack(files, thickness, oversampling, blur_method, min_blur_width):
+    import glob
+
+    paths = glob.glob(files)
+    if paths:
+        import numpy as np
+        from . import io
+
+        if blur_method == "none":
+            blur_method = None
+        kwargs = {
+            "oversampling": oversampling,
+            "blur_method": blur_method,
+            "min_blur_width": min_blur_width,
+        }
+        for path in paths:
+            print("Loading {} ...".format(path))
+            locs, info = io.load_locs(path)
+            if not hasattr(locs, "z"):
+                import sys
+
+                sys.exit(
+                    "Error: {} has no z coordinates. z stacks can only be"
+                    " exported from 3D localizations.".format(path)
+                )
+            # Slices are open below, so the first edge is under min(z)
+            z_edges = thickness * np.arange(
+                np.ceil(locs.z.min() / thickness) - 1,
+                np.ceil(locs.z.max() / thickness) + 1,
+            )
+            base, ext = os.path.splitext(path)
+            io.save_stack(base + "_zstack.tif", locs, info, z_edges, kwargs)
+
+
 def main():
     import argparse
 
@@ -1191,6 +1318,15 @@ def main():
         choices=["mle", "lq", "lq-gpu", "lq-3d", "lq-gpu-3d", "avg"],
         default="mle",
     )
+    localize_parser.add_argument(
+        "--fit-backend",
+        choices=["auto", "gpufit", "cpu"],
+        default="auto",
+        help=(
+            "backend for lq-gpu and lq-gpu-3d; auto uses GPUfit if it is"
+            " installed and its CPU implementation otherwise"
+        ),
+    )
     localize_parser.add_argument(
         "-g", "--gradient", type=int, default=5000, help="minimum net gradient"
     )
@@ -1289,6 +1425,50 @@ def main():
         action="store_true",
         help="do not open the image file",
     )
+    render_parser.add_argument(
+        "-t",
+        "--tiled",
+        action="store_true",
+        help=(
+            "render tile by tile into a BigTIFF, for images that do not"
+            " fit into memory"
+        ),
+    )
+
+    # z stack
+    zstack_parser = subparsers.add_parser(
+        "zstack", help="render the z slices of 3D localizations into a tif"
+    )
+    zstack_parser.add_argument(
+        "files",
+        help=(
+            "one or multiple hdf5 localization files"
+            " specified by a unix style path pattern"
+        ),
+    )
+    zstack_parser.add_argument(
+        "thickness", type=float, help="the thickness of the z slices"
+    )
+    zstack_parser.add_argument(
+        "-o",
+        "--oversampling",
+        type=float,
+        default=1.0,
+        help="the number of super-resolution pixels per camera pixels",
+    )
+    zstack_parser.add_argument(
+        "-b",
+        "--blur-method",
+        choices=["none", "convolve", "gaussian"],
+        default="convolve",
+    )
+    zstack_parser.add_argument(
+        "-w",
+        "--min-blur-width",
+        type=float,
+        default=0.0,
+        help="minimum blur width if blur is applied",
+    )
 
     # design
     subparsers.add_parser("design", help="design RRO DNA origami structures")
@@ -1389,6 +1569,14 @@ def main():
             )
         elif args.command == "density":
             _density(args.files, args.radius)
+        elif args.command == "zstack":
+            _zstack(
+                args.files,
+                args.thickness,
+                args.oversampling,
+                args.blur_method,
+                args.min_blur_width,
+            )
         elif args.command == "dbscan":
             _dbscan(args.files, args.radius, args.density)
         elif args.command == "nneighbor":
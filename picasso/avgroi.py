@@ -10,10 +10,7 @@
 
 from scipy import optimize as _optimize
 import numpy as _np
-from tqdm import tqdm as _tqdm
 import numba as _numba
-import multiprocessing as _multiprocessing
-from concurrent import futures as _futures
 from . import postprocess as _postprocess
 
 
@@ -27,6 +24,81 @@ def _sum(spot, size):
     return _sum_
 
 
+@_numba.jit(nopython=True, nogil=True)
+def _roi_sums(frame, y, x, box):
+    """
+    Sums the box around each identification and averages the pixels on
+    the box border as local background, straight from the frame.
+    """
+    r = int(box / 2)
+    n = len(x)
+    sums = _np.zeros(n, dtype=_np.float32)
+    bgs = _np.zeros(n, dtype=_np.float32)
+    n_border = 4 * (box - 1)
+    for k in range(n):
+        yc = y[k]
+        xc = x[k]
+        roi_sum = 0.0
+        border_sum = 0.0
+        for i in range(yc - r, yc + r + 1):
+            for j in range(xc - r, xc + r + 1):
+                value = frame[i, j]
+                roi_sum += value
+                if i == yc - r or i == yc + r or j == xc - r or j == xc + r:
+                    border_sum += value
+        sums[k] = roi_sum
+        bgs[k] = border_sum / n_border
+    return sums, bgs
+
+
+def photometry_in_frame(frame, y, x, box, camera_info):
+    """
+    Returns the ROI sum and the local background per pixel, both in
+    photons, for identifications at y, x in one frame. The net signal is
+    photons - box**2 * bg.
+    """
+    sums, bgs = _roi_sums(frame, y, x, box)
+    factor = camera_info["sensitivity"] / (
+        camera_info["gain"] * camera_info["qe"]
+    )
+    baseline = camera_info["baseline"]
+    photons = (sums - box * box * baseline) * factor
+    bg = (bgs - baseline) * factor
+    return photons, bg
+
+
+def photometry(movie, identifications, box, camera_info):
+    """
+    ROI photometry for all identifications without cutting out spots.
+    Assumes that identifications are sorted by frame.
+    """
+    photons = _np.empty(len(identifications), dtype=_np.float32)
+    bg = _np.empty(len(identifications), dtype=_np.float32)
+    frames = identifications.frame
+    bounds = _np.searchsorted(frames, _np.arange(len(movie) + 1))
+    for frame_number, (start, stop) in enumerate(
+        zip(bounds[:-1], bounds[1:])
+    ):
+        if start == stop:
+            continue
+        photons[start:stop], bg[start:stop] = photometry_in_frame(
+            movie[frame_number],
+            identifications.y[start:stop],
+            identifications.x[start:stop],
+            box,
+            camera_info,
+        )
+    return photons, bg
+
+
+def locs_from_photometry(identifications, photons, bg, box, em):
+    theta = _np.zeros((len(identifications), 6), dtype=_np.float32)
+    theta[:, 2] = photons
+    theta[:, 3] = bg
+    theta[:, 4:] = 1
+    return locs_from_fits(identifications, theta, box, em)
+
+
 def fit_spot(spot):
     size = spot.shape[0]
     avg_roi = _sum(spot, size)
@@ -43,34 +115,6 @@ def fit_spots(spots):
     return theta
 
 
-def fit_spots_parallel(spots, asynch=False):
-    n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
-    n_spots = len(spots)
-    n_tasks = 100 * n_workers
-    spots_per_task = [
-        int(n_spots / n_tasks + 1)
-        if _ < n_spots % n_tasks
-        else int(n_spots / n_tasks)
-        for _ in range(n_tasks)
-    ]
-    start_indices = _np.cumsum([0] + spots_per_task[:-1])
-    fs = []
-    executor = _futures.ProcessPoolExecutor(n_workers)
-    for i, n_spots_task in zip(start_indices, spots_per_task):
-        fs.append(executor.submit(fit_spots, spots[i: i + n_spots_task]))
-    if asynch:
-        return fs
-    with _tqdm(total=n_tasks, unit="task") as progress_bar:
-        for f in _futures.as_completed(fs):
-            progress_bar.update()
-    return fits_from_futures(fs)
-
-
-def fits_from_futures(futures):
-    theta = [_.result() for _ in futures]
-    return _np.vstack(theta)
-
-
 def locs_from_fits(identifications, theta, box, em):
     # box_offset = int(box/2)
     x = theta[:, 0] + identifications.x  # - box_offset
@@ -11,9 +11,9 @@
 
 from scipy import optimize as _optimize
 import numpy as _np
+import time as _time
 from tqdm import tqdm as _tqdm
 import numba as _numba
-import multiprocessing as _multiprocessing
 from concurrent import futures as _futures
 from . import postprocess as _postprocess
 
@@ -25,6 +25,10 @@ except ImportError:
     gpufit_installed = False
 
 
+# Gpufit model id of the elliptical 2D Gaussian, used by the CPU backend
+GAUSS_2D_ELLIPTIC = 2
+
+
 @_numba.jit(nopython=True, nogil=True)
 def _gaussian(mu, sigma, grid):
     norm = 0.3989422804014327 / sigma
@@ -128,6 +132,176 @@ def _compute_residuals(
     return residuals.flatten()
 
 
+@_numba.jit(nopython=True, nogil=True)
+def _lm_chi2_and_jacobian(theta, spot, grid, size, jac, residuals):
+    """
+    Computes the residuals and the analytic Jacobian of the elliptical
+    Gaussian model with respect to theta = [x, y, photons, bg, sx, sy].
+    """
+    x, y, n, bg, sx, sy = theta
+    gx = _np.empty(size)
+    gy = _np.empty(size)
+    dgx_dx = _np.empty(size)
+    dgy_dy = _np.empty(size)
+    dgx_dsx = _np.empty(size)
+    dgy_dsy = _np.empty(size)
+    for k in range(size):
+        ux = (grid[k] - x) / sx
+        uy = (grid[k] - y) / sy
+        gx[k] = 0.3989422804014327 / sx * _np.exp(-0.5 * ux * ux)
+        gy[k] = 0.3989422804014327 / sy * _np.exp(-0.5 * uy * uy)
+        dgx_dx[k] = gx[k] * ux / sx
+        dgy_dy[k] = gy[k] * uy / sy
+        dgx_dsx[k] = gx[k] * (ux * ux - 1.0) / sx
+        dgy_dsy[k] = gy[k] * (uy * uy - 1.0) / sy
+    chi2 = 0.0
+    for i in range(size):
+        for j in range(size):
+            k = i * size + j
+            r = spot[i, j] - (n * gy[i] * gx[j] + bg)
+            residuals[k] = r
+            chi2 += r * r
+            jac[k, 0] = n * gy[i] * dgx_dx[j]
+            jac[k, 1] = n * dgy_dy[i] * gx[j]
+            jac[k, 2] = gy[i] * gx[j]
+            jac[k, 3] = 1.0
+            jac[k, 4] = n * gy[i] * dgx_dsx[j]
+            jac[k, 5] = n * dgy_dsy[i] * gx[j]
+    return chi2
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _lm_chi2(theta, spot, grid, size):
+    x, y, n, bg, sx, sy = theta
+    gx = _np.empty(size)
+    gy = _np.empty(size)
+    for k in range(size):
+        ux = (grid[k] - x) / sx
+        uy = (grid[k] - y) / sy
+        gx[k] = 0.3989422804014327 / sx * _np.exp(-0.5 * ux * ux)
+        gy[k] = 0.3989422804014327 / sy * _np.exp(-0.5 * uy * uy)
+    chi2 = 0.0
+    for i in range(size):
+        for j in range(size):
+            r = spot[i, j] - (n * gy[i] * gx[j] + bg)
+            chi2 += r * r
+    return chi2
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _solve_6x6(A, b, delta):
+    """ Gaussian elimination with partial pivoting, A and b are modified """
+    for c in range(6):
+        p = c
+        for r in range(c + 1, 6):
+            if abs(A[r, c]) > abs(A[p, c]):
+                p = r
+        if A[p, c] == 0.0:
+            return False
+        if p != c:
+            for k in range(6):
+                A[c, k], A[p, k] = A[p, k], A[c, k]
+            b[c], b[p] = b[p], b[c]
+        for r in range(c + 1, 6):
+            f = A[r, c] / A[c, c]
+            for k in range(c, 6):
+                A[r, k] -= f * A[c, k]
+            b[r] -= f * b[c]
+    for c in range(5, -1, -1):
+        s = b[c]
+        for k in range(c + 1, 6):
+            s -= A[c, k] * delta[k]
+        delta[c] = s / A[c, c]
+    return True
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _fit_spot_lm(spot, size, size_half, eps, max_it, theta_out):
+    """
+    Levenberg-Marquardt fit of a single spot with an analytic Jacobian.
+    Writes [x, y, photons, bg, sx, sy] into theta_out and returns the
+    number of iterations.
+    """
+    n_pixels = size * size
+    grid = _np.empty(size)
+    for k in range(size):
+        grid[k] = k - size_half
+    theta = _initial_parameters(spot, size, size_half).astype(_np.float64)
+    jac = _np.empty((n_pixels, 6))
+    residuals = _np.empty(n_pixels)
+    JtJ = _np.empty((6, 6))
+    Jtr = _np.empty(6)
+    A = _np.empty((6, 6))
+    b = _np.empty(6)
+    delta = _np.empty(6)
+    theta_new = _np.empty(6)
+    lam = 1e-3
+    chi2 = _lm_chi2_and_jacobian(theta, spot, grid, size, jac, residuals)
+    it = 0
+    while it < max_it:
+        it += 1
+        for p in range(6):
+            s = 0.0
+            for k in range(n_pixels):
+                s += jac[k, p] * residuals[k]
+            Jtr[p] = s
+            for q in range(p, 6):
+                s = 0.0
+                for k in range(n_pixels):
+                    s += jac[k, p] * jac[k, q]
+                JtJ[p, q] = s
+                JtJ[q, p] = s
+        accepted = False
+        while lam < 1e10:
+            for p in range(6):
+                for q in range(6):
+                    A[p, q] = JtJ[p, q]
+                A[p, p] += lam * max(JtJ[p, p], 1e-12)
+                b[p] = Jtr[p]
+            if _solve_6x6(A, b, delta):
+                for p in range(6):
+                    theta_new[p] = theta[p] + delta[p]
+                if theta_new[4] > 0.0 and theta_new[5] > 0.0:
+                    chi2_new = _lm_chi2(theta_new, spot, grid, size)
+                    if chi2_new <= chi2:
+                        accepted = True
+                        break
+            lam *= 10.0
+        if not accepted:
+            break
+        lam = max(lam / 10.0, 1e-10)
+        step = 0.0
+        norm = 0.0
+        for p in range(6):
+            step += delta[p] * delta[p]
+            norm += theta_new[p] * theta_new[p]
+            theta[p] = theta_new[p]
+        converged = (chi2 - chi2_new) <= eps * chi2 or step <= (
+            eps * eps * norm
+        )
+        chi2 = _lm_chi2_and_jacobian(theta, spot, grid, size, jac, residuals)
+        if converged:
+            break
+    for p in range(6):
+        theta_out[p] = theta[p]
+    return it
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def fit_spots_lm(spots, eps=1e-3, max_it=100):
+    """
+    Fits all spots in parallel with a compiled Levenberg-Marquardt solver.
+    Returns theta with the same layout as fit_spot: [x, y, photons, bg, sx,
+    sy], positions relative to the spot center.
+    """
+    n_spots, size, _ = spots.shape
+    size_half = int(size / 2)
+    theta = _np.empty((n_spots, 6), dtype=_np.float32)
+    for i in _numba.prange(n_spots):
+        _fit_spot_lm(spots[i], size, size_half, eps, max_it, theta[i])
+    return theta
+
+
 def fit_spot(spot):
     size = spot.shape[0]
     size_half = int(size / 2)
@@ -156,28 +330,25 @@ def fit_spot(spot):
 
 
 def fit_spots(spots):
-    theta = _np.empty((len(spots), 6), dtype=_np.float32)
-    theta.fill(_np.nan)
-    for i, spot in enumerate(spots):
-        theta[i] = fit_spot(spot)
-    return theta
+    if len(spots) == 0:
+        return _np.empty((0, 6), dtype=_np.float32)
+    return fit_spots_lm(_np.ascontiguousarray(spots, dtype=_np.float32))
 
 
 def fit_spots_parallel(spots, asynch=False):
-    n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
+    """
+    The compiled solver is already parallel, so the spots are fitted in
+    consecutive chunks by a single background thread; the chunk futures are
+    only used for progress reporting.
+    """
     n_spots = len(spots)
-    n_tasks = 100 * n_workers
-    spots_per_task = [
-        int(n_spots / n_tasks + 1)
-        if _ < n_spots % n_tasks
-        else int(n_spots / n_tasks)
-        for _ in range(n_tasks)
-    ]
-    start_indices = _np.cumsum([0] + spots_per_task[:-1])
+    n_tasks = max(1, min(100, n_spots))
+    start_indices = _np.linspace(0, n_spots, n_tasks + 1).astype(int)
     fs = []
-    executor = _futures.ProcessPoolExecutor(n_workers)
-    for i, n_spots_task in zip(start_indices, spots_per_task):
-        fs.append(executor.submit(fit_spots, spots[i: i + n_spots_task]))
+    executor = _futures.ThreadPoolExecutor(1)
+    for i, j in zip(start_indices[:-1], start_indices[1:]):
+        fs.append(executor.submit(fit_spots, spots[i:j]))
+    executor.shutdown(wait=False)
     if asynch:
         return fs
     with _tqdm(total=n_tasks, unit="task") as progress_bar:
@@ -186,13 +357,207 @@ def fit_spots_parallel(spots, asynch=False):
     return fits_from_futures(fs)
 
 
-def fit_spots_gpufit(spots):
+@_numba.jit(nopython=True, nogil=True)
+def _fit_gauss_2d_elliptic(
+    data, weights, size, initial, tolerance, max_it, fit_mask, parameters
+):
+    """
+    Fits one spot with the GAUSS_2D_ELLIPTIC model of Gpufit,
+    [amplitude, x0, y0, sx, sy, bg], where x is the column and y the row.
+    Mirrors the Gpufit Levenberg-Marquardt iteration: one trial step per
+    iteration, converged if the chi-square change is below
+    tolerance * max(1, chi-square). Returns state, chi-square, iterations.
+    """
+    n_points = size * size
+    theta = _np.empty(6)
+    theta_new = _np.empty(6)
+    for p in range(6):
+        theta[p] = initial[p]
+    jac = _np.empty((n_points, 6))
+    residuals = _np.empty(n_points)
+    ex = _np.empty(size)
+    ey = _np.empty(size)
+    JtJ = _np.empty((6, 6))
+    Jtr = _np.empty(6)
+    A = _np.empty((6, 6))
+    b = _np.empty(6)
+    delta = _np.empty(6)
+
+    def chi2_of(theta, with_jacobian):
+        a, x0, y0, sx, sy, bg = theta
+        for k in range(size):
+            ex[k] = _np.exp(-0.5 * ((k - x0) / sx) ** 2)
+            ey[k] = _np.exp(-0.5 * ((k - y0) / sy) ** 2)
+        chi2 = 0.0
+        for i in range(size):
+            dy = i - y0
+            for j in range(size):
+                dx = j - x0
+                k = i * size + j
+                e = ex[j] * ey[i]
+                r = data[k] - (a * e + bg)
+                chi2 += weights[k] * r * r
+                if with_jacobian:
+                    residuals[k] = r
+                    jac[k, 0] = e
+                    jac[k, 1] = a * e * dx / sx ** 2
+                    jac[k, 2] = a * e * dy / sy ** 2
+                    jac[k, 3] = a * e * dx * dx / sx ** 3
+                    jac[k, 4] = a * e * dy * dy / sy ** 3
+                    jac[k, 5] = 1.0
+        return chi2
+
+    lam = 1e-3
+    chi2 = chi2_of(theta, True)
+    state = 1
+    it = 0
+    while it < max_it:
+        it += 1
+        for p in range(6):
+            s = 0.0
+            for k in range(n_points):
+                s += weights[k] * jac[k, p] * residuals[k]
+            Jtr[p] = s
+            for q in range(p, 6):
+                s = 0.0
+                for k in range(n_points):
+                    s += weights[k] * jac[k, p] * jac[k, q]
+                JtJ[p, q] = s
+                JtJ[q, p] = s
+        for p in range(6):
+            for q in range(6):
+                if fit_mask[p] and fit_mask[q]:
+                    A[p, q] = JtJ[p, q]
+                else:
+                    A[p, q] = 1.0 if p == q else 0.0
+            if fit_mask[p]:
+                A[p, p] *= 1.0 + lam
+                b[p] = Jtr[p]
+            else:
+                b[p] = 0.0
+        if not _solve_6x6(A, b, delta):
+            state = 2
+            break
+        for p in range(6):
+            theta_new[p] = theta[p] + delta[p]
+        if theta_new[3] <= 0.0 or theta_new[4] <= 0.0:
+            lam *= 10.0
+            continue
+        chi2_new = chi2_of(theta_new, False)
+        if chi2_new > chi2:
+            lam *= 10.0
+            continue
+        lam /= 10.0
+        for p in range(6):
+            theta[p] = theta_new[p]
+        converged = abs(chi2 - chi2_new) < tolerance * max(1.0, chi2_new)
+        chi2 = chi2_of(theta, True)
+        if converged:
+            state = 0
+            break
+    for p in range(6):
+        parameters[p] = theta[p]
+    return state, chi2, it
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _fit_gauss_2d_elliptic_batch(
+    data,
+    weights,
+    size,
+    initial_parameters,
+    tolerance,
+    max_it,
+    fit_mask,
+    parameters,
+    states,
+    chi_squares,
+    number_iterations,
+):
+    for i in _numba.prange(len(data)):
+        states[i], chi_squares[i], number_iterations[i] = (
+            _fit_gauss_2d_elliptic(
+                data[i],
+                weights[i],
+                size,
+                initial_parameters[i],
+                tolerance,
+                max_it,
+                fit_mask,
+                parameters[i],
+            )
+        )
+
+
+def fit_cpu(
+    data,
+    weights,
+    model_id,
+    initial_parameters,
+    tolerance=1e-4,
+    max_number_iterations=25,
+    parameters_to_fit=None,
+):
+    """
+    CPU implementation of the Gpufit batch fit (pygpufit.gpufit.fit) for
+    hosts without a GPU. Only GAUSS_2D_ELLIPTIC with the least squares
+    estimator is supported. Returns parameters, states, chi_squares,
+    number_iterations and exec_time like Gpufit.
+    """
+    if model_id != GAUSS_2D_ELLIPTIC:
+        raise ValueError("Only GAUSS_2D_ELLIPTIC is available on the CPU.")
+    t0 = _time.time()
+    data = _np.ascontiguousarray(data, dtype=_np.float32)
+    n_fits, n_points = data.shape
+    size = int(round(_np.sqrt(n_points)))
+    if size * size != n_points:
+        raise ValueError("Data points do not form a square spot.")
+    if weights is None:
+        weights = _np.ones((1, n_points), dtype=_np.float32)
+        weights = _np.broadcast_to(weights, data.shape)
+    else:
+        weights = _np.ascontiguousarray(weights, dtype=_np.float32)
+    if parameters_to_fit is None:
+        fit_mask = _np.ones(6, dtype=_np.bool_)
+    else:
+        fit_mask = _np.asarray(parameters_to_fit, dtype=_np.bool_)
+    initial_parameters = _np.ascontiguousarray(
+        initial_parameters, dtype=_np.float32
+    )
+    parameters = _np.empty((n_fits, 6), dtype=_np.float32)
+    states = _np.empty(n_fits, dtype=_np.int32)
+    chi_squares = _np.empty(n_fits, dtype=_np.float32)
+    number_iterations = _np.empty(n_fits, dtype=_np.int32)
+    _fit_gauss_2d_elliptic_batch(
+        data,
+        weights,
+        size,
+        initial_parameters,
+        tolerance,
+        max_number_iterations,
+        fit_mask,
+        parameters,
+        states,
+        chi_squares,
+        number_iterations,
+    )
+    exec_time = _time.time() - t0
+    return parameters, states, chi_squares, number_iterations, exec_time
+
+
+def fit_spots_gpufit(spots, backend="gpufit"):
     size = spots.shape[1]
     initial_parameters = initial_parameters_gpufit(spots, size)
     spots.shape = (len(spots), (size * size))
-    model_id = gf.ModelID.GAUSS_2D_ELLIPTIC
 
-    parameters, states, chi_squares, number_iterations, exec_time = gf.fit(
+    if backend == "gpufit":
+        fit, model_id = gf.fit, gf.ModelID.GAUSS_2D_ELLIPTIC
+    elif backend == "cpu":
+        fit, model_id = fit_cpu, GAUSS_2D_ELLIPTIC
+    else:
+        raise ValueError("Unknown fit backend: {}".format(backend))
+
+    parameters, states, chi_squares, number_iterations, exec_time = fit(
         spots,
         None,
         model_id,
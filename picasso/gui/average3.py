@@ -788,7 +788,7 @@ class Window(QtGui.QMainWindow):
         for i in range(n_channels):
             if self.dataset_dialog.checks[i].isChecked():
                 renderings.append(
-                    render.render_hist3d(
+                    render.render_hist3d_sparse(
                         locs[i],
                         oversampling,
                         self.t_min,
@@ -801,7 +801,7 @@ class Window(QtGui.QMainWindow):
                     )
                 )
         n_locs = sum([_[0] for _ in renderings])
-        images = np.array([_[1] for _ in renderings])
+        images = [_[1] for _ in renderings]
 
         pixmap1 = self.pixmap_from_colors(images, colors, 2)
         pixmap2 = self.pixmap_from_colors(images, colors, 0)
@@ -811,9 +811,9 @@ class Window(QtGui.QMainWindow):
 
     def pixmap_from_colors(self, images, colors, axisval):
         if axisval == 2:
-            image = [np.sum(_, axis=axisval) for _ in images]
+            image = [_.project(axisval) for _ in images]
         else:
-            image = [np.transpose(np.sum(_, axis=axisval)) for _ in images]
+            image = [np.transpose(_.project(axisval)) for _ in images]
         image = np.array([self.scale_contrast(_) for _ in image])
         Y, X = image.shape[1:]
         bgra = np.zeros((Y, X, 4), dtype=np.float32)
@@ -865,7 +865,7 @@ class Window(QtGui.QMainWindow):
 
     def translate(self, translateaxis):
         renderings = [
-            render.render_hist3d(
+            render.render_hist3d_sparse(
                 _,
                 self.oversampling,
                 self.t_min,
@@ -879,16 +879,16 @@ class Window(QtGui.QMainWindow):
             for _ in self.locs
         ]
         n_locs = sum([_[0] for _ in renderings])
-        images = np.array([_[1] for _ in renderings])
+        images = [_[1] for _ in renderings]
 
         if translateaxis == "x":
-            image = [np.sum(_, axis=2) for _ in images]
+            image = [_.project(2) for _ in images]
             signalimg = [np.sum(_, axis=0) for _ in image]
         elif translateaxis == "y":
-            image = [np.sum(_, axis=2) for _ in images]
+            image = [_.project(2) for _ in images]
             signalimg = [np.sum(_, axis=1) for _ in image]
         elif translateaxis == "z":
-            image = [np.sum(_, axis=1) for _ in images]
+            image = [_.project(1) for _ in images]
             signalimg = [np.sum(_, axis=0) for _ in image]
 
         fig = plt.figure(figsize=(5, 5))
@@ -1150,7 +1150,7 @@ class Window(QtGui.QMainWindow):
             )
 
         renderings = [
-            render.render_hist3d(
+            render.render_hist3d_sparse(
                 _,
                 self.oversampling,
                 self.t_min,
@@ -1165,21 +1165,21 @@ class Window(QtGui.QMainWindow):
         ]
 
         n_locs = sum([_[0] for _ in renderings])
-        images = np.array([_[1] for _ in renderings])
+        images = [_[1] for _ in renderings]
 
         # DELIVER CORRECT PROJECTION FOR IMAGE
         proplane = []
 
         if self.xy_projbtn.isChecked():
             proplane = "xy"
-            image = [np.sum(_, axis=2) for _ in images]
+            image = [_.project(2) for _ in images]
         elif self.yz_projbtn.isChecked():
             proplane = "yz"
-            image = [np.sum(_, axis=1) for _ in images]
+            image = [_.project(1) for _ in images]
             image = [_.transpose() for _ in image]
         elif self.xz_projbtn.isChecked():
             proplane = "xz"
-            image = [(np.sum(_, axis=0)) for _ in images]
+            image = [_.project(0) for _ in images]
             image = [_.transpose() for _ in image]
 
         # Change CFiamge for symmetry
@@ -1289,7 +1289,7 @@ class Window(QtGui.QMainWindow):
             )
 
         renderings = [
-            render.render_hist3d(
+            render.render_hist3d_sparse(
                 _,
                 self.oversampling,
                 self.t_min,
@@ -1303,24 +1303,24 @@ class Window(QtGui.QMainWindow):
             for _ in self.locs
         ]
         n_locs = sum([_[0] for _ in renderings])
-        images = np.array([_[1] for _ in renderings])
+        images = [_[1] for _ in renderings]
 
         # DELIVER CORRECT PROJECTION FOR IMAGE
         proplane = []
         if self.xy_projbtn.isChecked():
 
             proplane = "xy"
-            image = [np.sum(_, axis=2) for _ in images]
+            image = [_.project(2) for _ in images]
         elif self.yz_projbtn.isChecked():
 
             proplane = "yz"
 
-            image = [np.sum(_, axis=1) for _ in images]
+            image = [_.project(1) for _ in images]
             image = [_.transpose() for _ in image]
         elif self.xz_projbtn.isChecked():
 
             proplane = "xz"
-            image = [(np.sum(_, axis=0)) for _ in images]
+            image = [_.project(0) for _ in images]
             image = [_.transpose() for _ in image]
 
         if self.radio_sym.isChecked():
@@ -1428,12 +1428,12 @@ class Window(QtGui.QMainWindow):
 
     def projectPlanes(self, images, proplane):
         if proplane == "xy":
-            image = [np.sum(_, axis=2) for _ in images]
+            image = [_.project(2) for _ in images]
         elif proplane == "yz":
-            image = [np.sum(_, axis=1) for _ in images]
+            image = [_.project(1) for _ in images]
             image = [_.transpose() for _ in image]
         elif proplane == "xz":
-            image = [(np.sum(_, axis=0)) for _ in images]
+            image = [_.project(0) for _ in images]
             image = [_.transpose() for _ in image]
 
         return image
@@ -1505,7 +1505,7 @@ class Window(QtGui.QMainWindow):
         n_groups = self.group_index[0].shape[0]
 
         renderings = [
-            render.render_hist3d(
+            render.render_hist3d_sparse(
                 _,
                 self.oversampling,
                 self.t_min,
@@ -1519,11 +1519,12 @@ class Window(QtGui.QMainWindow):
             for _ in self.locs
         ]
         n_locs = sum([_[0] for _ in renderings])
-        # Make an average and not a sum image here..
-        images = np.array([_[1] / n_groups for _ in renderings])
+        images = [_[1] for _ in renderings]
 
         # DELIVER CORRECT PROJECTION FOR IMAGE
         image = self.projectPlanes(images, proplane)
+        # Make an average and not a sum image here..
+        image = [_ / n_groups for _ in image]
 
         n_channels = len(image)
 
@@ -2008,9 +2009,8 @@ class Window(QtGui.QMainWindow):
             n_locs = self.n_locs
             image = self.image
         else:
-            renderings = [render.render(_, **kwargs) for _ in locs]
-            n_locs = sum([_[0] for _ in renderings])
-            image = np.array([_[1] for _ in renderings])
+            n_locs, image = render.render_multi(locs, **kwargs)
+            n_locs = int(n_locs.sum())
         if cache:
             self.n_locs = n_locs
             self.image = image
@@ -504,7 +504,7 @@ class ParametersDialog(QtGui.QDialog):
         self.gpufit_checkbox.stateChanged.connect(self.on_gpufit_changed)
 
         if not gpufit_installed:
-            self.gpufit_checkbox.hide()
+            self.gpufit_checkbox.setText("Use GPUfit (CPU implementation)")
         lq_grid.addWidget(self.gpufit_checkbox)
 
         fit_stack.addWidget(lq_widget)
@@ -799,6 +799,10 @@ class Window(QtGui.QMainWindow):
         #: A numpy.recarray of identifcations with fields frame, x and y
         self.identifications = None
 
+        #: The camera parameters of the ROI photometry measured during the
+        #: last identification, or None
+        self.photometry_camera_info = None
+
         self.ready_for_fit = False
 
         self.locs = None
@@ -1342,6 +1346,7 @@ class Window(QtGui.QMainWindow):
             ).format(n_identifications, box, mng)
             self.status_bar.showMessage(message)
             self.identifications = identifications
+            self.photometry_camera_info = self.identificaton_worker.camera_info
             self.ready_for_fit = True
             self.draw_frame()
             if fit_afterwards:
@@ -1360,10 +1365,19 @@ class Window(QtGui.QMainWindow):
             max_it = self.parameters_dialog.max_it.value()
             fit_z = self.parameters_dialog.fit_z_checkbox.isChecked()
             use_gpufit = self.parameters_dialog.gpufit_checkbox.isChecked()
+            identifications = self.identifications
+            if (
+                "photons" in identifications.dtype.names
+                and self.photometry_camera_info != self.camera_info
+            ):
+                # The camera parameters changed after identification
+                identifications = lib.remove_from_rec(
+                    identifications, ["photons", "bg"]
+                )
             self.fit_worker = FitWorker(
                 self.movie,
                 self.camera_info,
-                self.identifications,
+                identifications,
                 self.parameters["Box Size"],
                 method,
                 eps,
@@ -1519,6 +1533,12 @@ class IdentificationWorker(QtCore.QThread):
         self.movie = window.movie
         self.roi = window.view.roi
         self.parameters = window.parameters
+        # ROI photometry for avg is measured while identifying
+        fit_method = window.parameters_dialog.fit_method.currentText()
+        if fit_method == "Average of ROI":
+            self.camera_info = window.camera_info
+        else:
+            self.camera_info = None
         self.fit_afterwards = fit_afterwards
         self.calibrate_z = calibrate_z
 
@@ -1529,6 +1549,7 @@ class IdentificationWorker(QtCore.QThread):
             self.parameters["Min. Net Gradient"],
             self.parameters["Box Size"],
             self.roi,
+            self.camera_info,
         )
         while curr[0] < N:
             self.progressMade.emit(curr[0], self.parameters)
@@ -1577,13 +1598,18 @@ class FitWorker(QtCore.QThread):
     def run(self):
         N = len(self.identifications)
         t0 = time.time()
-        spots = localize.get_spots(
-            self.movie, self.identifications, self.box, self.camera_info
-        )
+        if self.method != "avg":
+            spots = localize.get_spots(
+                self.movie, self.identifications, self.box, self.camera_info
+            )
         if self.method == "lq":
             if self.use_gpufit:
                 self.progressMade.emit(1, 1)
-                theta = gausslq.fit_spots_gpufit(spots)
+                if gpufit_installed:
+                    backend = "gpufit"
+                else:
+                    backend = "cpu"
+                theta = gausslq.fit_spots_gpufit(spots, backend=backend)
                 em = self.camera_info["gain"] > 1
                 locs = gausslq.locs_from_fits_gpufit(
                     self.identifications, theta, self.box, em
@@ -1617,19 +1643,21 @@ class FitWorker(QtCore.QThread):
                 self.box,
             )
         elif self.method == "avg":
-            print("Average intensity")
-            # just get out the average intensity
-            fs = avgroi.fit_spots_parallel(spots, asynch=True)
-            n_tasks = len(fs)
-            while lib.n_futures_done(fs) < n_tasks:
-                self.progressMade.emit(
-                    round(N * lib.n_futures_done(fs) / n_tasks), N
+            if "photons" in self.identifications.dtype.names:
+                photons = self.identifications.photons
+                bg = self.identifications.bg
+            else:
+                # Loaded picks or identifications for another fit method
+                # still need the ROI sums from the frames
+                photons, bg = avgroi.photometry(
+                    self.movie,
+                    self.identifications,
+                    self.box,
+                    self.camera_info,
                 )
-                time.sleep(0.2)
-            theta = avgroi.fits_from_futures(fs)
             em = self.camera_info["gain"] > 1
-            locs = avgroi.locs_from_fits(
-                self.identifications, theta, self.box, em
+            locs = avgroi.locs_from_photometry(
+                self.identifications, photons, bg, self.box, em
             )
         else:
             print("This should never happen...")
@@ -45,6 +45,9 @@ INITIAL_REL_MAXIMUM = 0.5
 ZOOM = 10 / 7
 N_GROUP_COLORS = 8
 N_Z_COLORS = 32
+# Larger exports are rendered tile by tile into a BigTIFF
+MAX_EXPORT_PIXELS = 2 ** 28
+EXPORT_TILE_SHAPE = 2048
 
 matplotlib.rcParams.update({"axes.titlesize": "large"})
 
@@ -2130,80 +2133,38 @@ class SlicerDialog(QtGui.QDialog):
 
         if path:
             base, ext = os.path.splitext(path)
-
-            if self.seperateCheck.isChecked():
-                # Uncheck all
-                for checks in self.window.dataset_dialog.checks:
-                    checks.setChecked(False)
-                for j in range(len(self.window.view.locs)):
-                    self.window.dataset_dialog.checks[j].setChecked(True)
-
-                    progress = lib.ProgressDialog(
-                        "Exporting slices..", 0, self.sl.maximum(), self
+            view = self.window.view
+            if self.fullCheck.isChecked():
+                movie_height, movie_width = view.movie_size()
+                viewport = [(0, 0), (movie_height, movie_width)]
+            else:
+                viewport = view.viewport
+            kwargs = view.get_render_kwargs(viewport=viewport)
+            n_channels = len(view.locs)
+            if self.seperateCheck.isChecked() or n_channels == 1:
+                exports = [
+                    (
+                        view.locs[j],
+                        base + "_CH" + "{num:03d}".format(num=j + 1) + ".tif",
                     )
-                    progress.set_value(0)
-                    progress.show()
-                    for i in tqdm(range(self.sl.maximum() + 1)):
-                        self.sl.setValue(i)
-                        print("Slide: " + str(i))
-                        out_path = (
-                            base
-                            + "_Z"
-                            + "{num:03d}".format(num=i)
-                            + "_CH"
-                            + "{num:03d}".format(num=j + 1)
-                            + ".tif"
-                        )
-                        if self.fullCheck.isChecked():
-                            movie_height, movie_width = (
-                                self.window.view.movie_size()
-                            )
-                            viewport = [(0, 0), (movie_height, movie_width)]
-                            qimage = self.window.view.render_scene(
-                                cache=False, viewport=viewport
-                            )
-                            gray = qimage.convertToFormat(
-                                QtGui.QImage.Format_RGB16
-                            )
-                        else:
-                            gray = self.window.view.qimage.convertToFormat(
-                                QtGui.QImage.Format_RGB16
-                            )
-                        gray.save(out_path)
-                        progress.set_value(i)
-                    progress.close()
-                    self.window.dataset_dialog.checks[j].setChecked(False)
-                for checks in self.window.dataset_dialog.checks:
-                    checks.setChecked(True)
+                    for j in range(n_channels)
+                ]
             else:
+                # One hyperstack, ordered by slice, then channel
+                exports = [(view.locs, base + ".tif")]
+            for locs, out_path in exports:
                 progress = lib.ProgressDialog(
-                    "Exporting slices..", 0, self.sl.maximum(), self
+                    "Exporting slices..", 0, len(self.bins) - 1, self
                 )
                 progress.set_value(0)
-                progress.show()
-
-                for i in tqdm(range(self.sl.maximum() + 1)):
-                    self.sl.setValue(i)
-                    print("Slide: " + str(i))
-                    out_path = (
-                        base
-                        + "_Z"
-                        + "{num:03d}".format(num=i)
-                        + "_CH001"
-                        + ".tif"
-                    )
-                    if self.fullCheck.isChecked():
-                        movie_height, movie_width = (
-                            self.window.view.movie_size()
-                        )
-                        viewport = [(0, 0), (movie_height, movie_width)]
-                        qimage = self.window.view.render_scene(
-                            cache=False, viewport=viewport
-                        )
-                        qimage.save(out_path)
-                    else:
-                        self.window.view.qimage.save(out_path)
-                    progress.set_value(i)
+                io.save_stack(
+                    out_path,
+                    locs,
+                    view.infos[0],
+                    self.bins,
+                    kwargs,
+                    callback=progress.set_value,
+                )
                 progress.close()
 
 
@@ -2233,11 +2194,17 @@ class View(QtGui.QLabel):
         self._picks = []
         self._points = []
         self.index_blocks = []
+        self.tile_indices = []
+        self.pyramids = []
+        self._pan_state = None
+        self._bgra = None
         self._drift = []
         self._driftfiles = []
         self.currentdrift = []
-        self.x_render_cache = []
         self.x_render_state = False
+        self.x_render_property = None
+        self.z_render = False
+        self.t_render = False
 
     def is_consecutive(l):
         setl = set(l)
@@ -2262,6 +2229,8 @@ class View(QtGui.QLabel):
         self.infos.append(info)
         self.locs_paths.append(path)
         self.index_blocks.append(None)
+        self.tile_indices.append(None)
+        self.pyramids.append(None)
 
         drift = None
         # Try to load a driftfile:
@@ -2429,6 +2398,7 @@ class View(QtGui.QLabel):
                     locs_.z -= shift[2][i]
                 # Cleanup
                 self.index_blocks[i] = None
+                self.tile_indices[i] = None
                 sp.set_value(i + 1)
 
             self.update_scene()
@@ -2466,6 +2436,7 @@ class View(QtGui.QLabel):
                         completed = False
                     locs_.y -= shift[0][i]
                     locs_.x -= shift[1][i]
+                    self.tile_indices[i] = None
 
                     temp_shift_x.append(shift[1][i])
                     temp_shift_y.append(shift[0][i])
@@ -3260,6 +3231,11 @@ class View(QtGui.QLabel):
         viewport_height, viewport_width = self.viewport_size()
         x_move = dx * viewport_width
         y_move = dy * viewport_height
+        if self._pan_state is not None:
+            # Pan by whole pixels, so that the last image can be shifted
+            oversampling = self._pan_state[0]["oversampling"]
+            x_move = np.round(x_move * oversampling) / oversampling
+            y_move = np.round(y_move * oversampling) / oversampling
         x_min = self.viewport[0][1] - x_move
         x_max = self.viewport[1][1] - x_move
         y_min = self.viewport[0][0] - y_move
@@ -4149,38 +4125,9 @@ class View(QtGui.QLabel):
     def filter_picks(self):
         channel = self.get_channel("Pick similar")
         if channel is not None:
-            locs = self.locs[channel]
-            info = self.infos[channel]
-            d = self.window.tools_settings_dialog.pick_diameter.value()
-            r = d / 2
-            std_range = (
-                self.window.tools_settings_dialog.pick_similar_range.value()
-            )
-            index_blocks = self.get_index_blocks(channel)
-            n_locs = []
-            rmsd = []
-
             if self._picks:
-                removelist = []
-                loccount = []
-                progress = lib.ProgressDialog(
-                    "Counting in picks..", 0, len(self._picks) - 1, self
-                )
-                progress.set_value(0)
-                progress.show()
-                for i, pick in enumerate(self._picks):
-                    x, y = pick
-                    block_locs = postprocess.get_block_locs_at(
-                        x, y, index_blocks
-                    )
-                    pick_locs = lib.locs_at(x, y, block_locs, r)
-                    locs = stack_arrays(
-                        pick_locs, asrecarray=True, usemask=False
-                    )
-                    loccount.append(len(locs))
-                    progress.set_value(i)
-
-                progress.close()
+                picked_locs = self.picked_locs(channel)
+                loccount = np.array([len(_) for _ in picked_locs])
                 fig = plt.figure()
                 fig.canvas.set_window_title("Localizations in Picks")
                 ax = fig.add_subplot(111)
@@ -4217,24 +4164,14 @@ class View(QtGui.QLabel):
                         "Enter maximum number of localizations:",
                     )
                     if ok2:
-                        progress = lib.ProgressDialog(
-                            "Removing picks..", 0, len(self._picks) - 1, self
-                        )
-                        progress.set_value(0)
-                        progress.show()
-                        for i, pick in enumerate(self._picks):
-
-                            if loccount[i] > maxlocs:
-                                removelist.append(pick)
-                            elif loccount[i] < minlocs:
-                                removelist.append(pick)
-                            progress.set_value(i)
-
-                for pick in removelist:
-                    self._picks.remove(pick)
+                        keep = (loccount >= minlocs) & (loccount <= maxlocs)
+                        self._picks = [
+                            pick
+                            for pick, keep_ in zip(self._picks, keep)
+                            if keep_
+                        ]
                 self.n_picks = len(self._picks)
                 self.update_pick_info_short()
-                progress.close()
                 self.update_scene()
 
     def rmsd_at_com(self, locs):
@@ -4251,20 +4188,125 @@ class View(QtGui.QLabel):
         info = self.infos[channel]
         d = self.window.tools_settings_dialog.pick_diameter.value()
         size = d / 2
-        K, L = postprocess.index_blocks_shape(info, size)
-        progress = lib.ProgressDialog("Indexing localizations", 0, K, self)
-        progress.show()
-        progress.set_value(0)
-        index_blocks = postprocess.get_index_blocks(
-            locs, info, size, progress.set_value
+        self.index_blocks[channel] = postprocess.get_index_blocks(
+            locs, info, size
         )
-        self.index_blocks[channel] = index_blocks
 
     def get_index_blocks(self, channel):
         if self.index_blocks[channel] is None:
             self.index_locs(channel)
         return self.index_blocks[channel]
 
+    def get_tile_index(self, channel):
+        """
+        Returns the spatial tile index used to render only the
+        localizations in the viewport. It is built once per channel and
+        rebuilt when the localizations of the channel are replaced.
+        """
+        locs = self.locs[channel]
+        cached = self.tile_indices[channel]
+        if cached is None or cached[0] is not locs:
+            tile_index = render.get_tile_index(locs, self.infos[channel])
+            max_blur_width = max(np.max(locs.lpx), np.max(locs.lpy))
+            self.tile_indices[channel] = (locs, tile_index, max_blur_width)
+        return self.tile_indices[channel][1]
+
+    def locs_in_viewport(self, channel, viewport):
+        """
+        Returns the localizations of a channel in the tiles that
+        intersect the viewport.
+        """
+        tile_index = self.get_tile_index(channel)
+        return render.tile_index_locs(tile_index, viewport)
+
+    def get_pyramid(self, channel):
+        """
+        Returns the image pyramid of a channel. A new pyramid is started
+        whenever the tile index of the channel was rebuilt, and its
+        levels are rendered in the background.
+        """
+        tile_index = self.get_tile_index(channel)
+        pyramid = self.pyramids[channel]
+        if pyramid is None or pyramid.tile_index is not tile_index:
+            if pyramid is not None:
+                pyramid.cancel()
+            pyramid = render.ImagePyramid(tile_index)
+            pyramid.build_async(self.display_pixels_per_viewport_pixels())
+            self.pyramids[channel] = pyramid
+        return pyramid
+
+    def render_pyramids(self, kwargs):
+        """
+        Returns the renderings of all channels composed from their image
+        pyramids, or None if the view needs exact rendering.
+        """
+        if kwargs["blur_method"] is not None:
+            return None
+        if self.window.slicer_dialog.slicerRadioButton.isChecked():
+            if any([hasattr(_, "z") for _ in self.locs]):
+                return None
+        renderings = []
+        for channel in range(len(self.locs)):
+            rendering = self.get_pyramid(channel).render(
+                kwargs["viewport"], kwargs["oversampling"]
+            )
+            if rendering is None:
+                return None
+            renderings.append(rendering)
+        return renderings
+
+    def render_pan(self, kwargs):
+        """
+        Returns the renderings of all channels updated from the last
+        rendering, if the viewport was only panned by whole pixels since.
+        Only the newly exposed strips are rendered. Returns None if the
+        last rendering can not be reused.
+        """
+        if self._pan_state is None:
+            return None
+        if self.window.slicer_dialog.slicerRadioButton.isChecked():
+            if any([hasattr(_, "z") for _ in self.locs]):
+                return None
+        last_kwargs, tile_indices, last_renderings = self._pan_state
+        if len(tile_indices) != len(self.locs):
+            return None
+        for key in ["blur_method", "min_blur_width"]:
+            if kwargs[key] != last_kwargs[key]:
+                return None
+        if not np.isclose(
+            kwargs["oversampling"], last_kwargs["oversampling"], rtol=1e-9
+        ):
+            return None
+        renderings = []
+        for channel, tile_index in enumerate(tile_indices):
+            if self.get_tile_index(channel) is not tile_index:
+                return None
+            n_locs, image = last_renderings[channel]
+            rendering = render.render_pan(
+                image,
+                n_locs,
+                tile_index,
+                last_kwargs["viewport"],
+                kwargs["viewport"],
+                kwargs["oversampling"],
+                blur_method=kwargs["blur_method"],
+                min_blur_width=kwargs["min_blur_width"],
+                max_blur_width=self.tile_indices[channel][2],
+            )
+            if rendering is None:
+                return None
+            renderings.append(rendering)
+        return renderings
+
+    def set_pan_state(self, kwargs, renderings):
+        """ Remembers a rendering of all channels for render_pan """
+        if self.window.slicer_dialog.slicerRadioButton.isChecked():
+            if any([hasattr(_, "z") for _ in self.locs]):
+                self._pan_state = None
+                return
+        tile_indices = [self.get_tile_index(_) for _ in range(len(self.locs))]
+        self._pan_state = (kwargs, tile_indices, renderings)
+
     @check_picks
     def pick_similar(self):
         if self._pick_shape == "Rectangle":
@@ -4273,170 +4315,47 @@ class View(QtGui.QLabel):
             )
         channel = self.get_channel("Pick similar")
         if channel is not None:
-            locs = self.locs[channel]
-            info = self.infos[channel]
             d = self.window.tools_settings_dialog.pick_diameter.value()
-            r = d / 2
             std_range = (
                 self.window.tools_settings_dialog.pick_similar_range.value()
             )
-            index_blocks = self.get_index_blocks(channel)
-            n_locs = []
-            rmsd = []
-            for i, pick in enumerate(self._picks):
-                x, y = pick
-                block_locs = postprocess.get_block_locs_at(x, y, index_blocks)
-                pick_locs = lib.locs_at(x, y, block_locs, r)
-                n_locs.append(len(pick_locs))
-                rmsd.append(self.rmsd_at_com(pick_locs))
-            mean_n_locs = np.mean(n_locs)
-            mean_rmsd = np.mean(rmsd)
-            std_n_locs = np.std(n_locs)
-            std_rmsd = np.std(rmsd)
-            min_n_locs = mean_n_locs - std_range * std_n_locs
-            max_n_locs = mean_n_locs + std_range * std_n_locs
-            min_rmsd = mean_rmsd - std_range * std_rmsd
-            max_rmsd = mean_rmsd + std_range * std_rmsd
-            # x, y coordinates of found similar regions:
-            x_similar = np.array([_[0] for _ in self._picks])
-            y_similar = np.array([_[1] for _ in self._picks])
-            # preparations for hex grid search
-            x_range = np.arange(d / 2, info[0]["Width"], np.sqrt(3) * d / 2)
-            y_range_base = np.arange(d / 2, info[0]["Height"] - d / 2, d)
-            y_range_shift = y_range_base + d / 2
-            d2 = d ** 2
-            nx = len(x_range)
-            locs, size, x_index, y_index, block_starts, block_ends, K, L = (
-                index_blocks
+            status = lib.StatusDialog("Picking similar...", self)
+            similar = postprocess.pick_similar(
+                self.locs[channel],
+                self.infos[channel],
+                self._picks,
+                d,
+                std_range,
+                index_blocks=self.get_index_blocks(channel),
             )
-            progress = lib.ProgressDialog("Pick similar", 0, nx, self)
-            progress.set_value(0)
-            for i, x_grid in enumerate(x_range):
-                # y_grid is shifted for odd columns
-                if i % 2:
-                    y_range = y_range_shift
-                else:
-                    y_range = y_range_base
-                for y_grid in y_range:
-                    n_block_locs = postprocess.n_block_locs_at(
-                        x_grid, y_grid, size, K, L, block_starts, block_ends
-                    )
-                    if n_block_locs > min_n_locs:
-                        block_locs = postprocess.get_block_locs_at(
-                            x_grid, y_grid, index_blocks
-                        )
-                        picked_locs = lib.locs_at(
-                            x_grid, y_grid, block_locs, r
-                        )
-                        if len(picked_locs) > 1:
-                            # Move to COM peak
-                            x_test_old = x_grid
-                            y_test_old = y_grid
-                            x_test = picked_locs.x.mean()
-                            y_test = picked_locs.y.mean()
-                            while (
-                                np.abs(x_test - x_test_old) > 1e-3
-                                or np.abs(y_test - y_test_old) > 1e-3
-                            ):
-                                x_test_old = x_test
-                                y_test_old = y_test
-                                picked_locs = lib.locs_at(
-                                    x_test, y_test, block_locs, r
-                                )
-                                x_test = picked_locs.x.mean()
-                                y_test = picked_locs.y.mean()
-                            if np.all(
-                                (x_similar - x_test) ** 2
-                                + (y_similar - y_test) ** 2
-                                > d2
-                            ):
-                                if min_n_locs < len(picked_locs) < max_n_locs:
-                                    if (
-                                        min_rmsd
-                                        < self.rmsd_at_com(picked_locs)
-                                        < max_rmsd
-                                    ):
-                                        x_similar = np.append(
-                                            x_similar, x_test
-                                        )
-                                        y_similar = np.append(
-                                            y_similar, y_test
-                                        )
-                progress.set_value(i + 1)
-            similar = list(zip(x_similar, y_similar))
+            status.close()
             self._picks = []
-            self.add_picks(similar)
+            self.add_picks([tuple(_) for _ in similar])
 
     def picked_locs(self, channel, add_group=True):
         """ Returns picked localizations in the specified channel """
 
         if len(self._picks):
-            picked_locs = []
-            progress = lib.ProgressDialog(
-                "Creating localization list", 0, len(self._picks), self
-            )
-            progress.set_value(0)
             if self._pick_shape == "Circle":
-                d = self.window.tools_settings_dialog.pick_diameter.value()
-                r = d / 2
-                index_blocks = self.get_index_blocks(channel)
-                for i, pick in enumerate(self._picks):
-                    x, y = pick
-                    block_locs = postprocess.get_block_locs_at(
-                        x, y, index_blocks
-                    )
-                    group_locs = lib.locs_at(x, y, block_locs, r)
-                    if add_group:
-                        group = i * np.ones(len(group_locs), dtype=np.int32)
-                        group_locs = lib.append_to_rec(
-                            group_locs, group, "group"
-                        )
-                    group_locs.sort(kind="mergesort", order="frame")
-                    picked_locs.append(group_locs)
-                    progress.set_value(i + 1)
+                size = self.window.tools_settings_dialog.pick_diameter.value()
             elif self._pick_shape == "Rectangle":
-                w = self.window.tools_settings_dialog.pick_width.value()
-                channel_locs = self.locs[channel]
-                for i, pick in enumerate(self._picks):
-                    (xs, ys), (xe, ye) = pick
-                    X, Y = self.get_pick_rectangle_corners(xs, ys, xe, ye, w)
-                    x_min = min(X)
-                    x_max = max(X)
-                    y_min = min(Y)
-                    y_max = max(Y)
-                    group_locs = channel_locs[channel_locs.x > x_min]
-                    group_locs = group_locs[group_locs.x < x_max]
-                    group_locs = group_locs[group_locs.y > y_min]
-                    group_locs = group_locs[group_locs.y < y_max]
-                    group_locs = lib.locs_in_rectangle(group_locs, X, Y)
-                    # store rotated coordinates in x_rot and y_rot
-                    angle = 0.5 * np.pi - np.arctan2((ye - ys), (xe - xs))
-                    x_shifted = group_locs.x - xs
-                    y_shifted = group_locs.y - ys
-                    x_pick_rot = x_shifted * np.cos(
-                        angle
-                    ) - y_shifted * np.sin(angle)
-                    y_pick_rot = x_shifted * np.sin(
-                        angle
-                    ) + y_shifted * np.cos(angle)
-                    group_locs = lib.append_to_rec(
-                        group_locs, x_pick_rot, "x_pick_rot"
-                    )
-                    group_locs = lib.append_to_rec(
-                        group_locs, y_pick_rot, "y_pick_rot"
-                    )
-                    if add_group:
-                        group = i * np.ones(len(group_locs), dtype=np.int32)
-                        group_locs = lib.append_to_rec(
-                            group_locs, group, "group"
-                        )
-                    group_locs.sort(kind="mergesort", order="frame")
-                    picked_locs.append(group_locs)
-                    progress.set_value(i + 1)
+                size = self.window.tools_settings_dialog.pick_width.value()
             else:
                 raise ValueError("Invalid value for pick shape")
-
-            return picked_locs
+            locs = self.locs[channel]
+            if self._pick_shape == "Circle":
+                # Circle picks only hold sane localizations, as in the
+                # block index
+                locs = lib.ensure_sanity(locs, self.infos[channel])
+            locs = postprocess.pick_locs(
+                locs, self._picks, self._pick_shape, size
+            )
+            # Split into one array per pick
+            n_picks = len(self._picks)
+            bounds = np.searchsorted(locs.group, np.arange(1, n_picks))
+            if not add_group:
+                locs = lib.remove_from_rec(locs, "group")
+            return np.split(locs, bounds)
 
     def remove_picks(self, position):
         x, y = position
@@ -4472,13 +4391,26 @@ class View(QtGui.QLabel):
         self.update_scene()
 
     def render_scene(
-        self, autoscale=False, use_cache=False, cache=True, viewport=None
+        self,
+        autoscale=False,
+        use_cache=False,
+        cache=True,
+        viewport=None,
+        blur_widths=None,
     ):
         kwargs = self.get_render_kwargs(viewport=viewport)
+        if blur_widths is not None:
+            kwargs["blur_widths"] = blur_widths
+        # Exported images are always rendered exactly
+        use_pyramid = viewport is None
         n_channels = len(self.locs)
         if n_channels == 1:
             self.render_single_channel(
-                kwargs, autoscale=autoscale, use_cache=use_cache, cache=cache
+                kwargs,
+                autoscale=autoscale,
+                use_cache=use_cache,
+                cache=cache,
+                use_pyramid=use_pyramid,
             )
         else:
             self.render_multi_channel(
@@ -4487,6 +4419,7 @@ class View(QtGui.QLabel):
                 use_cache=use_cache,
                 cache=cache,
                 plot_channels=True,
+                use_pyramid=use_pyramid,
             )
         self._bgra[:, :, 3].fill(255)
         Y, X = self._bgra.shape[:2]
@@ -4518,9 +4451,19 @@ class View(QtGui.QLabel):
         use_cache=False,
         cache=True,
         plot_channels=False,
+        use_pyramid=False,
     ):
+        renderings = None
+        pan_state = locs is None and use_pyramid and cache
         if locs is None:
-            locs = self.locs
+            if use_pyramid and not use_cache:
+                renderings = self.render_pyramids(kwargs)
+                if renderings is None:
+                    renderings = self.render_pan(kwargs)
+            locs = [
+                self.locs_in_viewport(_, kwargs["viewport"])
+                for _ in range(len(self.locs))
+            ]
         # Plot each channel
         if plot_channels:
             locsall = locs.copy()
@@ -4538,42 +4481,36 @@ class View(QtGui.QLabel):
             if use_cache:
                 n_locs = self.n_locs
                 image = self.image
-            else:
-                renderings = []
-                for i in range(len(self.locs)):
-                    # We render all images first
-                    # and later decide to keep them or not
-                    renderings.append(render.render(locsall[i], **kwargs))
-                renderings = [render.render(_, **kwargs) for _ in locsall]
+            elif renderings is not None:
                 n_locs = sum([_[0] for _ in renderings])
                 image = np.array([_[1] for _ in renderings])
+            else:
+                # We render all images first
+                # and later decide to keep them or not
+                n_locs, image = render.render_multi(locsall, **kwargs)
+                renderings = list(zip(n_locs, image))
+                n_locs = int(n_locs.sum())
         else:
             n_channels = len(locs)
             colors = get_colors(n_channels)
             if use_cache:
                 n_locs = self.n_locs
                 image = self.image
-            else:
-
-                pb = lib.ProgressDialog("Rendering.. ", 0, n_channels, self)
-                pb.set_value(0)
-                renderings = []
-                for i in tqdm(range(n_channels)):
-                    renderings.append(render.render(locs[i], **kwargs))
-                    pb.set_value(i + 1)
-                pb.close()
-
-                # renderings = [render.render(_, **kwargs) for _ in locs]
+            elif renderings is not None:
                 n_locs = sum([_[0] for _ in renderings])
                 image = np.array([_[1] for _ in renderings])
+            else:
+                n_locs, image = render.render_multi(locs, **kwargs)
+                renderings = list(zip(n_locs, image))
+                n_locs = int(n_locs.sum())
 
         if cache:
             self.n_locs = n_locs
             self.image = image
+        if pan_state and not use_cache:
+            self.set_pan_state(kwargs, renderings)
 
-        image = self.scale_contrast(image)
-        Y, X = image.shape[1:]
-        bgra = np.zeros((Y, X, 4), dtype=np.float32)
+        lower, upper = self.contrast_limits(image)
 
         # Color images
         for i in range(len(self.locs)):
@@ -4631,31 +4568,73 @@ class View(QtGui.QLabel):
                 inverted = tuple([1 - _ for _ in tempcolor])
                 colors[i] = inverted
 
+            # Intensity and visibility are applied through the color
             iscale = self.window.dataset_dialog.intensitysettings[i].value()
-            image[i] = iscale * image[i]
             if not self.window.dataset_dialog.checks[i].isChecked():
-                image[i] = 0 * image[i]
+                iscale = 0
+            colors[i] = tuple([iscale * _ for _ in colors[i]])
 
-        for color, image in zip(colors, image):
-            bgra[:, :, 0] += color[2] * image
-            bgra[:, :, 1] += color[1] * image
-            bgra[:, :, 2] += color[0] * image
+        self._bgra = render.to_bgra(
+            image,
+            lower,
+            upper,
+            colors[: len(image)],
+            out=self._bgra if cache else None,
+            invert=self.window.dataset_dialog.wbackground.isChecked(),
+        )
+        return self._bgra
 
-        bgra = np.minimum(bgra, 1)
-        if self.window.dataset_dialog.wbackground.isChecked():
-            bgra = -(bgra - 1)
-        self._bgra = self.to_8bit(bgra)
+    def render_property(
+        self, kwargs, autoscale=False, use_cache=False, cache=True
+    ):
+        """
+        Renders the first channel colored by x_render_property, which is
+        (parameter, value_range, n_colors)
+        """
+        if "blur_widths" in kwargs:
+            kwargs = dict(kwargs, blur_widths=kwargs["blur_widths"][0])
+        if use_cache:
+            n_locs = self.n_locs
+            image = self.image
+        else:
+            parameter, value_range, n_colors = self.x_render_property
+            locs = self.locs_in_viewport(0, kwargs["viewport"])
+            n_locs, image = render.render_colormap(
+                locs,
+                locs[parameter],
+                value_range,
+                get_colors(n_colors)[:n_colors],
+                **kwargs,
+            )
+        if cache:
+            self.n_locs = n_locs
+            self.image = image
+        # The blue, green and red planes of the rendering
+        image = np.moveaxis(image[:, :, :3], 2, 0)
+        lower, upper = self.contrast_limits(image, autoscale=autoscale)
+        self._bgra = render.to_bgra(
+            image,
+            lower,
+            upper,
+            [(0, 0, 1), (0, 1, 0), (1, 0, 0)],
+            out=self._bgra if cache else None,
+            invert=self.window.dataset_dialog.wbackground.isChecked(),
+        )
         return self._bgra
 
     def render_single_channel(
-        self, kwargs, autoscale=False, use_cache=False, cache=True
+        self,
+        kwargs,
+        autoscale=False,
+        use_cache=False,
+        cache=True,
+        use_pyramid=False,
     ):
         locs = self.locs[0]
 
         if self.x_render_state:
-            locs = self.x_locs
-            return self.render_multi_channel(
-                kwargs, autoscale=autoscale, locs=locs, use_cache=use_cache
+            return self.render_property(
+                kwargs, autoscale=autoscale, use_cache=use_cache, cache=cache
             )
 
         if hasattr(locs, "group"):
@@ -4664,6 +4643,7 @@ class View(QtGui.QLabel):
                 kwargs, autoscale=autoscale, locs=locs, use_cache=use_cache
             )
 
+        locs = self.locs_in_viewport(0, kwargs["viewport"])
         if hasattr(locs, "z"):
             if self.window.slicer_dialog.slicerRadioButton.isChecked():
                 z_min = self.window.slicer_dialog.slicermin
@@ -4671,28 +4651,147 @@ class View(QtGui.QLabel):
                 in_view = (locs.z > z_min) & (locs.z <= z_max)
                 locs = locs[in_view]
 
+        renderings = None
+        if use_pyramid and not use_cache:
+            renderings = self.render_pyramids(kwargs)
+            if renderings is None:
+                renderings = self.render_pan(kwargs)
         if use_cache:
             n_locs = self.n_locs
             image = self.image
+        elif renderings is not None:
+            n_locs, image = renderings[0]
         else:
+            if "blur_widths" in kwargs:
+                kwargs = dict(kwargs, blur_widths=kwargs["blur_widths"][0])
             n_locs, image = render.render(locs, **kwargs)
         if cache:
             self.n_locs = n_locs
             self.image = image
-        image = self.scale_contrast(image, autoscale=autoscale)
-        image = self.to_8bit(image)
-        Y, X = image.shape
+        if use_pyramid and cache and not use_cache:
+            self.set_pan_state(kwargs, [(n_locs, image)])
+        lower, upper = self.contrast_limits(image, autoscale=autoscale)
         cmap = self.window.display_settings_dlg.colormap.currentText()
         cmap = np.uint8(np.round(255 * plt.get_cmap(cmap)(np.arange(256))))
-        self._bgra = np.zeros((Y, X, 4), dtype=np.uint8, order="C")
-        self._bgra[..., 0] = cmap[:, 2][image]
-        self._bgra[..., 1] = cmap[:, 1][image]
-        self._bgra[..., 2] = cmap[:, 0][image]
+        self._bgra = render.to_bgra_lut(
+            image,
+            lower,
+            upper,
+            cmap[:, :3],
+            out=self._bgra if cache else None,
+        )
         return self._bgra
 
     def resizeEvent(self, event):
         self.update_scene()
 
+    def export_tiled(self, path, viewport):
+        """
+        Renders the viewport tile by tile and writes the tiles to a
+        BigTIFF, so that the full image never has to fit into memory. The
+        tiles are rendered with a halo of the blur width and the blur
+        widths of the whole viewport, as in render.render_tiled.
+        """
+        kwargs = self.get_render_kwargs(viewport=viewport)
+        oversampling = kwargs["oversampling"]
+        blur_widths = self.export_blur_widths(kwargs)
+        max_blur_width = 0
+        if blur_widths is not None:
+            # Convolve blurs with the widths in view
+            for widths in blur_widths:
+                if widths is not None:
+                    max_blur_width = max(
+                        max_blur_width, max(widths) / oversampling
+                    )
+        else:
+            for channel in range(len(self.locs)):
+                self.get_tile_index(channel)
+                max_blur_width = max(
+                    max_blur_width, self.tile_indices[channel][2]
+                )
+        halo = render.blur_halo(
+            oversampling,
+            kwargs["blur_method"],
+            kwargs["min_blur_width"],
+            max_blur_width,
+        )
+        n_pixel_y, n_pixel_x = render.image_shape(viewport, oversampling)
+        tiles = list(
+            render.tile_viewports(
+                viewport, oversampling, EXPORT_TILE_SHAPE, halo
+            )
+        )
+        progress = lib.ProgressDialog("Exporting image", 0, len(tiles), self)
+        progress.set_value(0)
+        with io.TiledTiffWriter(path, n_pixel_y, n_pixel_x) as tif:
+            for i, (bounds, tile_viewport) in enumerate(tiles):
+                i_min, i_max, j_min, j_max = bounds
+                self.render_scene(
+                    cache=False,
+                    viewport=tile_viewport,
+                    blur_widths=blur_widths,
+                )
+                bgra = self._bgra[
+                    halo : halo + i_max - i_min, halo : halo + j_max - j_min
+                ]
+                tif.write(bgra[:, :, 2::-1], i_min, j_min)
+                progress.set_value(i + 1)
+        progress.close()
+        # The tiles replaced the buffer of the displayed scene
+        self.update_scene(use_cache=True)
+
+    def export_blur_widths(self, kwargs):
+        """
+        Returns the convolve blur widths of each rendered channel over
+        all localizations in the viewport of kwargs, as render_scene
+        splits them into channels, or None for other blur methods.
+        """
+        if kwargs["blur_method"] != "convolve":
+            return None
+        viewport = kwargs["viewport"]
+
+        def z_slice(locs):
+            if (
+                hasattr(locs, "z")
+                and self.window.slicer_dialog.slicerRadioButton.isChecked()
+            ):
+                z_min = self.window.slicer_dialog.slicermin
+                z_max = self.window.slicer_dialog.slicermax
+                locs = locs[(locs.z > z_min) & (locs.z <= z_max)]
+            return locs
+
+        if len(self.locs) > 1:
+            locs = [
+                z_slice(self.locs_in_viewport(_, viewport))
+                for _ in range(len(self.locs))
+            ]
+        elif self.x_render_state:
+            locs = self.locs_in_viewport(0, viewport)
+            parameter = self.x_render_property[0]
+            locs = [locs[np.isfinite(locs[parameter])]]
+        elif hasattr(self.locs[0], "group"):
+            locs = self.locs[0]
+            locs = [locs[self.group_color == _] for _ in range(N_GROUP_COLORS)]
+        else:
+            locs = [z_slice(self.locs_in_viewport(0, viewport))]
+        oversampling = kwargs["oversampling"]
+        min_blur_width = kwargs["min_blur_width"]
+        blur_widths = []
+        for locs_ in locs:
+            in_view = render._in_viewport(locs_, viewport)
+            if np.any(in_view):
+                blur_widths.append(
+                    (
+                        oversampling
+                        * max(np.median(locs_.lpy[in_view]), min_blur_width),
+                        oversampling
+                        * max(np.median(locs_.lpx[in_view]), min_blur_width),
+                    )
+                )
+            else:
+                blur_widths.append(None)
+        return blur_widths
+
     def save_picked_locs(self, path, channel):
         locs = self.picked_locs(channel)
         locs = stack_arrays(locs, asrecarray=True, usemask=False)
@@ -4794,7 +4893,11 @@ class View(QtGui.QLabel):
         with open(path, "w") as f:
             yaml.dump(picks, f)
 
-    def scale_contrast(self, image, autoscale=False):
+    def contrast_limits(self, image, autoscale=False):
+        """
+        Returns the lower and upper contrast limits of the display
+        settings, set from the image if autoscale
+        """
         if autoscale:
             if image.ndim == 2:
                 max_ = image.max()
@@ -4810,57 +4913,37 @@ class View(QtGui.QLabel):
         if upper == lower:
             upper = lower + 1 / (10 ** 6)
             self.window.display_settings_dlg.silent_maximum_update(upper)
-
-        image = (image - lower) / (upper - lower)
-        image[~np.isfinite(image)] = 0
-        image = np.minimum(image, 1.0)
-        image = np.maximum(image, 0.0)
-        return image
+        return lower, upper
 
     def render_3d(self):
+        """ Toggles coloring the first channel by z """
         if hasattr(self.locs[0], "z"):
-            if self.z_render is True:
-                self.z_render = False
-            else:
-                self.z_render = True
+            self.t_render = False
+            self.z_render = not self.z_render
+            if self.z_render:
                 mean_z = np.mean(self.locs[0].z)
                 std_z = np.std(self.locs[0].z)
-                min_z = mean_z - 3 * std_z
-                max_z = mean_z + 3 * std_z
-                z_step = (max_z - min_z) / N_Z_COLORS
-                self.z_color = np.floor((self.locs[0].z - min_z) / z_step)
-                z_locs = []
-                if not hasattr(self, "z_locs"):
-                    pb = lib.ProgressDialog(
-                        "Indexing colors", 0, N_Z_COLORS, self
-                    )
-                    pb.set_value(0)
-                    for i in tqdm(range(N_Z_COLORS)):
-                        z_locs.append(self.locs[0][self.z_color == i])
-                        pb.set_value(i)
-                    pb.close()
-                    self.z_locs = z_locs
+                self.x_render_property = (
+                    "z",
+                    (mean_z - 3 * std_z, mean_z + 3 * std_z),
+                    N_Z_COLORS,
+                )
+            self.x_render_state = self.z_render
             self.update_scene()
 
     def render_time(self):
-        if self.t_render is True:
-            self.t_render = False
-        else:
-            self.t_render = True
-
+        """ Toggles coloring the first channel by frame """
+        self.z_render = False
+        self.t_render = not self.t_render
+        if self.t_render:
             min_frames = np.min(self.locs[0].frame)
             max_frames = np.max(self.locs[0].frame)
-            t_step = (max_frames - min_frames) / N_Z_COLORS
-            self.t_color = np.floor((self.locs[0].frame - min_frames) / t_step)
-            t_locs = []
-            if not hasattr(self, "t_locs"):
-                pb = lib.ProgressDialog("Indexing time", 0, N_Z_COLORS, self)
-                pb.set_value(0)
-                for i in tqdm(range(N_Z_COLORS)):
-                    t_locs.append(self.locs[0][self.t_color == i])
-                    pb.set_value(i)
-                pb.close()
-                self.t_locs = t_locs
+            self.x_render_property = (
+                "frame",
+                (min_frames, max_frames),
+                N_Z_COLORS,
+            )
+        self.x_render_state = self.t_render
         self.update_scene()
 
     def show_legend(self):
@@ -4906,52 +4989,13 @@ class View(QtGui.QLabel):
             max_val = self.window.display_settings_dlg.maximum_render.value()
 
             x_step = (max_val - min_val) / colors
-
-            self.x_color = np.floor(
-                (self.locs[0][parameter] - min_val) / x_step
+            # Values above max_val get the last of colors + 1 colors
+            self.x_render_property = (
+                parameter,
+                (min_val, max_val + x_step),
+                colors + 1,
             )
 
-            # values above and below will be fixed:
-            self.x_color[self.x_color < 0] = 0
-            self.x_color[self.x_color > colors] = colors
-
-            x_locs = []
-
-            for cached_entry in self.x_render_cache:
-                if cached_entry["parameter"] == parameter:
-                    if cached_entry["colors"] == colors:
-                        if (cached_entry["min_val"] == min_val) & (
-                            cached_entry["max_val"] == max_val
-                        ):
-                            x_locs = cached_entry["locs"]
-                        break
-
-            if x_locs == []:
-                pb = lib.ProgressDialog(
-                    "Indexing " + parameter, 0, colors, self
-                )
-                pb.set_value(0)
-                for i in tqdm(range(colors + 1)):
-                    x_locs.append(self.locs[0][self.x_color == i])
-                    pb.set_value(i + 1)
-                pb.close()
-
-                entry = {}
-                entry["parameter"] = parameter
-                entry["colors"] = colors
-                entry["locs"] = x_locs
-                entry["min_val"] = min_val
-                entry["max_val"] = max_val
-
-                # Do not store to many datasets in cache
-                if len(self.x_render_cache) < 10:
-                    self.x_render_cache.append(entry)
-                else:
-                    self.x_render_cache.insert(0, entry)
-                    del self.x_render_cache[-1]
-
-            self.x_locs = x_locs
-
             self.update_scene()
 
             self.window.display_settings_dlg.show_legend.setEnabled(True)
@@ -5047,9 +5091,6 @@ class View(QtGui.QLabel):
     def sizeHint(self):
         return QtCore.QSize(*self._size_hint)
 
-    def to_8bit(self, image):
-        return np.round(255 * image).astype("uint8")
-
     def to_left(self):
         self.pan_relative(0, 0.8)
 
@@ -5165,6 +5206,7 @@ class View(QtGui.QLabel):
                     )
                     self.locs[channel] = lib.ensure_sanity(locs, info)
                     self.index_blocks[channel] = None
+                    self.tile_indices[channel] = None
                     self.add_drift(channel, drift)
                     self.update_scene()
                 except Exception as e:
@@ -5260,6 +5302,7 @@ class View(QtGui.QLabel):
 
         # Cleanup
         self.index_blocks[channel] = None
+        self.tile_indices[channel] = None
         self.add_drift(channel, drift)
         status.close()
         self.update_scene()
@@ -5285,6 +5328,7 @@ class View(QtGui.QLabel):
 
         # Cleanup
         self.index_blocks[channel] = None
+        self.tile_indices[channel] = None
         self.add_drift(channel, drift)
         status.close()
         self.update_scene()
@@ -5307,6 +5351,7 @@ class View(QtGui.QLabel):
             drift.z = -drift.z
             self.locs[channel].z -= drift.z[self.locs[channel].frame]
 
+        self.tile_indices[channel] = None
         self.add_drift(channel, drift)
         self.update_scene()
 
@@ -5355,6 +5400,7 @@ class View(QtGui.QLabel):
         if self.unfold_status == "folded":
             if hasattr(self.locs[0], "group"):
                 self.locs[0].x += self.locs[0].group * 2
+                self.tile_indices[0] = None
             groups = np.unique(self.locs[0].group)
 
             if self._picks:
@@ -5408,6 +5454,7 @@ class View(QtGui.QLabel):
 
             self.locs[0].x += offset_x
             self.locs[0].y += offset_y
+            self.tile_indices[0] = None
 
             if self._picks:
                 if self._pick_shape == "Rectangle":
@@ -5438,6 +5485,7 @@ class View(QtGui.QLabel):
     def refold_groups(self):
         if hasattr(self.locs[0], "group"):
             self.locs[0].x -= self.locs[0].group * 2
+            self.tile_indices[0] = None
         groups = np.unique(self.locs[0].group)
         self.fit_in_view()
         self.infos[0][0]["Width"] = self.oldwidth
@@ -5937,8 +5985,28 @@ class Window(QtGui.QMainWindow):
         if path:
             movie_height, movie_width = self.view.movie_size()
             viewport = [(0, 0), (movie_height, movie_width)]
-            qimage = self.view.render_scene(cache=False, viewport=viewport)
-            qimage.save(path)
+            oversampling = self.view.get_render_kwargs()["oversampling"]
+            n_pixel_y, n_pixel_x = render.image_shape(viewport, oversampling)
+            if n_pixel_y * n_pixel_x > MAX_EXPORT_PIXELS:
+                base, ext = os.path.splitext(path)
+                if ext.lower() != ".tif":
+                    path = base + ".tif"
+                    QtGui.QMessageBox.information(
+                        self,
+                        "Large image",
+                        (
+                            "The image is too large for PNG"
+                            " and is saved as tiled BigTIFF to {}.".format(
+                                path
+                            )
+                        ),
+                    )
+                self.view.export_tiled(path, viewport)
+            else:
+                qimage = self.view.render_scene(
+                    cache=False, viewport=viewport
+                )
+                qimage.save(path)
 
     def export_txt(self):
         channel = self.view.get_channel(
@@ -6596,6 +6664,7 @@ class Window(QtGui.QMainWindow):
                 self.view.locs[channel], self.view.infos[channel]
             )
             self.view.index_blocks[channel] = None
+            self.view.tile_indices[channel] = None
             self.view.update_scene()
 
     def open_file_dialog(self):
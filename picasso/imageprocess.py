@@ -7,9 +7,15 @@
     :author: Joerg Schnitzbauer, 2016
     :copyright: Copyright (c) 2016 Jungmann Lab, MPI of Biochemistry
 """
+import multiprocessing as _multiprocessing
+from collections import deque as _deque
+from concurrent import futures as _futures
+
 import matplotlib.pyplot as _plt
+import numba as _numba
 import numpy as _np
 from numpy import fft as _fft
+from scipy import fft as _scipy_fft
 import lmfit as _lmfit
 from tqdm import tqdm as _tqdm
 from . import lib as _lib
@@ -26,14 +32,85 @@ def xcorr(imageA, imageB):
     ) / _np.sqrt(imageA.size)
 
 
-def get_image_shift(imageA, imageB, box, roi=None, display=False):
-    """ Computes the shift from imageA to imageB """
+def rfft2(image):
+    """ The float32 real FFT of an image, to be reused with xcorr_fft """
+    return _scipy_fft.rfft2(_np.asarray(image, dtype=_np.float32))
+
+
+def xcorr_fft(FimageA, FimageB, shape):
+    """ Like xcorr, from the rfft2 of both images of the given shape """
+    XCorr = _scipy_fft.irfft2(FimageA * _np.conj(FimageB), s=shape)
+    return _fft.fftshift(XCorr) / _np.sqrt(XCorr.size)
+
+
+def get_image_shift(
+    imageA,
+    imageB,
+    box,
+    roi=None,
+    display=False,
+    method="gaussian",
+    upsample_factor=None,
+    windowed=False,
+):
+    """
+    Computes the shift from imageA to imageB. method selects the peak
+    estimator, see PEAK_METHODS. With upsample_factor, the peak is refined
+    to 1/upsample_factor pixels by an upsampled DFT of the correlation.
+    windowed evaluates the correlation only around the peak, see
+    windowed_shift, and cannot be combined with upsample_factor.
+    """
+    if windowed and upsample_factor:
+        raise ValueError("upsample_factor requires the FFT correlation.")
     if (_np.sum(imageA) == 0) or (_np.sum(imageB) == 0):
         return 0, 0
     # Compute image correlation
-    XCorr = xcorr(imageA, imageB)
-    # Cut out center roi
-    Y, X = imageA.shape
+    if windowed:
+        shift_y, shift_x, XCorr, Y_, X_ = windowed_shift(
+            pyramid(imageA, roi), pyramid(imageB, roi), roi, method
+        )
+        # Correlation window coordinates for the display
+        yc, xc = -shift_y, -shift_x
+    elif upsample_factor:
+        FimageA, FimageB = rfft2(imageA), rfft2(imageB)
+        XCorr = xcorr_fft(FimageA, FimageB, imageA.shape)
+    else:
+        XCorr = xcorr(imageA, imageB)
+    if not windowed:
+        # Cut out center roi
+        XCorr, Y_, X_ = _crop_roi(XCorr, roi)
+        yc, xc = _fit_peak(XCorr, box, method)
+        # Add offsets
+        xc += X_
+        yc += Y_
+        if upsample_factor:
+            yc, xc = _upsample_peak(
+                FimageA * _np.conj(FimageB),
+                imageA.shape,
+                yc,
+                xc,
+                upsample_factor,
+            )
+
+    if display:
+        _plt.figure(figsize=(17, 10))
+        _plt.subplot(1, 3, 1)
+        _plt.imshow(imageA, interpolation="none")
+        _plt.subplot(1, 3, 2)
+        _plt.imshow(imageB, interpolation="none")
+        _plt.subplot(1, 3, 3)
+        _plt.imshow(XCorr, interpolation="none")
+        _plt.plot(xc - X_, yc - Y_, "x")
+        _plt.show()
+
+    if windowed:
+        return shift_y, shift_x
+    return _peak_shift(yc, xc, imageA.shape)
+
+
+def _crop_roi(XCorr, roi):
+    """ Returns the center roi of XCorr and the offsets of its corner """
+    Y, X = XCorr.shape
     if roi is not None:
         Y_ = int((Y - roi) / 2)
         X_ = int((X - roi) / 2)
@@ -47,6 +124,89 @@ def get_image_shift(imageA, imageB, box, roi=None, display=False):
             X_ = 0
     else:
         Y_ = X_ = 0
+    return XCorr, Y_, X_
+
+
+PEAK_METHODS = ("gaussian", "parabolic", "lmfit")
+
+
+def _fit_peak(XCorr, box, method="gaussian"):
+    """
+    Returns the sub-pixel position of the maximum of XCorr. "gaussian" and
+    "parabolic" interpolate the maximum pixel and its neighbors in closed
+    form along each axis. "lmfit" fits a 2D Gaussian to the box around the
+    maximum, which is slow but kept for validation.
+    """
+    if method == "lmfit":
+        return _fit_peak_lmfit(XCorr, box)
+    if method not in PEAK_METHODS:
+        raise ValueError("Unknown peak method: {}".format(method))
+    y_max_, x_max_ = _np.unravel_index(XCorr.argmax(), XCorr.shape)
+    yc = y_max_ + _interpolate_peak(XCorr[:, x_max_], y_max_, method)
+    xc = x_max_ + _interpolate_peak(XCorr[y_max_, :], x_max_, method)
+    return yc, xc
+
+
+def _interpolate_peak(profile, i, method):
+    """
+    The offset of the vertex through the maximum profile[i] and its two
+    neighbors from i. The Gaussian interpolation fits a parabola to the
+    logarithm of the values and falls back to a parabola if they are not
+    all positive.
+    """
+    if i == 0 or i == len(profile) - 1:
+        return 0.0
+    l, c, r = (float(_) for _ in profile[i - 1: i + 2])
+    if method == "gaussian" and min(l, c, r) > 0:
+        l, c, r = _np.log(l), _np.log(c), _np.log(r)
+    denominator = l - 2 * c + r
+    if denominator >= 0:
+        return 0.0
+    return 0.5 * (l - r) / denominator
+
+
+def _upsample_peak(product, shape, yc, xc, upsample_factor):
+    """
+    Refines the peak at yc, xc of the correlation with the real FFT
+    product (see xcorr_fft) by evaluating its DFT on a grid with
+    1/upsample_factor pixel spacing within 0.75 pixels of the peak. The
+    DFT is computed as two matrix products, following Guizar-Sicairos et
+    al., Opt. Lett. 33, 156 (2008). The maximum of the grid is then
+    interpolated like in _fit_peak.
+    """
+    Y, X = shape
+    n = int(_np.ceil(1.5 * upsample_factor))
+    offsets = (_np.arange(n) - n // 2) / upsample_factor
+    # The lags of the grid, centered on the peak rounded to the grid
+    lag_y = _np.round((yc - _np.floor(Y / 2)) * upsample_factor)
+    lag_x = _np.round((xc - _np.floor(X / 2)) * upsample_factor)
+    lags_y = lag_y / upsample_factor + offsets
+    lags_x = lag_x / upsample_factor + offsets
+    kernel_y = _np.exp(
+        2j * _np.pi * _np.outer(lags_y, _scipy_fft.fftfreq(Y))
+    )
+    # The real FFT holds each frequency but 0 and Nyquist for two
+    weights = _np.full(product.shape[1], 2.0)
+    weights[0] = 1
+    if X % 2 == 0:
+        weights[-1] = 1
+    kernel_x = weights[:, None] * _np.exp(
+        2j * _np.pi * _np.outer(_scipy_fft.rfftfreq(X), lags_x)
+    )
+    upsampled = _np.real(kernel_y @ product @ kernel_x)
+    i, j = _np.unravel_index(upsampled.argmax(), upsampled.shape)
+    # Interpolate between the grid points
+    lag_y = lags_y[i] + (
+        _interpolate_peak(upsampled[:, j], i, "gaussian") / upsample_factor
+    )
+    lag_x = lags_x[j] + (
+        _interpolate_peak(upsampled[i, :], j, "gaussian") / upsample_factor
+    )
+    return lag_y + _np.floor(Y / 2), lag_x + _np.floor(X / 2)
+
+
+def _fit_peak_lmfit(XCorr, box):
+    """ Fits a 2D Gaussian to the box around the maximum of XCorr """
     # A quarter of the fit ROI
     fit_X = int(box / 2)
     # A coordinate grid for the fitting ROI
@@ -76,46 +236,192 @@ def get_image_shift(imageA, imageB, box, roi=None, display=False):
     params.add("b", value=FitROI.min(), vary=True, min=0)
     results = gaussian2d.fit(FitROI.flatten(), params)
 
-    # Get maximum coordinates and add offsets
-    xc = results.best_values["xc"]
-    yc = results.best_values["yc"]
-    xc += X_ + x_max_
-    yc += Y_ + y_max_
+    # Get maximum coordinates
+    xc = results.best_values["xc"] + x_max_
+    yc = results.best_values["yc"] + y_max_
+    return yc, xc
 
-    if display:
-        _plt.figure(figsize=(17, 10))
-        _plt.subplot(1, 3, 1)
-        _plt.imshow(imageA, interpolation="none")
-        _plt.subplot(1, 3, 2)
-        _plt.imshow(imageB, interpolation="none")
-        _plt.subplot(1, 3, 3)
-        _plt.imshow(XCorr, interpolation="none")
-        _plt.plot(xc, yc, "x")
-        _plt.show()
 
+def _peak_shift(yc, xc, shape):
+    """ The shift of a correlation peak at yc, xc from the center """
+    Y, X = shape
     xc -= _np.floor(X / 2)
     yc -= _np.floor(Y / 2)
     return -yc, -xc
 
 
-def rcc(segments, max_shift=None, callback=None):
-    n_segments = len(segments)
+def pyramid(image, roi=None, min_size=16):
+    """
+    The image and its 2x2 binned versions, finest first, for
+    windowed_shift. Binning stops once the drift range, half of roi, is
+    at most 4 pixels or the image would get smaller than min_size.
+    """
+    image = _np.ascontiguousarray(image, dtype=_np.float32)
+    max_shift = max(image.shape) / 2 if roi is None else roi / 2
+    levels = [image]
+    while max_shift > 4 and min(image.shape) >= 2 * min_size:
+        Y, X = image.shape
+        image = image[: Y - Y % 2, : X - X % 2]
+        rows = image[0::2] + image[1::2]
+        image = rows[:, 0::2] + rows[:, 1::2]
+        levels.append(image)
+        max_shift /= 2
+    return levels
+
+
+def windowed_shift(pyramidA, pyramidB, roi=None, method="gaussian"):
+    """
+    Computes the shift from imageA to imageB from their pyramids without
+    the full correlation image. The correlation is evaluated in the
+    spatial domain, for all shifts within the roi only on the coarsest
+    level. Each finer level evaluates the 3x3 neighborhood of the peak
+    from the level above, moving it until the center is the maximum. The
+    cost grows with the drift range and the number of pixels, but not
+    with their product. Returns the shift and the last correlation
+    window, with the lags of its corner.
+    """
+    max_shift = max(pyramidA[0].shape) / 2 if roi is None else roi / 2
+    n_levels = min(len(pyramidA), len(pyramidB))
+    # Search the full drift range on the coarsest level
+    radius = int(_np.ceil(max_shift / 2 ** (n_levels - 1))) + 1
+    window = _xcorr_window(
+        pyramidA[n_levels - 1], pyramidB[n_levels - 1], 0, 0, radius
+    )
+    lag_y = lag_x = 0
+    for level in range(n_levels - 2, -1, -1):
+        # Start from the interpolated peak of the level above
+        yc, xc = _fit_peak(window, 3, "parabolic")
+        lag_y = int(round(2 * (yc + lag_y - radius)))
+        lag_x = int(round(2 * (xc + lag_x - radius)))
+        radius = 2 if (level == 0 and method == "lmfit") else 1
+        window, lag_y, lag_x = _climb_peak(
+            pyramidA[level], pyramidB[level], lag_y, lag_x, radius
+        )
+    y0, x0 = lag_y - radius, lag_x - radius
+    yc, xc = _fit_peak(window, 2 * radius + 1, method)
+    return -(yc + y0), -(xc + x0), window, y0, x0
+
+
+def _climb_peak(imageA, imageB, lag_y, lag_x, radius):
+    """
+    Moves the correlation window around lag_y, lag_x until its maximum is
+    at its center. Returns the window and its center.
+    """
+    max_lag = max(imageA.shape)
+    for _ in range(max_lag):
+        window = _xcorr_window(imageA, imageB, lag_y, lag_x, radius)
+        i, j = _np.unravel_index(window.argmax(), window.shape)
+        if (i == radius and j == radius) or abs(lag_y) + abs(lag_x) > max_lag:
+            break
+        lag_y += i - radius
+        lag_x += j - radius
+    return window, lag_y, lag_x
+
+
+@_numba.jit(nopython=True, nogil=True, fastmath=True)
+def _xcorr_window(imageA, imageB, lag_y, lag_x, radius):
+    """
+    The correlation sum(imageA[y + dy, x + dx] * imageB[y, x]) of the
+    overlapping pixels, like xcorr but without wrapping, for the lags dy,
+    dx within radius of lag_y, lag_x. The result is normalized like xcorr.
+    """
+    Y, X = imageA.shape
+    n = 2 * radius + 1
+    window = _np.zeros((n, n), dtype=_np.float64)
+    norm = 1 / _np.sqrt(Y * X)
+    for i in range(n):
+        dy = lag_y - radius + i
+        y_min = max(0, -dy)
+        y_max = min(Y, Y - dy)
+        for j in range(n):
+            dx = lag_x - radius + j
+            x_min = max(0, -dx)
+            x_max = min(X, X - dx)
+            total = 0.0
+            for y in range(y_min, y_max):
+                rowA = imageA[y + dy, x_min + dx: x_max + dx]
+                rowB = imageB[y, x_min:x_max]
+                # Summed in single precision, so that it is vectorized
+                row = _np.float32(0)
+                for x in range(len(rowB)):
+                    row += rowA[x] * rowB[x]
+                total += row
+            window[i, j] = total * norm
+    return window
+
+
+def rcc(
+    segments,
+    max_shift=None,
+    callback=None,
+    n_segments=None,
+    method="gaussian",
+    upsample_factor=None,
+    windowed=False,
+):
+    """
+    Redundant cross-correlation of all pairs of segment images. segments
+    can also be an iterator, such as render.iter_segments, if n_segments
+    is given. Each segment is then correlated with the previous ones as
+    soon as it arrives. The FFT, or with windowed the pyramid, of each
+    segment is computed once. The pairs are correlated in a thread pool,
+    a few pairs ahead of the progress updates. method, upsample_factor
+    and windowed are passed to the peak estimation, see get_image_shift.
+    """
+    if windowed and upsample_factor:
+        raise ValueError("upsample_factor requires the FFT correlation.")
+    if n_segments is None:
+        n_segments = len(segments)
     shifts_x = _np.zeros((n_segments, n_segments))
     shifts_y = _np.zeros((n_segments, n_segments))
     n_pairs = int(n_segments * (n_segments - 1) / 2)
-    flag = 0
+    n_workers = _multiprocessing.cpu_count()
+    # The FFTs or pyramids of the segments, None for empty segments
+    ffts = []
+    pending = _deque()
+
+    def correlate(i, j, shape):
+        if windowed:
+            return windowed_shift(ffts[i], ffts[j], max_shift, method)[:2]
+        product = ffts[i] * _np.conj(ffts[j])
+        XCorr = _scipy_fft.irfft2(product, s=shape)
+        XCorr = _fft.fftshift(XCorr) / _np.sqrt(XCorr.size)
+        XCorr, Y_, X_ = _crop_roi(XCorr, max_shift)
+        yc, xc = _fit_peak(XCorr, 5, method)
+        yc += Y_
+        xc += X_
+        if upsample_factor:
+            yc, xc = _upsample_peak(product, shape, yc, xc, upsample_factor)
+        return _peak_shift(yc, xc, shape)
+
+    def fit_next():
+        i, j, future = pending.popleft()
+        if future is not None:
+            shifts_y[i, j], shifts_x[i, j] = future.result()
+        progress_bar.update()
+        if callback is not None:
+            callback(progress_bar.n)
+
     with _tqdm(
         total=n_pairs, desc="Correlating image pairs", unit="pairs"
-    ) as progress_bar:
+    ) as progress_bar, _futures.ThreadPoolExecutor(n_workers) as executor:
         if callback is not None:
             callback(0)
-        for i in range(n_segments - 1):
-            for j in range(i + 1, n_segments):
-                progress_bar.update()
-                shifts_y[i, j], shifts_x[i, j] = get_image_shift(
-                    segments[i], segments[j], 5, max_shift
-                )
-                flag += 1
-                if callback is not None:
-                    callback(flag)
+        for j, segment in enumerate(segments):
+            if _np.sum(segment) == 0:
+                ffts.append(None)
+            elif windowed:
+                ffts.append(pyramid(segment, max_shift))
+            else:
+                ffts.append(rfft2(segment))
+            for i in range(j):
+                if ffts[i] is None or ffts[j] is None:
+                    future = None
+                else:
+                    future = executor.submit(correlate, i, j, segment.shape)
+                pending.append((i, j, future))
+                while len(pending) > 2 * n_workers:
+                    fit_next()
+        while pending:
+            fit_next()
     return _lib.minimize_shifts(shifts_x, shifts_y)
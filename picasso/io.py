@@ -19,6 +19,7 @@ import os as _os
 import threading as _threading
 from PyQt4.QtGui import QMessageBox as _QMessageBox
 from . import lib as _lib
+from . import render as _render
 
 
 class NoMetadataFileError(FileNotFoundError):
@@ -480,6 +481,191 @@ class TiffMultiMap:
             map.tofile(file_handle, byte_order)
 
 
+class TiledTiffWriter:
+    """
+    Writes an RGB image as a tiled BigTIFF, one block at a time, so that
+    the image never has to be held in memory as a whole
+    """
+
+    def __init__(self, path, height, width, tile_size=256):
+        if tile_size % 16:
+            raise ValueError("The TIFF tile size must be a multiple of 16.")
+        self.height = height
+        self.width = width
+        self.tile_size = tile_size
+        self.n_tiles_y = -(-height // tile_size)
+        self.n_tiles_x = -(-width // tile_size)
+        n_tiles = self.n_tiles_y * self.n_tiles_x
+        self.tile_offsets = _np.zeros(n_tiles, dtype=_np.uint64)
+        self.tile_byte_counts = _np.zeros(n_tiles, dtype=_np.uint64)
+        self.file = open(path, "wb")
+        # BigTIFF header, the offset of the IFD is filled in on close
+        self.file.write(b"II" + _struct.pack("<HHHQ", 43, 8, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, image, y, x):
+        """
+        Writes a (Y, X, 3) uint8 block with its upper left corner at pixel
+        (y, x), which must lie on the tile grid
+        """
+        T = self.tile_size
+        if y % T or x % T:
+            raise ValueError("Blocks must start on the tile grid.")
+        image = _np.ascontiguousarray(image, dtype=_np.uint8)
+        Y, X = image.shape[:2]
+        for i in range(0, Y, T):
+            for j in range(0, X, T):
+                tile = _np.zeros((T, T, 3), dtype=_np.uint8)
+                block = image[i : i + T, j : j + T]
+                tile[: block.shape[0], : block.shape[1]] = block
+                k = ((y + i) // T) * self.n_tiles_x + (x + j) // T
+                self.tile_offsets[k] = self.file.tell()
+                self.tile_byte_counts[k] = tile.nbytes
+                self.file.write(tile.tobytes())
+
+    def close(self):
+        if self.file.closed:
+            return
+        T = self.tile_size
+        # Tiles that were never written are stored empty
+        empty = _np.zeros((T, T, 3), dtype=_np.uint8).tobytes()
+        for k in _np.flatnonzero(self.tile_byte_counts == 0):
+            self.tile_offsets[k] = self.file.tell()
+            self.tile_byte_counts[k] = len(empty)
+            self.file.write(empty)
+        arrays = []
+        for array in [self.tile_offsets, self.tile_byte_counts]:
+            if len(array) > 1:
+                arrays.append(self.file.tell())
+                self.file.write(array.astype("<u8").tobytes())
+            else:
+                arrays.append(int(array[0]))
+        # Tag, type (3: SHORT, 4: LONG, 16: LONG8), count, value
+        entries = [
+            (256, 4, 1, _struct.pack("<I", self.width)),
+            (257, 4, 1, _struct.pack("<I", self.height)),
+            (258, 3, 3, _struct.pack("<HHH", 8, 8, 8)),
+            (259, 3, 1, _struct.pack("<H", 1)),
+            (262, 3, 1, _struct.pack("<H", 2)),
+            (277, 3, 1, _struct.pack("<H", 3)),
+            (284, 3, 1, _struct.pack("<H", 1)),
+            (322, 4, 1, _struct.pack("<I", T)),
+            (323, 4, 1, _struct.pack("<I", T)),
+            (324, 16, len(self.tile_offsets), _struct.pack("<Q", arrays[0])),
+            (325, 16, len(self.tile_offsets), _struct.pack("<Q", arrays[1])),
+        ]
+        ifd_offset = _write_bigtiff_ifd(self.file, entries, 0)
+        self.file.seek(8)
+        self.file.write(_struct.pack("<Q", ifd_offset))
+        self.file.close()
+
+
+class TiffStackWriter:
+    """
+    Writes images of the same shape and type as the pages of a BigTIFF,
+    one at a time. Pages are (Y, X) integer or float images, or (Y, X, 3)
+    uint8 RGB images.
+    """
+
+    def __init__(self, path):
+        self.pages = []
+        self.file = open(path, "wb")
+        # BigTIFF header, the offset of the first IFD is filled in on close
+        self.file.write(b"II" + _struct.pack("<HHHQ", 43, 8, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, image):
+        image = _np.asarray(image)
+        rgb = image.ndim == 3 and image.shape[2] == 3
+        if rgb and image.dtype != _np.uint8:
+            raise ValueError("RGB pages must be uint8.")
+        if image.ndim != 2 and not rgb:
+            raise ValueError("Pages must be (Y, X) or (Y, X, 3) images.")
+        if image.dtype.kind not in "uif":
+            raise ValueError("Pages must be integer or float images.")
+        image = _np.ascontiguousarray(image, image.dtype.newbyteorder("<"))
+        if self.pages and image.shape != self.pages[0][2]:
+            raise ValueError("All pages must have the same shape.")
+        self.pages.append((self.file.tell(), image.nbytes, image.shape))
+        self.dtype = image.dtype
+        self.file.write(image.tobytes())
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.pages:
+            n_samples = 3 if len(self.pages[0][2]) == 3 else 1
+            bits = 8 * self.dtype.itemsize
+            sample_format = {"u": 1, "i": 2, "f": 3}[self.dtype.kind]
+            photometric = 2 if n_samples == 3 else 1
+            next_offset = 0
+            # The IFDs are written back to front, each pointing to the next
+            for offset, nbytes, shape in self.pages[::-1]:
+                entries = [
+                    (256, 4, 1, _struct.pack("<I", shape[1])),
+                    (257, 4, 1, _struct.pack("<I", shape[0])),
+                    (258, 3, n_samples, _struct.pack("<H", bits) * n_samples),
+                    (259, 3, 1, _struct.pack("<H", 1)),
+                    (262, 3, 1, _struct.pack("<H", photometric)),
+                    (273, 16, 1, _struct.pack("<Q", offset)),
+                    (277, 3, 1, _struct.pack("<H", n_samples)),
+                    (278, 4, 1, _struct.pack("<I", shape[0])),
+                    (279, 16, 1, _struct.pack("<Q", nbytes)),
+                    (284, 3, 1, _struct.pack("<H", 1)),
+                    (
+                        339,
+                        3,
+                        n_samples,
+                        _struct.pack("<H", sample_format) * n_samples,
+                    ),
+                ]
+                next_offset = _write_bigtiff_ifd(
+                    self.file, entries, next_offset
+                )
+            self.file.seek(8)
+            self.file.write(_struct.pack("<Q", next_offset))
+        self.file.close()
+
+
+def _write_bigtiff_ifd(file, entries, next_offset):
+    """
+    Appends a BigTIFF IFD of entries (tag, type, count, value bytes),
+    sorted by tag, and returns its offset
+    """
+    file.seek(0, _os.SEEK_END)
+    ifd_offset = file.tell()
+    file.write(_struct.pack("<Q", len(entries)))
+    for tag, type, count, value in entries:
+        file.write(_struct.pack("<HHQ", tag, type, count))
+        file.write(value.ljust(8, b"\0"))
+    file.write(_struct.pack("<Q", next_offset))
+    return ifd_offset
+
+
+def save_stack(path, locs, info, z_edges, kwargs={}, callback=None):
+    """
+    Renders the z slices between consecutive z_edges, see
+    render.iter_slices, and saves them as the float32 pages of a TIFF.
+    For a list of channels, the pages are ordered by slice, then channel,
+    as in ImageJ hyperstacks.
+    """
+    slices = _render.iter_slices(locs, info, z_edges, kwargs, callback)
+    with TiffStackWriter(path) as tif:
+        for image in slices:
+            for page in image.reshape((-1,) + image.shape[-2:]):
+                tif.write(page)
+
+
 def to_raw_combined(basename, paths):
     raw_file_name = basename + ".ome.raw"
     with open(raw_file_name, "wb") as file_handle:
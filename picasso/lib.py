@@ -11,7 +11,6 @@
 
 import numba as _numba
 import numpy as _np
-from numpy.lib.recfunctions import append_fields as _append_fields
 from numpy.lib.recfunctions import drop_fields as _drop_fields
 import collections as _collections
 import glob as _glob
@@ -114,33 +113,34 @@ def calculate_optimal_bins(data, max_n_bins=None):
 def append_to_rec(rec_array, data, name):
     if hasattr(rec_array, name):
         rec_array = remove_from_rec(rec_array, name)
-    return _append_fields(
-        rec_array,
-        name,
-        data,
-        dtypes=data.dtype,
-        usemask=False,
-        asrecarray=True,
-    )
-    return rec_array
+    # Copying field by field is much faster than append_fields
+    names = rec_array.dtype.names
+    dtype = [(_, rec_array.dtype[_]) for _ in names] + [(name, data.dtype)]
+    new_rec_array = _np.empty(len(rec_array), dtype=dtype)
+    for _ in names:
+        new_rec_array[_] = rec_array[_]
+    new_rec_array[name] = data
+    return new_rec_array.view(_np.recarray)
 
 
 def ensure_sanity(locs, info):
+    """
+    Removes localizations with non-finite fields, outside of the movie or
+    with a localization precision that is not positive. The checks are
+    combined into one mask, so that locs is copied only once.
+    """
     # no inf or nan:
-    locs = locs[
-        _np.all(
-            _np.array([_np.isfinite(locs[_]) for _ in locs.dtype.names]),
-            axis=0,
-        )
-    ]
+    valid = _np.ones(len(locs), dtype=bool)
+    for name in locs.dtype.names:
+        valid &= _np.isfinite(locs[name])
     # other sanity checks:
-    locs = locs[locs.x > 0]
-    locs = locs[locs.y > 0]
-    locs = locs[locs.x < info[0]["Width"]]
-    locs = locs[locs.y < info[0]["Height"]]
-    locs = locs[locs.lpx > 0]
-    locs = locs[locs.lpy > 0]
-    return locs
+    valid &= locs.x > 0
+    valid &= locs.y > 0
+    valid &= locs.x < info[0]["Width"]
+    valid &= locs.y < info[0]["Height"]
+    valid &= locs.lpx > 0
+    valid &= locs.lpy > 0
+    return locs[valid]
 
 
 def is_loc_at(x, y, locs, r):
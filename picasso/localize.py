@@ -16,6 +16,7 @@ import threading as _threading
 from itertools import chain as _chain
 import matplotlib.pyplot as _plt
 from . import gaussmle as _gaussmle
+from . import avgroi as _avgroi
 from . import io as _io
 
 
@@ -127,7 +128,34 @@ def identify_by_frame_number(movie, minimum_ng, box, frame_number, roi=None):
     )
 
 
-def _identify_worker(movie, current, minimum_ng, box, roi, lock):
+def identify_and_measure_by_frame_number(
+    movie, minimum_ng, box, frame_number, camera_info, roi=None
+):
+    """
+    Identifies spots and measures their ROI photometry (see
+    avgroi.photometry_in_frame) while the frame is at hand, so no spots
+    have to be cut out later.
+    """
+    frame = movie[frame_number]
+    y, x, net_gradient = identify_in_frame(frame, minimum_ng, box, roi)
+    photons, bg = _avgroi.photometry_in_frame(frame, y, x, box, camera_info)
+    frame = frame_number * _np.ones(len(x))
+    return _np.rec.array(
+        (frame, x, y, net_gradient, photons, bg),
+        dtype=[
+            ("frame", "i"),
+            ("x", "i"),
+            ("y", "i"),
+            ("net_gradient", "f4"),
+            ("photons", "f4"),
+            ("bg", "f4"),
+        ],
+    )
+
+
+def _identify_worker(
+    movie, current, minimum_ng, box, roi, lock, camera_info=None
+):
     n_frames = len(movie)
     identifications = []
     while True:
@@ -136,22 +164,33 @@ def _identify_worker(movie, current, minimum_ng, box, roi, lock):
             if index == n_frames:
                 return identifications
             current[0] += 1
-        identifications.append(
-            identify_by_frame_number(movie, minimum_ng, box, index, roi)
-        )
+        if camera_info is None:
+            identifications.append(
+                identify_by_frame_number(movie, minimum_ng, box, index, roi)
+            )
+        else:
+            identifications.append(
+                identify_and_measure_by_frame_number(
+                    movie, minimum_ng, box, index, camera_info, roi
+                )
+            )
     return identifications
 
 
 def identifications_from_futures(futures):
     ids_list_of_lists = [_.result() for _ in futures]
-    ids_list = _chain(*ids_list_of_lists)
+    ids_list = list(_chain(*ids_list_of_lists))
     ids = _np.hstack(ids_list).view(_np.recarray)
     ids.sort(kind="mergesort", order="frame")
     return ids
 
 
-def identify_async(movie, minimum_ng, box, roi=None):
-    "Use the user settings to define the number of workers that are being used"
+def identify_async(movie, minimum_ng, box, roi=None, camera_info=None):
+    """
+    Use the user settings to define the number of workers that are being
+    used. If camera_info is given, the ROI photometry of each
+    identification is measured in the same pass (see avgroi.photometry).
+    """
     settings = _io.load_user_settings()
     try:
         cpu_utilization = settings["Localize"]["cpu_utilization"]
@@ -173,7 +212,14 @@ def identify_async(movie, minimum_ng, box, roi=None):
     lock = _threading.Lock()
     f = [
         executor.submit(
-            _identify_worker, movie, current, minimum_ng, box, roi, lock
+            _identify_worker,
+            movie,
+            current,
+            minimum_ng,
+            box,
+            roi,
+            lock,
+            camera_info,
         )
         for _ in range(n_workers)
     ]
@@ -18,6 +18,7 @@ from scipy.spatial import distance
 from scipy.spatial import ConvexHull
 
 from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from concurrent.futures import as_completed as _as_completed
 import multiprocessing as _multiprocessing
 import matplotlib.pyplot as _plt
 import itertools as _itertools
@@ -26,46 +27,60 @@ from collections import OrderedDict as _OrderedDict
 from . import lib as _lib
 from . import render as _render
 from . import imageprocess as _imageprocess
-from threading import Thread as _Thread
-import time as _time
 from tqdm import tqdm as _tqdm
 from numpy.lib.recfunctions import stack_arrays
 
 
 def get_index_blocks(locs, info, size, callback=None):
+    """
+    Sorts the localizations into a grid of blocks with the given size.
+    Returns the sorted localizations with their block indices and the
+    tables of block starts and ends. The localizations are sorted by a
+    counting sort in bands of block rows, which are filled in parallel.
+    callback is called with the number of block rows done.
+    """
     locs = _lib.ensure_sanity(locs, info)
-    # Sort locs by indices
-    x_index = _np.uint32(locs.x / size)
-    y_index = _np.uint32(locs.y / size)
-    sort_indices = _np.lexsort([x_index, y_index])
-    locs = locs[sort_indices]
-    x_index = x_index[sort_indices]
-    y_index = y_index[sort_indices]
-    # Allocate block info arrays
     n_blocks_y, n_blocks_x = index_blocks_shape(info, size)
     block_starts = _np.zeros((n_blocks_y, n_blocks_x), dtype=_np.uint32)
     block_ends = _np.zeros((n_blocks_y, n_blocks_x), dtype=_np.uint32)
     K, L = block_starts.shape
-    # Fill in block starts and ends
-    # We are running this in a thread with a nogil numba function.
-    # This helps updating a potential GUI with the callback.
-    if callback is not None:
-        callback(0)
-        counter = [0]
-    else:
-        counter = None
-    thread = _Thread(
-        target=_fill_index_blocks,
-        args=(block_starts, block_ends, x_index, y_index, counter),
+    # Clipped for localizations that round onto the upper border
+    x_index = _np.minimum(_np.uint32(locs.x / size), L - 1)
+    y_index = _np.minimum(_np.uint32(locs.y / size), K - 1)
+    n_threads = _multiprocessing.cpu_count()
+    band_height = max(1, -(-K // (4 * n_threads)))
+    n_bands = -(-K // band_height)
+    index, offsets = _render._band_index(
+        y_index, y_index + 1, band_height, n_bands
     )
-    thread.start()
+    order = _np.empty(len(locs), dtype=_np.int64)
     if callback is not None:
-        while counter[0] < K:
-            callback(counter[0])
-            _time.sleep(0.1)
-    thread.join()
-    if callback is not None:
-        callback(counter[0])
+        callback(0)
+    with _ThreadPoolExecutor(n_threads) as executor:
+        futures = [
+            executor.submit(
+                _fill_index_band,
+                index,
+                offsets,
+                band,
+                band_height,
+                x_index,
+                y_index,
+                block_starts,
+                block_ends,
+                order,
+            )
+            for band in range(n_bands)
+        ]
+        if callback is not None:
+            for i, _ in enumerate(_as_completed(futures)):
+                callback(min(K, (i + 1) * band_height))
+    for future in futures:
+        future.result()
+    # take is much faster than fancy indexing for record arrays
+    locs = _np.take(locs, order)
+    x_index = x_index[order]
+    y_index = y_index[order]
     return locs, size, x_index, y_index, block_starts, block_ends, K, L
 
 
@@ -105,30 +120,467 @@ def get_block_locs_at(x, y, index_blocks):
     return locs[indices]
 
 
-def _fill_index_blocks(
-    block_starts, block_ends, x_index, y_index, counter=None
+def pick_locs(locs, picks, shape, size):
+    """
+    Returns the localizations in all picks, with the index of their pick
+    in a group field, sorted by group and frame. With shape "Circle",
+    picks are (x, y) centers and size is the diameter. With "Rectangle",
+    picks are ((start_x, start_y), (end_x, end_y)) axis points and size
+    is the width, and the coordinates in the rotated pick frame are added
+    as x_pick_rot and y_pick_rot. Localizations in several picks are
+    returned once for each of them.
+    """
+    picks = _np.asarray(picks, dtype=_np.float64)
+    if shape == "Circle":
+        picks = picks.reshape(-1, 2)
+        x_start = x_end = picks[:, 0]
+        y_start = y_end = picks[:, 1]
+    elif shape == "Rectangle":
+        picks = picks.reshape(-1, 2, 2)
+        x_start, y_start = picks[:, 0, 0], picks[:, 0, 1]
+        x_end, y_end = picks[:, 1, 0], picks[:, 1, 1]
+    else:
+        raise ValueError("Invalid value for pick shape")
+    half_size = size / 2
+    # The rotation that takes the pick axis onto the positive y axis
+    angle = 0.5 * _np.pi - _np.arctan2(y_end - y_start, x_end - x_start)
+    length = _np.hypot(x_end - x_start, y_end - y_start)
+    # A hash of the cells that overlap the bounding box of each pick
+    x_min = _np.minimum(x_start, x_end) - half_size
+    x_max = _np.maximum(x_start, x_end) + half_size
+    y_min = _np.minimum(y_start, y_end) - half_size
+    y_max = _np.maximum(y_start, y_end) + half_size
+    if len(picks):
+        x0, y0 = x_min.min(), y_min.min()
+        span = max(x_max.max() - x0, y_max.max() - y0)
+    else:
+        x0 = y0 = span = 0
+    cell = max(size, span / 1024, 1e-6)
+    n_x = int((x_max.max() - x0) / cell) + 1 if len(picks) else 0
+    n_y = int((y_max.max() - y0) / cell) + 1 if len(picks) else 0
+    cell_starts, cell_picks = _pick_grid(
+        (x_min - x0) / cell,
+        (x_max - x0) / cell,
+        (y_min - y0) / cell,
+        (y_max - y0) / cell,
+        n_x,
+        n_y,
+    )
+    index, group, x_rot, y_rot = _pick_locs(
+        locs.x,
+        locs.y,
+        x_start,
+        y_start,
+        _np.cos(angle),
+        _np.sin(angle),
+        length,
+        half_size,
+        shape == "Circle",
+        x0,
+        y0,
+        cell,
+        n_x,
+        n_y,
+        cell_starts,
+        cell_picks,
+    )
+    order = _np.lexsort((locs.frame[index], group))
+    picked_locs = _np.take(locs, index[order])
+    if shape == "Rectangle":
+        picked_locs = _lib.append_to_rec(
+            picked_locs, x_rot[order], "x_pick_rot"
+        )
+        picked_locs = _lib.append_to_rec(
+            picked_locs, y_rot[order], "y_pick_rot"
+        )
+    return _lib.append_to_rec(picked_locs, group[order], "group")
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _pick_grid(x_min, x_max, y_min, y_max, n_x, n_y):
+    """
+    Returns cell_starts, cell_picks such that
+    cell_picks[cell_starts[c]:cell_starts[c + 1]] are the picks whose
+    bounding box, in cell units, overlaps cell c = i * n_x + j.
+    """
+    n_picks = len(x_min)
+    counts = _np.zeros(n_y * n_x + 1, dtype=_np.int64)
+    for p in range(n_picks):
+        for i in range(int(y_min[p]), min(int(y_max[p]) + 1, n_y)):
+            for j in range(int(x_min[p]), min(int(x_max[p]) + 1, n_x)):
+                counts[i * n_x + j + 1] += 1
+    cell_starts = _np.cumsum(counts)
+    position = cell_starts[:-1].copy()
+    cell_picks = _np.empty(cell_starts[-1], dtype=_np.int64)
+    for p in range(n_picks):
+        for i in range(int(y_min[p]), min(int(y_max[p]) + 1, n_y)):
+            for j in range(int(x_min[p]), min(int(x_max[p]) + 1, n_x)):
+                c = i * n_x + j
+                cell_picks[position[c]] = p
+                position[c] += 1
+    return cell_starts, cell_picks
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _pick_coordinates(
+    x, y, x_start, y_start, cos, sin, length, half_size, circle
 ):
-    Y, X = block_starts.shape
-    N = len(x_index)
-    k = 0
-    if counter is not None:
-        counter[0] = 0
-    for i in range(Y):
-        for j in range(X):
-            k = _fill_index_block(
-                block_starts, block_ends, N, x_index, y_index, i, j, k
+    """
+    Returns whether x, y is in a pick and its coordinates in the rotated
+    pick frame
+    """
+    dx = x - x_start
+    dy = y - y_start
+    x_rot = dx * cos - dy * sin
+    y_rot = dx * sin + dy * cos
+    if circle:
+        is_picked = dx ** 2 + dy ** 2 < half_size ** 2
+    else:
+        is_picked = abs(x_rot) < half_size and 0 < y_rot < length
+    return is_picked, x_rot, y_rot
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _pick_cell(x, y, x0, y0, cell, n_x, n_y):
+    """ The pick grid cell of x, y or -1 outside of the grid """
+    j = (x - x0) / cell
+    i = (y - y0) / cell
+    if 0 <= i < n_y and 0 <= j < n_x:
+        return int(i) * n_x + int(j)
+    return -1
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _pick_locs(
+    x,
+    y,
+    x_start,
+    y_start,
+    cos,
+    sin,
+    length,
+    half_size,
+    circle,
+    x0,
+    y0,
+    cell,
+    n_x,
+    n_y,
+    cell_starts,
+    cell_picks,
+):
+    """
+    Returns the localization and pick indices of all picked localizations
+    and their coordinates in the rotated pick frame, in the order of the
+    localizations. The localizations are counted in a first pass, to
+    fill the output in parallel in a second.
+    """
+    n = len(x)
+    counts = _np.zeros(n + 1, dtype=_np.int64)
+    for k in _numba.prange(n):
+        c = _pick_cell(x[k], y[k], x0, y0, cell, n_x, n_y)
+        if c >= 0:
+            for m in range(cell_starts[c], cell_starts[c + 1]):
+                p = cell_picks[m]
+                if _pick_coordinates(
+                    x[k],
+                    y[k],
+                    x_start[p],
+                    y_start[p],
+                    cos[p],
+                    sin[p],
+                    length[p],
+                    half_size,
+                    circle,
+                )[0]:
+                    counts[k + 1] += 1
+    offsets = _np.cumsum(counts)
+    n_picked = offsets[n]
+    index = _np.empty(n_picked, dtype=_np.int64)
+    group = _np.empty(n_picked, dtype=_np.int32)
+    x_rot = _np.empty(n_picked, dtype=_np.float32)
+    y_rot = _np.empty(n_picked, dtype=_np.float32)
+    for k in _numba.prange(n):
+        c = _pick_cell(x[k], y[k], x0, y0, cell, n_x, n_y)
+        if c >= 0:
+            i = offsets[k]
+            for m in range(cell_starts[c], cell_starts[c + 1]):
+                p = cell_picks[m]
+                is_picked, xr, yr = _pick_coordinates(
+                    x[k],
+                    y[k],
+                    x_start[p],
+                    y_start[p],
+                    cos[p],
+                    sin[p],
+                    length[p],
+                    half_size,
+                    circle,
+                )
+                if is_picked:
+                    index[i] = k
+                    group[i] = p
+                    x_rot[i] = xr
+                    y_rot[i] = yr
+                    i += 1
+    return index, group, x_rot, y_rot
+
+
+def pick_similar(locs, info, picks, d, std_range, index_blocks=None):
+    """
+    Finds circular picks with diameter d that are similar to the given
+    picks. The number of localizations and their rmsd from the center of
+    mass must be within std_range standard deviations of the mean over the
+    given picks. A hexagonal grid of candidates is moved to the center of
+    mass of their localizations in parallel, and the candidates are then
+    accepted in grid order if they do not overlap with any accepted pick.
+    index_blocks can be passed from get_index_blocks with size d / 2.
+    Returns the centers of the given and the similar picks.
+    """
+    picks = _np.asarray(picks, dtype=_np.float64).reshape(-1, 2)
+    width, height = info[0]["Width"], info[0]["Height"]
+    if index_blocks is None:
+        index_blocks = get_index_blocks(locs, info, d / 2)
+    locs, size, x_index, y_index, block_starts, block_ends, K, L = (
+        index_blocks
+    )
+    # Statistics of the given picks, computed as those of the candidates
+    n_locs, _, _, rmsd = _np.array(
+        [
+            _pick_moments(
+                x_pick, y_pick, locs.x, locs.y, block_starts, block_ends, size
             )
-        if counter is not None:
-            counter[0] = i + 1
+            for x_pick, y_pick in picks
+        ]
+    ).reshape(-1, 4).T
+    min_n_locs = n_locs.mean() - std_range * n_locs.std()
+    max_n_locs = n_locs.mean() + std_range * n_locs.std()
+    min_rmsd = rmsd.mean() - std_range * rmsd.std()
+    max_rmsd = rmsd.mean() + std_range * rmsd.std()
+    # The hexagonal grid, with y shifted for odd columns
+    x_range = _np.arange(d / 2, width, _np.sqrt(3) * d / 2)
+    y_range = _np.arange(d / 2, height - d / 2, d)
+    x_grid = _np.repeat(x_range, len(y_range))
+    y_grid = (
+        y_range[_np.newaxis, :]
+        + (d / 2) * (_np.arange(len(x_range)) % 2)[:, _np.newaxis]
+    ).ravel()
+    x_center, y_center, is_similar = _similar_candidates(
+        locs.x,
+        locs.y,
+        block_starts,
+        block_ends,
+        size,
+        x_grid,
+        y_grid,
+        min_n_locs,
+        max_n_locs,
+        min_rmsd,
+        max_rmsd,
+    )
+    x_similar, y_similar = _accept_similar(
+        picks[:, 0],
+        picks[:, 1],
+        x_center[is_similar],
+        y_center[is_similar],
+        d,
+        int(width / d) + 1,
+        int(height / d) + 1,
+    )
+    return _np.column_stack((x_similar, y_similar))
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _pick_moments(x_pick, y_pick, x, y, block_starts, block_ends, r):
+    """
+    Returns the number of localizations within r of x_pick, y_pick, the
+    mean of their coordinates and their rmsd from it. The block size of
+    the index must be r. The sums are taken over float64 offsets from
+    the pick, and the rmsd in a second pass around the mean, so that it
+    keeps its precision far from the origin.
+    """
+    K, L = block_starts.shape
+    k_pick = int(y_pick / r)
+    l_pick = int(x_pick / r)
+    r2 = r ** 2
+    n = 0
+    sum_dx = sum_dy = 0.0
+    for k in range(max(k_pick - 1, 0), min(k_pick + 2, K)):
+        for l in range(max(l_pick - 1, 0), min(l_pick + 2, L)):
+            for i in range(block_starts[k, l], block_ends[k, l]):
+                dx = _np.float64(x[i]) - x_pick
+                dy = _np.float64(y[i]) - y_pick
+                if dx ** 2 + dy ** 2 < r2:
+                    n += 1
+                    sum_dx += dx
+                    sum_dy += dy
+    if n == 0:
+        return 0, _np.nan, _np.nan, _np.nan
+    dx_mean = sum_dx / n
+    dy_mean = sum_dy / n
+    sum_d2 = 0.0
+    for k in range(max(k_pick - 1, 0), min(k_pick + 2, K)):
+        for l in range(max(l_pick - 1, 0), min(l_pick + 2, L)):
+            for i in range(block_starts[k, l], block_ends[k, l]):
+                dx = _np.float64(x[i]) - x_pick
+                dy = _np.float64(y[i]) - y_pick
+                if dx ** 2 + dy ** 2 < r2:
+                    sum_d2 += (dx - dx_mean) ** 2 + (dy - dy_mean) ** 2
+    return n, x_pick + dx_mean, y_pick + dy_mean, _np.sqrt(sum_d2 / n)
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _similar_candidates(
+    x,
+    y,
+    block_starts,
+    block_ends,
+    r,
+    x_grid,
+    y_grid,
+    min_n_locs,
+    max_n_locs,
+    min_rmsd,
+    max_rmsd,
+):
+    """
+    Moves each grid point to the center of mass of the localizations
+    within r, until it moves less than 1e-3. Returns the centers and
+    whether their number of localizations and rmsd are in range.
+    """
+    K, L = block_starts.shape
+    n_grid = len(x_grid)
+    x_center = _np.empty(n_grid)
+    y_center = _np.empty(n_grid)
+    is_similar = _np.zeros(n_grid, dtype=_np.bool_)
+    for g in _numba.prange(n_grid):
+        x_pick = x_grid[g]
+        y_pick = y_grid[g]
+        x_center[g] = x_pick
+        y_center[g] = y_pick
+        # Skip grid points with too few localizations in their blocks
+        k_pick = int(y_pick / r)
+        l_pick = int(x_pick / r)
+        n_block_locs = 0
+        for k in range(max(k_pick - 1, 0), min(k_pick + 2, K)):
+            for l in range(max(l_pick - 1, 0), min(l_pick + 2, L)):
+                n_block_locs += block_ends[k, l] - block_starts[k, l]
+        if n_block_locs <= min_n_locs:
+            continue
+        n, x_mean, y_mean, rmsd = _pick_moments(
+            x_pick, y_pick, x, y, block_starts, block_ends, r
+        )
+        if n <= 1:
+            continue
+        for _ in range(1000):
+            if (
+                abs(x_mean - x_pick) <= 1e-3
+                and abs(y_mean - y_pick) <= 1e-3
+            ):
+                break
+            x_pick = x_mean
+            y_pick = y_mean
+            n, x_mean, y_mean, rmsd = _pick_moments(
+                x_pick, y_pick, x, y, block_starts, block_ends, r
+            )
+            if n == 0:
+                break
+        x_center[g] = x_mean
+        y_center[g] = y_mean
+        is_similar[g] = (
+            n > 0
+            and min_n_locs < n < max_n_locs
+            and min_rmsd < rmsd < max_rmsd
+        )
+    return x_center, y_center, is_similar
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _accept_similar(x_picks, y_picks, x_center, y_center, d, n_x, n_y):
+    """
+    Appends the centers, in order, to the picks if they are more than d
+    away from all picks so far. The picks are hashed into cells of size
+    d, kept as linked lists, so that only the neighboring cells are
+    searched.
+    """
+    n_max = len(x_picks) + len(x_center)
+    x_out = _np.empty(n_max)
+    y_out = _np.empty(n_max)
+    head = -_np.ones(n_x * n_y, dtype=_np.int64)
+    next_pick = _np.empty(n_max, dtype=_np.int64)
+    d2 = d ** 2
+    n = 0
+    for m in range(n_max):
+        if m < len(x_picks):
+            x_pick = x_picks[m]
+            y_pick = y_picks[m]
+        else:
+            x_pick = x_center[m - len(x_picks)]
+            y_pick = y_center[m - len(x_picks)]
+        # Cells of points outside of the grid are clipped to its border,
+        # which keeps neighbors in neighboring cells
+        i = min(max(int(_np.floor(y_pick / d)), 0), n_y - 1)
+        j = min(max(int(_np.floor(x_pick / d)), 0), n_x - 1)
+        if m >= len(x_picks):
+            overlaps = False
+            for i_ in range(max(i - 1, 0), min(i + 2, n_y)):
+                for j_ in range(max(j - 1, 0), min(j + 2, n_x)):
+                    p = head[i_ * n_x + j_]
+                    while p >= 0 and not overlaps:
+                        d2_pick = (x_out[p] - x_pick) ** 2
+                        d2_pick += (y_out[p] - y_pick) ** 2
+                        overlaps = d2_pick <= d2
+                        p = next_pick[p]
+            if overlaps:
+                continue
+        x_out[n] = x_pick
+        y_out[n] = y_pick
+        next_pick[n] = head[i * n_x + j]
+        head[i * n_x + j] = n
+        n += 1
+    return x_out[:n], y_out[:n]
 
 
 @_numba.jit(nopython=True, nogil=True)
-def _fill_index_block(block_starts, block_ends, N, x_index, y_index, i, j, k):
-    block_starts[i, j] = k
-    while k < N and y_index[k] == i and x_index[k] == j:
-        k += 1
-    block_ends[i, j] = k
-    return k
+def _fill_index_band(
+    index,
+    offsets,
+    band,
+    band_height,
+    x_index,
+    y_index,
+    block_starts,
+    block_ends,
+    order,
+):
+    """
+    Fills the block starts and ends of one band of block rows and the
+    sort order of its localizations, keeping their order within blocks.
+    index[offsets[band]:offsets[band + 1]] are the localizations of the
+    band, which start at offsets[band] in the sort order.
+    """
+    K, L = block_starts.shape
+    k_min = band * band_height
+    k_max = min(k_min + band_height, K)
+    # Count the localizations in each block of the band
+    counts = _np.zeros((k_max - k_min) * L, dtype=_np.int64)
+    for m in range(offsets[band], offsets[band + 1]):
+        i = index[m]
+        counts[(y_index[i] - k_min) * L + x_index[i]] += 1
+    # Block starts from the cumulative counts, which become write positions
+    position = offsets[band]
+    for k in range(k_min, k_max):
+        for l in range(L):
+            c = (k - k_min) * L + l
+            block_starts[k, l] = position
+            position += counts[c]
+            block_ends[k, l] = position
+            counts[c] = block_starts[k, l]
+    for m in range(offsets[band], offsets[band + 1]):
+        i = index[m]
+        c = (y_index[i] - k_min) * L + x_index[i]
+        order[counts[c]] = i
+        counts[c] += 1
 
 
 @_numba.jit(nopython=True, nogil=True)
@@ -1284,15 +1736,46 @@ def undrift(
     display=True,
     segmentation_callback=None,
     rcc_callback=None,
+    blur_method="gaussian",
+    stream=True,
+    peak_method="gaussian",
+    upsample_factor=None,
+    windowed=False,
 ):
-    bounds, segments = _render.segment(
-        locs,
-        info,
-        segmentation,
-        {"blur_method": "gaussian", "min_blur_width": 1},
-        segmentation_callback,
-    )
-    shift_y, shift_x = _imageprocess.rcc(segments, 32, rcc_callback)
+    """
+    Estimates drift by redundant cross-correlation of rendered segments.
+    blur_method is passed to render; "convolve" blurs the segment
+    histograms with render.gaussian_filter instead of drawing a Gaussian
+    for every localization. With stream, the segments are correlated
+    while the next ones are rendered, instead of rendering the full stack
+    first. peak_method, upsample_factor and windowed are passed to
+    imageprocess.rcc.
+    """
+    render_kwargs = {"blur_method": blur_method, "min_blur_width": 1}
+    rcc_kwargs = {
+        "method": peak_method,
+        "upsample_factor": upsample_factor,
+        "windowed": windowed,
+    }
+    if stream:
+        bounds = _render.segment_bounds(info, segmentation)
+        segments = _render.iter_segments(
+            locs, info, segmentation, render_kwargs, segmentation_callback
+        )
+        shift_y, shift_x = _imageprocess.rcc(
+            segments,
+            32,
+            rcc_callback,
+            n_segments=len(bounds) - 1,
+            **rcc_kwargs
+        )
+    else:
+        bounds, segments = _render.segment(
+            locs, info, segmentation, render_kwargs, segmentation_callback
+        )
+        shift_y, shift_x = _imageprocess.rcc(
+            segments, 32, rcc_callback, **rcc_kwargs
+        )
     t = (bounds[1:] + bounds[:-1]) / 2
     drift_x_pol = _interpolate.InterpolatedUnivariateSpline(t, shift_x, k=3)
     drift_y_pol = _interpolate.InterpolatedUnivariateSpline(t, shift_y, k=3)
@@ -7,13 +7,22 @@
     :author: Joerg Schnitzbauer, 2015
     :copyright: Copyright (c) 2015 Jungmann Lab, MPI of Biochemistry
 """
+import multiprocessing as _multiprocessing
+import threading as _threading
+from collections import OrderedDict as _OrderedDict
+from collections import deque as _deque
+from concurrent import futures as _futures
+
 import numpy as _np
 import numba as _numba
-import scipy.signal as _signal
 from tqdm import trange as _trange
 
 
 _DRAW_MAX_SIGMA = 3
+_TILE_SIZE = 8
+_RECURSIVE_MIN_SIGMA = 10
+_RECURSIVE_TAIL = 6
+_TILED_OUTLIER_FRACTION = 0.001
 
 
 def render(
@@ -23,33 +32,514 @@ def render(
     viewport=None,
     blur_method=None,
     min_blur_width=0,
+    parallel=True,
+    tile_index=None,
+    blur_widths=None,
 ):
+    """
+    If a tile_index from get_tile_index is given, only its tiles that
+    intersect the viewport are rendered and locs is ignored. blur_widths
+    (height, width) replaces the median localization precision of the
+    convolve blur, so that several viewports can be blurred alike.
+    """
     if viewport is None:
         try:
             viewport = [(0, 0), (info[0]["Height"], info[0]["Width"])]
         except TypeError:
             raise ValueError("Need info if no viewport is provided.")
+    if tile_index is not None:
+        locs = tile_index_locs(tile_index, viewport)
     (y_min, x_min), (y_max, x_max) = viewport
     if blur_method is None:
+        if parallel:
+            return render_hist_parallel(
+                locs, oversampling, y_min, x_min, y_max, x_max
+            )
         return render_hist(locs, oversampling, y_min, x_min, y_max, x_max)
     elif blur_method == "gaussian":
+        if parallel:
+            return render_gaussian_parallel(
+                locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
+            )
         return render_gaussian(
             locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
         )
     elif blur_method == "gaussian_iso":
+        if parallel:
+            return render_gaussian_iso_parallel(
+                locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
+            )
         return render_gaussian_iso(
             locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
         )
     elif blur_method == "smooth":
-        return render_smooth(locs, oversampling, y_min, x_min, y_max, x_max)
+        return render_smooth(
+            locs, oversampling, y_min, x_min, y_max, x_max, parallel=parallel
+        )
     elif blur_method == "convolve":
         return render_convolve(
-            locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
+            locs,
+            oversampling,
+            y_min,
+            x_min,
+            y_max,
+            x_max,
+            min_blur_width,
+            parallel=parallel,
+            blur_widths=blur_widths,
         )
     else:
         raise Exception("blur_method not understood.")
 
 
+def render_multi(
+    locs,
+    info=None,
+    oversampling=1,
+    viewport=None,
+    blur_method=None,
+    min_blur_width=0,
+    colors=None,
+    parallel=True,
+    blur_widths=None,
+):
+    """
+    Renders a list of localization channels in one pass over all of them.
+    Returns (n_locs, image), where n_locs holds the number of rendered
+    localizations of each channel. Without colors, image is the
+    (C, Y, X) stack of the channel images, equal to rendering each
+    channel with render. With colors, one (r, g, b) weight per channel,
+    the channels are blended straight into a (Y, X, 4) float32 BGRA
+    image with alpha 1. blur_widths holds the convolve blur widths of
+    each channel, as in render.
+    """
+    viewport = _multi_viewport(info, viewport, blur_method)
+    n_pixel_y, n_pixel_x = image_shape(viewport, oversampling)
+    n_channels = len(locs)
+    n_locs = _np.zeros(n_channels, dtype=_np.int64)
+    x, y, sx, sy, channel, in_views = [], [], [], [], [], []
+    for c, locs_ in enumerate(locs):
+        x_, y_, sx_, sy_, in_view = _multi_setup(
+            locs_, oversampling, viewport, blur_method, min_blur_width
+        )
+        n_locs[c] = len(x_)
+        x.append(x_)
+        y.append(y_)
+        sx.append(sx_)
+        sy.append(sy_)
+        channel.append(_np.full(n_locs[c], c, dtype=_np.int64))
+        in_views.append(in_view)
+    x, y, channel = [_np.concatenate(_) for _ in (x, y, channel)]
+    if blur_method in ["gaussian", "gaussian_iso"]:
+        sx, sy = _np.concatenate(sx), _np.concatenate(sy)
+    else:
+        sx = sy = None
+    if colors is not None and blur_method not in ["smooth", "convolve"]:
+        return n_locs, _render_bgra(
+            x, y, sx, sy, channel, colors, n_pixel_y, n_pixel_x, parallel
+        )
+    image = _np.zeros((n_channels, n_pixel_y, n_pixel_x), _np.float32)
+    _fill_multi(image, x, y, sx, sy, channel, _np.zeros((0, 0)), parallel)
+    if blur_method in ["smooth", "convolve"]:
+        # The blur widths differ between channels, so they are filtered
+        # one by one
+        for c, locs_ in enumerate(locs):
+            if n_locs[c] > 0:
+                blur_height, blur_width = _filter_widths(
+                    locs_[in_views[c]],
+                    oversampling,
+                    blur_method,
+                    min_blur_width,
+                    None if blur_widths is None else blur_widths[c],
+                )
+                gaussian_filter(
+                    image[c], blur_height, blur_width, parallel=parallel
+                )
+    if colors is not None:
+        bgra = _np.ones((n_pixel_y, n_pixel_x, 4), dtype=_np.float32)
+        colors = _np.array(colors, dtype=_np.float32)
+        bgra[:, :, :3] = _np.tensordot(image, colors[:, ::-1], (0, 0))
+        return n_locs, bgra
+    return n_locs, image
+
+
+def render_colormap(
+    locs,
+    values,
+    value_range,
+    lut,
+    info=None,
+    oversampling=1,
+    viewport=None,
+    blur_method=None,
+    min_blur_width=0,
+    parallel=True,
+    blur_widths=None,
+):
+    """
+    Renders localizations colored by a scalar per localization, such as
+    z or frame. value_range is split into len(lut) equal bins, which are
+    drawn in the (r, g, b) colors of lut. Values below or above the range
+    get the first or last color, also if the range is empty, localizations
+    with non-finite values are not drawn. The colors are accumulated straight into a (Y, X, 4)
+    float32 BGRA image with alpha 1. Returns (n_locs, image). blur_widths
+    is as in render.
+    """
+    viewport = _multi_viewport(info, viewport, blur_method)
+    n_pixel_y, n_pixel_x = image_shape(viewport, oversampling)
+    lut = _np.asarray(lut, dtype=_np.float64)
+    values = _np.asarray(values, dtype=_np.float64)
+    finite = _np.isfinite(values)
+    if not _np.all(finite):
+        locs, values = locs[finite], values[finite]
+    x, y, sx, sy, in_view = _multi_setup(
+        locs, oversampling, viewport, blur_method, min_blur_width
+    )
+    v_min, v_max = value_range
+    if v_max > v_min:
+        bins = _np.floor(
+            len(lut) * (values[in_view] - v_min) / (v_max - v_min)
+        ).astype(_np.int64)
+        _np.clip(bins, 0, len(lut) - 1, out=bins)
+    else:
+        # An empty range, e.g. of a single frame, has no bins in between
+        bins = _np.where(values[in_view] > v_max, len(lut) - 1, 0)
+    n_locs = len(x)
+    if blur_method not in ["smooth", "convolve"]:
+        return n_locs, _render_bgra(
+            x, y, sx, sy, bins, lut, n_pixel_y, n_pixel_x, parallel
+        )
+    # The blur is the same for all colors, so the color planes are
+    # filtered after the accumulation
+    planes = _np.zeros((3, n_pixel_y, n_pixel_x), dtype=_np.float32)
+    _fill_multi(planes, x, y, None, None, bins, lut[:, ::-1].copy(), parallel)
+    if n_locs > 0:
+        blur_height, blur_width = _filter_widths(
+            locs[in_view],
+            oversampling,
+            blur_method,
+            min_blur_width,
+            blur_widths,
+        )
+        for plane in planes:
+            gaussian_filter(plane, blur_height, blur_width, parallel=parallel)
+    bgra = _np.ones((n_pixel_y, n_pixel_x, 4), dtype=_np.float32)
+    bgra[:, :, :3] = _np.moveaxis(planes, 0, 2)
+    return n_locs, bgra
+
+
+def _multi_viewport(info, viewport, blur_method):
+    if blur_method not in [None, "gaussian", "gaussian_iso"]:
+        if blur_method not in ["smooth", "convolve"]:
+            raise Exception("blur_method not understood.")
+    if viewport is None:
+        try:
+            viewport = [(0, 0), (info[0]["Height"], info[0]["Width"])]
+        except TypeError:
+            raise ValueError("Need info if no viewport is provided.")
+    return viewport
+
+
+def _multi_setup(locs, oversampling, viewport, blur_method, min_blur_width):
+    """
+    Returns the image coordinates x, y and blur widths sx, sy (None if
+    not blurred by localization) of the localizations in the viewport,
+    and the in_view mask. The precision is the same as in _render_setup,
+    so that the pixels match.
+    """
+    (y_min, x_min), (y_max, x_max) = viewport
+    x = locs.x.astype(_np.float64)
+    y = locs.y.astype(_np.float64)
+    in_view = (x > x_min) & (y > y_min) & (x < x_max) & (y < y_max)
+    x = oversampling * (x[in_view] - x_min)
+    y = oversampling * (y[in_view] - y_min)
+    if blur_method not in ["gaussian", "gaussian_iso"]:
+        return x, y, None, None, in_view
+    lpx = locs.lpx[in_view].astype(_np.float64)
+    lpy = locs.lpy[in_view].astype(_np.float64)
+    sx = oversampling * _np.maximum(lpx, min_blur_width)
+    sy = oversampling * _np.maximum(lpy, min_blur_width)
+    if blur_method == "gaussian_iso":
+        sx = sy = (sy + sx) / 2
+    return x, y, sx, sy, in_view
+
+
+def _filter_widths(
+    locs, oversampling, blur_method, min_blur_width, blur_widths=None
+):
+    """ The filter sigmas of render_smooth and render_convolve """
+    if blur_method == "smooth":
+        return 1, 1
+    if blur_widths is not None:
+        return blur_widths
+    blur_width = oversampling * max(_np.median(locs.lpx), min_blur_width)
+    blur_height = oversampling * max(_np.median(locs.lpy), min_blur_width)
+    return blur_height, blur_width
+
+
+def _render_bgra(
+    x, y, sx, sy, channel, colors, n_pixel_y, n_pixel_x, parallel
+):
+    bgra = _np.zeros((n_pixel_y, n_pixel_x, 4), dtype=_np.float32)
+    bgra[:, :, 3] = 1
+    # A (3, Y, X) view of the color planes of the BGRA image
+    planes = _np.moveaxis(bgra, 2, 0)[:3]
+    weights = _np.array(colors, dtype=_np.float64)[:, ::-1].copy()
+    _fill_multi(planes, x, y, sx, sy, channel, weights, parallel)
+    return bgra
+
+
+def _fill_multi(image, x, y, sx, sy, channel, weights, parallel):
+    """
+    Draws the localizations of all channels into the planes of image,
+    histogram bins if sx is None, Gaussians otherwise. Without weights,
+    each channel is drawn into its own plane, else channel c adds
+    weights[c, p] times its value to each plane p.
+    """
+    n_pixel_y = image.shape[1]
+    if sx is None:
+        row_min = y.astype(_np.int64)
+        row_max = row_min + 1
+    else:
+        max_y = _DRAW_MAX_SIGMA * sy
+        row_min = _np.maximum((y - max_y).astype(_np.int64), 0)
+        row_max = _np.minimum((y + max_y + 1).astype(_np.int64), n_pixel_y)
+    if parallel:
+        band_height = _band_height(n_pixel_y)
+        n_bands = -(-n_pixel_y // band_height)
+        index, offsets = _band_index(row_min, row_max, band_height, n_bands)
+    else:
+        band_height = max(n_pixel_y, 1)
+        index = _np.arange(len(x))
+        offsets = _np.array([0, len(x)], dtype=_np.int64)
+    if sx is None:
+        fill = _fill_multi_hist_parallel if parallel else _fill_multi_hist
+        fill(image, x, y, channel, weights, index, offsets)
+    else:
+        if parallel:
+            fill = _fill_multi_gaussian_parallel
+        else:
+            fill = _fill_multi_gaussian
+        fill(
+            image,
+            x,
+            y,
+            sx,
+            sy,
+            channel,
+            weights,
+            row_min,
+            row_max,
+            index,
+            offsets,
+            band_height,
+        )
+
+
+def get_tile_index(locs, info, tile_size=_TILE_SIZE):
+    """
+    Sorts localizations into square tiles of tile_size camera pixels.
+    Returns (locs, tile_size, n_tiles_y, n_tiles_x, tile_starts), where
+    locs are sorted by tile row, then tile column, and the localizations
+    of tile (k, l) are locs[tile_starts[k * n_tiles_x + l]:
+    tile_starts[k * n_tiles_x + l + 1]]. Localizations outside of the
+    movie are put into the nearest border tile.
+    """
+    n_tiles_y = max(1, int(_np.ceil(info[0]["Height"] / tile_size)))
+    n_tiles_x = max(1, int(_np.ceil(info[0]["Width"] / tile_size)))
+    tile_y = _tile_coordinate(locs.y, tile_size, n_tiles_y)
+    tile_x = _tile_coordinate(locs.x, tile_size, n_tiles_x)
+    tile = tile_y * n_tiles_x + tile_x
+    sort_indices = _np.argsort(tile, kind="stable")
+    counts = _np.bincount(tile, minlength=n_tiles_y * n_tiles_x)
+    tile_starts = _np.zeros(len(counts) + 1, dtype=_np.int64)
+    _np.cumsum(counts, out=tile_starts[1:])
+    return locs[sort_indices], tile_size, n_tiles_y, n_tiles_x, tile_starts
+
+
+def _tile_coordinate(coordinate, tile_size, n_tiles):
+    tile = _np.floor(_np.asarray(coordinate) / tile_size)
+    return _np.clip(tile, 0, n_tiles - 1).astype(_np.int64)
+
+
+def tile_index_locs(tile_index, viewport):
+    """
+    Returns the localizations of all tiles that intersect the viewport.
+    This is a superset of the localizations in the viewport, which the
+    render functions then crop exactly.
+    """
+    locs, tile_size, n_tiles_y, n_tiles_x, tile_starts = tile_index
+    (y_min, x_min), (y_max, x_max) = viewport
+    k_min, k_max = _tile_coordinate([y_min, y_max], tile_size, n_tiles_y)
+    l_min, l_max = _tile_coordinate([x_min, x_max], tile_size, n_tiles_x)
+    if k_min == 0 and l_min == 0:
+        if k_max == n_tiles_y - 1 and l_max == n_tiles_x - 1:
+            return locs
+    index = _tile_rows_index(
+        tile_starts, n_tiles_x, k_min, k_max, l_min, l_max
+    )
+    return locs[index]
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _tile_rows_index(tile_starts, n_tiles_x, k_min, k_max, l_min, l_max):
+    """
+    Within a tile row, the tiles l_min to l_max are contiguous, so the
+    index is made of one slice per row.
+    """
+    n = 0
+    for k in range(k_min, k_max + 1):
+        start = tile_starts[k * n_tiles_x + l_min]
+        n += tile_starts[k * n_tiles_x + l_max + 1] - start
+    index = _np.empty(n, dtype=_np.int64)
+    m = 0
+    for k in range(k_min, k_max + 1):
+        start = tile_starts[k * n_tiles_x + l_min]
+        stop = tile_starts[k * n_tiles_x + l_max + 1]
+        for i in range(start, stop):
+            index[m] = i
+            m += 1
+    return index
+
+
+def render_pan(
+    image,
+    n_locs,
+    tile_index,
+    last_viewport,
+    viewport,
+    oversampling,
+    blur_method=None,
+    min_blur_width=0,
+    max_blur_width=0,
+):
+    """
+    Updates a rendering (n_locs, image) of last_viewport to viewport, if
+    the viewport was moved by whole pixels. The image is shifted and only
+    the exposed strips are rendered, from the localizations found through
+    the tile index. For Gaussian blur, the strips are widened by the
+    largest blob radius, given by max_blur_width, the largest localization
+    precision. Returns None if the rendering can not be updated.
+    """
+    if blur_method not in [None, "gaussian", "gaussian_iso"]:
+        return None
+    (y_min, x_min), (y_max, x_max) = viewport
+    n_pixel_y = int(_np.ceil(oversampling * (y_max - y_min)))
+    n_pixel_x = int(_np.ceil(oversampling * (x_max - x_min)))
+    if image.shape != (n_pixel_y, n_pixel_x):
+        return None
+    shift = oversampling * (
+        _np.array(viewport[0]) - _np.array(last_viewport[0])
+    )
+    if _np.any(_np.abs(shift - _np.round(shift)) > 1e-3):
+        return None
+    sy, sx = _np.round(shift).astype(int)
+    if abs(sy) >= n_pixel_y or abs(sx) >= n_pixel_x:
+        return None
+    if blur_method is None:
+        margin = 0
+    else:
+        max_blur = max(max_blur_width, min_blur_width)
+        margin = int(_np.ceil(_DRAW_MAX_SIGMA * oversampling * max_blur)) + 2
+    shifted = _np.zeros_like(image)
+    shifted[
+        max(0, -sy) : n_pixel_y - max(0, sy),
+        max(0, -sx) : n_pixel_x - max(0, sx),
+    ] = image[
+        max(0, sy) : n_pixel_y + min(0, sy),
+        max(0, sx) : n_pixel_x + min(0, sx),
+    ]
+    # The exposed strips, widened by the margin where blobs of newly
+    # visible localizations reach into the shifted image, and the bands on
+    # the opposite side, where blobs of localizations that left the view
+    # have to be removed
+    strips = []
+    if sy > 0:
+        strips += [(n_pixel_y - sy - margin, n_pixel_y, 0, n_pixel_x)]
+        strips += [(0, margin, 0, n_pixel_x)]
+    elif sy < 0:
+        strips += [(0, margin - sy, 0, n_pixel_x)]
+        strips += [(n_pixel_y - margin, n_pixel_y, 0, n_pixel_x)]
+    if sx > 0:
+        strips += [(0, n_pixel_y, n_pixel_x - sx - margin, n_pixel_x)]
+        strips += [(0, n_pixel_y, 0, margin)]
+    elif sx < 0:
+        strips += [(0, n_pixel_y, 0, margin - sx)]
+        strips += [(0, n_pixel_y, n_pixel_x - margin, n_pixel_x)]
+    for i_min, i_max, j_min, j_max in strips:
+        i_min, i_max = max(i_min, 0), min(i_max, n_pixel_y)
+        j_min, j_max = max(j_min, 0), min(j_max, n_pixel_x)
+        if i_max <= i_min or j_max <= j_min:
+            continue
+        # Render the strip with a margin, from the localizations in view
+        strip_viewport = [
+            (
+                y_min + (i_min - margin) / oversampling,
+                x_min + (j_min - margin) / oversampling,
+            ),
+            (
+                y_min + (i_max + margin) / oversampling,
+                x_min + (j_max + margin) / oversampling,
+            ),
+        ]
+        locs = tile_index_locs(tile_index, strip_viewport)
+        locs = locs[_in_viewport(locs, viewport)]
+        _, strip = render(
+            locs,
+            viewport=strip_viewport,
+            oversampling=oversampling,
+            blur_method=blur_method,
+            min_blur_width=min_blur_width,
+        )
+        shifted[i_min:i_max, j_min:j_max] = strip[
+            margin : margin + i_max - i_min, margin : margin + j_max - j_min
+        ]
+    n_locs += _n_locs_between(tile_index, last_viewport, viewport)
+    n_locs -= _n_locs_between(tile_index, viewport, last_viewport)
+    return n_locs, shifted
+
+
+def _in_viewport(locs, viewport):
+    (y_min, x_min), (y_max, x_max) = viewport
+    return (locs.x > x_min) & (locs.y > y_min) & (locs.x < x_max) & (
+        locs.y < y_max
+    )
+
+
+def _n_locs_between(tile_index, inner, outer):
+    """
+    Returns the number of localizations in the viewport outer that are
+    not in the viewport inner
+    """
+    (yi_min, xi_min), (yi_max, xi_max) = inner
+    (yo_min, xo_min), (yo_max, xo_max) = outer
+    # The difference is split into bands above, below, left and right
+    bands = [
+        ([(yo_min, xo_min), (min(yi_min, yo_max), xo_max)], "above"),
+        ([(max(yi_max, yo_min), xo_min), (yo_max, xo_max)], "below"),
+        ([(yi_min, xo_min), (yi_max, min(xi_min, xo_max))], "left"),
+        ([(yi_min, max(xi_max, xo_min)), (yi_max, xo_max)], "right"),
+    ]
+    n = 0
+    for band, side in bands:
+        (y_min, x_min), (y_max, x_max) = band
+        if y_max < y_min or x_max < x_min:
+            continue
+        locs = tile_index_locs(tile_index, band)
+        locs = locs[_in_viewport(locs, outer)]
+        if side == "above":
+            n += _np.sum(locs.y <= yi_min)
+        elif side == "below":
+            n += _np.sum(locs.y >= yi_max)
+        else:
+            in_rows = (locs.y > yi_min) & (locs.y < yi_max)
+            if side == "left":
+                n += _np.sum(in_rows & (locs.x <= xi_min))
+            else:
+                n += _np.sum(in_rows & (locs.x >= xi_max))
+    return int(n)
+
+
 @_numba.jit(nopython=True, nogil=True)
 def _render_setup(locs, oversampling, y_min, x_min, y_max, x_max):
     n_pixel_y = int(_np.ceil(oversampling * (y_max - y_min)))
@@ -68,6 +558,17 @@ def _render_setup(locs, oversampling, y_min, x_min, y_max, x_max):
 @_numba.jit(nopython=True, nogil=True)
 def _render_setup3d(
     locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
+):
+    n_pixel_y, n_pixel_x, n_pixel_z, x, y, z, in_view = _voxel_setup3d(
+        locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
+    )
+    image = _np.zeros((n_pixel_y, n_pixel_x, n_pixel_z), dtype=_np.float32)
+    return image, n_pixel_y, n_pixel_x, n_pixel_z, x, y, z, in_view
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _voxel_setup3d(
+    locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
 ):
     n_pixel_y = int(_np.ceil(oversampling * (y_max - y_min)))
     n_pixel_x = int(_np.ceil(oversampling * (x_max - x_min)))
@@ -89,8 +590,7 @@ def _render_setup3d(
     x = oversampling * (x - x_min)
     y = oversampling * (y - y_min)
     z = oversampling * (z - z_min) / pixelsize
-    image = _np.zeros((n_pixel_y, n_pixel_x, n_pixel_z), dtype=_np.float32)
-    return image, n_pixel_y, n_pixel_x, n_pixel_z, x, y, z, in_view
+    return n_pixel_y, n_pixel_x, n_pixel_z, x, y, z, in_view
 
 
 @_numba.jit(nopython=True, nogil=True)
@@ -155,17 +655,95 @@ def render_hist3d(
     return len(x), image
 
 
-@_numba.jit(nopython=True, nogil=True)
-def render_gaussian(
-    locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
+def render_hist3d_sparse(
+    locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
 ):
-    image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
-        locs, oversampling, y_min, x_min, y_max, x_max
+    """
+    Like render_hist3d, but returns the histogram as a SparseVolume, which
+    only stores the occupied voxels
+    """
+    n_pixel_y, n_pixel_x, n_pixel_z, x, y, z, in_view = _voxel_setup3d(
+        locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
     )
-    blur_width = oversampling * _np.maximum(locs.lpx, min_blur_width)
-    blur_height = oversampling * _np.maximum(locs.lpy, min_blur_width)
-    sy = blur_height[in_view]
-    sx = blur_width[in_view]
+    keys = _voxel_keys(x, y, z, n_pixel_x, n_pixel_z)
+    keys, counts = _np.unique(keys, return_counts=True)
+    shape = (n_pixel_y, n_pixel_x, n_pixel_z)
+    return len(x), SparseVolume(keys, counts.astype(_np.float32), shape)
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _voxel_keys(x, y, z, n_pixel_x, n_pixel_z):
+    keys = _np.empty(len(x), dtype=_np.int64)
+    for m in range(len(x)):
+        i = _np.int64(_np.int32(y[m]))
+        j = _np.int64(_np.int32(x[m]))
+        k = _np.int64(_np.int32(z[m]))
+        keys[m] = (i * n_pixel_x + j) * n_pixel_z + k
+    return keys
+
+
+class SparseVolume:
+    """
+    A 3D histogram of the given (Y, X, Z) shape, stored as the sorted flat
+    C-order indices keys of its occupied voxels and their counts.
+    Projections, slices and binned dense volumes are computed on demand.
+    """
+
+    def __init__(self, keys, counts, shape):
+        self.keys = keys
+        self.counts = counts
+        self.shape = tuple(shape)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.counts.nbytes
+
+    def coordinates(self):
+        """ Returns the y, x and z indices of the occupied voxels """
+        return _np.unravel_index(self.keys, self.shape)
+
+    def project(self, axis):
+        """ Returns the sum along axis, like np.sum(volume, axis) """
+        coordinates = list(self.coordinates())
+        del coordinates[axis]
+        shape = [_ for i, _ in enumerate(self.shape) if i != axis]
+        return _bin_voxels(coordinates, self.counts, shape)
+
+    def slice(self, index, axis=2):
+        """ Returns the plane at index along axis, like np.take """
+        coordinates = list(self.coordinates())
+        in_slice = coordinates.pop(axis) == index
+        coordinates = [_[in_slice] for _ in coordinates]
+        shape = [_ for i, _ in enumerate(self.shape) if i != axis]
+        return _bin_voxels(coordinates, self.counts[in_slice], shape)
+
+    def dense(self, factor=1):
+        """
+        Returns the dense float32 volume, binned by factor voxels along
+        each axis, or along the axes by a tuple of three factors
+        """
+        factor = _np.broadcast_to(factor, 3)
+        coordinates = [_ // f for _, f in zip(self.coordinates(), factor)]
+        shape = [-(-_ // f) for _, f in zip(self.shape, factor)]
+        return _bin_voxels(coordinates, self.counts, shape)
+
+
+def _bin_voxels(coordinates, counts, shape):
+    shape = tuple(int(_) for _ in shape)
+    if len(counts) == 0:
+        return _np.zeros(shape, dtype=_np.float32)
+    index = _np.ravel_multi_index(coordinates, shape)
+    image = _np.bincount(index, counts, minlength=int(_np.prod(shape)))
+    return image.astype(_np.float32).reshape(shape)
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _fill_gaussian(image, x, y, sx, sy, n_pixel_x, n_pixel_y):
+    """
+    Draws each localization as an axis-aligned Gaussian. The blob is the
+    outer product of a 1D y-profile and a 1D x-profile, so only
+    (height + width) exponentials are evaluated per localization.
+    """
     for x_, y_, sx_, sy_ in zip(x, y, sx, sy):
         max_y = _DRAW_MAX_SIGMA * sy_
         i_min = _np.int32(y_ - max_y)
@@ -181,14 +759,36 @@ def render_gaussian(
         j_max = _np.int32(x_ + max_x) + 1
         if j_max > n_pixel_x:
             j_max = n_pixel_x
+        if i_max <= i_min or j_max <= j_min:
+            continue
+        profile_y = _np.empty(i_max - i_min)
+        for i in range(i_min, i_max):
+            profile_y[i - i_min] = _np.exp(
+                -((i - y_ + 0.5) ** 2) / (2 * sy_ ** 2)
+            ) / (2 * _np.pi * sx_ * sy_)
+        profile_x = _np.empty(j_max - j_min)
+        for j in range(j_min, j_max):
+            profile_x[j - j_min] = _np.exp(
+                -((j - x_ + 0.5) ** 2) / (2 * sx_ ** 2)
+            )
         for i in range(i_min, i_max):
+            py = profile_y[i - i_min]
             for j in range(j_min, j_max):
-                image[i, j] += _np.exp(
-                    -(
-                        (j - x_ + 0.5) ** 2 / (2 * sx_ ** 2)
-                        + (i - y_ + 0.5) ** 2 / (2 * sy_ ** 2)
-                    )
-                ) / (2 * _np.pi * sx_ * sy_)
+                image[i, j] += py * profile_x[j - j_min]
+
+
+@_numba.jit(nopython=True, nogil=True)
+def render_gaussian(
+    locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
+):
+    image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
+        locs, oversampling, y_min, x_min, y_max, x_max
+    )
+    blur_width = oversampling * _np.maximum(locs.lpx, min_blur_width)
+    blur_height = oversampling * _np.maximum(locs.lpy, min_blur_width)
+    sy = blur_height[in_view]
+    sx = blur_width[in_view]
+    _fill_gaussian(image, x, y, sx, sy, n_pixel_x, n_pixel_y)
     return len(x), image
 
 
@@ -203,93 +803,1059 @@ def render_gaussian_iso(
     blur_height = oversampling * _np.maximum(locs.lpy, min_blur_width)
     sy = (blur_height[in_view] + blur_width[in_view]) / 2
     sx = sy
-    for x_, y_, sx_, sy_ in zip(x, y, sx, sy):
-        max_y = _DRAW_MAX_SIGMA * sy_
-        i_min = _np.int32(y_ - max_y)
-        if i_min < 0:
-            i_min = 0
-        i_max = _np.int32(y_ + max_y + 1)
-        if i_max > n_pixel_y:
-            i_max = n_pixel_y
-        max_x = _DRAW_MAX_SIGMA * sx_
-        j_min = _np.int32(x_ - max_x)
-        if j_min < 0:
-            j_min = 0
-        j_max = _np.int32(x_ + max_x) + 1
-        if j_max > n_pixel_x:
-            j_max = n_pixel_x
-        for i in range(i_min, i_max):
+    _fill_gaussian(image, x, y, sx, sy, n_pixel_x, n_pixel_y)
+    return len(x), image
+
+
+# Parallel variants of the render kernels. The image rows are split into
+# bands, and a parallel counting sort lists the localizations overlapping
+# each band in their original order. Each band is then drawn by one thread,
+# so every pixel receives its contributions in the same order as in the
+# serial kernels and the images are identical to theirs.
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _band_height(n_rows):
+    n_bands = 4 * _numba.get_num_threads()
+    return max(1, -(-n_rows // n_bands))
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _band_index(row_min, row_max, band_height, n_bands):
+    """
+    Returns index, offsets such that index[offsets[b]:offsets[b + 1]] are
+    the localizations whose rows [row_min, row_max) overlap band b, in
+    ascending order. Rows must be clipped to the image.
+    """
+    n = len(row_min)
+    n_chunks = max(1, min(n, 4 * _numba.get_num_threads()))
+    chunk_bounds = _np.empty(n_chunks + 1, dtype=_np.int64)
+    for c in range(n_chunks + 1):
+        chunk_bounds[c] = c * n // n_chunks
+    counts = _np.zeros((n_chunks, n_bands), dtype=_np.int64)
+    for c in _numba.prange(n_chunks):
+        for k in range(chunk_bounds[c], chunk_bounds[c + 1]):
+            if row_max[k] > row_min[k]:
+                b_min = row_min[k] // band_height
+                b_max = (row_max[k] - 1) // band_height + 1
+                for b in range(b_min, b_max):
+                    counts[c, b] += 1
+    starts = _np.empty((n_chunks, n_bands), dtype=_np.int64)
+    offsets = _np.zeros(n_bands + 1, dtype=_np.int64)
+    position = 0
+    for b in range(n_bands):
+        for c in range(n_chunks):
+            starts[c, b] = position
+            position += counts[c, b]
+        offsets[b + 1] = position
+    index = _np.empty(position, dtype=_np.int64)
+    for c in _numba.prange(n_chunks):
+        for k in range(chunk_bounds[c], chunk_bounds[c + 1]):
+            if row_max[k] > row_min[k]:
+                b_min = row_min[k] // band_height
+                b_max = (row_max[k] - 1) // band_height + 1
+                for b in range(b_min, b_max):
+                    index[starts[c, b]] = k
+                    starts[c, b] += 1
+    return index, offsets
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _fill_parallel(image, x, y):
+    x = x.astype(_np.int32)
+    y = y.astype(_np.int32)
+    band_height = _band_height(image.shape[0])
+    n_bands = -(-image.shape[0] // band_height)
+    index, offsets = _band_index(y, y + 1, band_height, n_bands)
+    for b in _numba.prange(n_bands):
+        for m in range(offsets[b], offsets[b + 1]):
+            k = index[m]
+            image[y[k], x[k]] += 1
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _fill3d_parallel(image, x, y, z):
+    x = x.astype(_np.int32)
+    y = y.astype(_np.int32)
+    z = z.astype(_np.int32)
+    band_height = _band_height(image.shape[0])
+    n_bands = -(-image.shape[0] // band_height)
+    index, offsets = _band_index(y, y + 1, band_height, n_bands)
+    for b in _numba.prange(n_bands):
+        for m in range(offsets[b], offsets[b + 1]):
+            k = index[m]
+            image[y[k], x[k], z[k]] += 1
+    return image
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _fill_gaussian_parallel(image, x, y, sx, sy, n_pixel_x, n_pixel_y):
+    n = len(x)
+    i_min = _np.empty(n, dtype=_np.int64)
+    i_max = _np.empty(n, dtype=_np.int64)
+    for k in _numba.prange(n):
+        max_y = _DRAW_MAX_SIGMA * sy[k]
+        i_min[k] = max(_np.int32(y[k] - max_y), 0)
+        i_max[k] = min(_np.int32(y[k] + max_y + 1), n_pixel_y)
+    band_height = _band_height(n_pixel_y)
+    n_bands = -(-n_pixel_y // band_height)
+    index, offsets = _band_index(i_min, i_max, band_height, n_bands)
+    for b in _numba.prange(n_bands):
+        band_min = b * band_height
+        band_max = min(band_min + band_height, n_pixel_y)
+        for m in range(offsets[b], offsets[b + 1]):
+            k = index[m]
+            x_ = x[k]
+            y_ = y[k]
+            sx_ = sx[k]
+            sy_ = sy[k]
+            max_x = _DRAW_MAX_SIGMA * sx_
+            j_min = _np.int32(x_ - max_x)
+            if j_min < 0:
+                j_min = 0
+            j_max = _np.int32(x_ + max_x) + 1
+            if j_max > n_pixel_x:
+                j_max = n_pixel_x
+            if j_max <= j_min:
+                continue
+            profile_x = _np.empty(j_max - j_min)
             for j in range(j_min, j_max):
-                image[i, j] += _np.exp(
-                    -(
-                        (j - x_ + 0.5) ** 2 / (2 * sx_ ** 2)
-                        + (i - y_ + 0.5) ** 2 / (2 * sy_ ** 2)
-                    )
-                ) / (2 * _np.pi * sx_ * sy_)
+                profile_x[j - j_min] = _np.exp(
+                    -((j - x_ + 0.5) ** 2) / (2 * sx_ ** 2)
+                )
+            for i in range(max(i_min[k], band_min), min(i_max[k], band_max)):
+                py = _np.exp(-((i - y_ + 0.5) ** 2) / (2 * sy_ ** 2)) / (
+                    2 * _np.pi * sx_ * sy_
+                )
+                for j in range(j_min, j_max):
+                    image[i, j] += py * profile_x[j - j_min]
+
+
+@_numba.jit(nopython=True, nogil=True)
+def render_hist_parallel(locs, oversampling, y_min, x_min, y_max, x_max):
+    image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
+        locs, oversampling, y_min, x_min, y_max, x_max
+    )
+    _fill_parallel(image, x, y)
     return len(x), image
 
 
-def render_convolve(
+@_numba.jit(nopython=True, nogil=True)
+def render_histz_parallel(
+    locs, oversampling, x_min, z_min, x_max, z_max, pixelsize
+):
+    image, n_pixel_z, n_pixel_x, x, z, in_view = _render_setupz(
+        locs, oversampling, x_min, z_min, x_max, z_max, pixelsize
+    )
+    _fill_parallel(image, z, x)
+    return len(x), image
+
+
+@_numba.jit(nopython=True, nogil=True)
+def render_hist3d_parallel(
+    locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
+):
+    image, n_pixel_y, n_pixel_x, n_pixel_z, x, y, z, in_view = _render_setup3d(
+        locs, oversampling, y_min, x_min, y_max, x_max, z_min, z_max, pixelsize
+    )
+    _fill3d_parallel(image, x, y, z)
+    return len(x), image
+
+
+@_numba.jit(nopython=True, nogil=True)
+def render_gaussian_parallel(
     locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
 ):
     image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
         locs, oversampling, y_min, x_min, y_max, x_max
     )
-    _fill(image, x, y)
+    blur_width = oversampling * _np.maximum(locs.lpx, min_blur_width)
+    blur_height = oversampling * _np.maximum(locs.lpy, min_blur_width)
+    sy = blur_height[in_view]
+    sx = blur_width[in_view]
+    _fill_gaussian_parallel(image, x, y, sx, sy, n_pixel_x, n_pixel_y)
+    return len(x), image
+
+
+@_numba.jit(nopython=True, nogil=True)
+def render_gaussian_iso_parallel(
+    locs, oversampling, y_min, x_min, y_max, x_max, min_blur_width
+):
+    image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
+        locs, oversampling, y_min, x_min, y_max, x_max
+    )
+    blur_width = oversampling * _np.maximum(locs.lpx, min_blur_width)
+    blur_height = oversampling * _np.maximum(locs.lpy, min_blur_width)
+    sy = (blur_height[in_view] + blur_width[in_view]) / 2
+    sx = sy
+    _fill_gaussian_parallel(image, x, y, sx, sy, n_pixel_x, n_pixel_y)
+    return len(x), image
+
+
+def _fill_multi_hist_py(image, x, y, channel, weights, index, offsets):
+    n_planes = image.shape[0]
+    for b in _numba.prange(len(offsets) - 1):
+        for m in range(offsets[b], offsets[b + 1]):
+            k = index[m]
+            i = _np.int32(y[k])
+            j = _np.int32(x[k])
+            if weights.shape[0] == 0:
+                image[channel[k], i, j] += 1
+            else:
+                for p in range(n_planes):
+                    image[p, i, j] += weights[channel[k], p]
+
+
+def _fill_multi_gaussian_py(
+    image,
+    x,
+    y,
+    sx,
+    sy,
+    channel,
+    weights,
+    row_min,
+    row_max,
+    index,
+    offsets,
+    band_height,
+):
+    """ Draws like _fill_gaussian_parallel, band by band """
+    n_planes, n_pixel_y, n_pixel_x = image.shape
+    for b in _numba.prange(len(offsets) - 1):
+        band_min = b * band_height
+        band_max = min(band_min + band_height, n_pixel_y)
+        for m in range(offsets[b], offsets[b + 1]):
+            k = index[m]
+            x_ = x[k]
+            y_ = y[k]
+            sx_ = sx[k]
+            sy_ = sy[k]
+            c = channel[k]
+            max_x = _DRAW_MAX_SIGMA * sx_
+            j_min = _np.int32(x_ - max_x)
+            if j_min < 0:
+                j_min = 0
+            j_max = _np.int32(x_ + max_x) + 1
+            if j_max > n_pixel_x:
+                j_max = n_pixel_x
+            if j_max <= j_min:
+                continue
+            profile_x = _np.empty(j_max - j_min)
+            for j in range(j_min, j_max):
+                profile_x[j - j_min] = _np.exp(
+                    -((j - x_ + 0.5) ** 2) / (2 * sx_ ** 2)
+                )
+            i_min = max(row_min[k], band_min)
+            i_max = min(row_max[k], band_max)
+            for i in range(i_min, i_max):
+                py = _np.exp(-((i - y_ + 0.5) ** 2) / (2 * sy_ ** 2)) / (
+                    2 * _np.pi * sx_ * sy_
+                )
+                if weights.shape[0] == 0:
+                    for j in range(j_min, j_max):
+                        image[c, i, j] += py * profile_x[j - j_min]
+                else:
+                    for p in range(n_planes):
+                        w = weights[c, p]
+                        if w == 0:
+                            continue
+                        for j in range(j_min, j_max):
+                            image[p, i, j] += w * py * profile_x[j - j_min]
+
+
+_fill_multi_hist = _numba.jit(nopython=True, nogil=True)(_fill_multi_hist_py)
+_fill_multi_hist_parallel = _numba.jit(
+    nopython=True, nogil=True, parallel=True
+)(_fill_multi_hist_py)
+_fill_multi_gaussian = _numba.jit(nopython=True, nogil=True)(
+    _fill_multi_gaussian_py
+)
+_fill_multi_gaussian_parallel = _numba.jit(
+    nopython=True, nogil=True, parallel=True
+)(_fill_multi_gaussian_py)
+
+
+def render_convolve(
+    locs,
+    oversampling,
+    y_min,
+    x_min,
+    y_max,
+    x_max,
+    min_blur_width,
+    parallel=False,
+    blur_widths=None,
+):
+    image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
+        locs, oversampling, y_min, x_min, y_max, x_max
+    )
+    if parallel:
+        _fill_parallel(image, x, y)
+    else:
+        _fill(image, x, y)
     n = len(x)
     if n == 0:
         return 0, image
     else:
-        blur_width = oversampling * max(
-            _np.median(locs.lpx[in_view]), min_blur_width
-        )
-        blur_height = oversampling * max(
-            _np.median(locs.lpy[in_view]), min_blur_width
+        if blur_widths is None:
+            blur_width = oversampling * max(
+                _np.median(locs.lpx[in_view]), min_blur_width
+            )
+            blur_height = oversampling * max(
+                _np.median(locs.lpy[in_view]), min_blur_width
+            )
+        else:
+            blur_height, blur_width = blur_widths
+        return n, gaussian_filter(
+            image, blur_height, blur_width, parallel=parallel
         )
-        return n, _fftconvolve(image, blur_width, blur_height)
 
 
-def render_smooth(locs, oversampling, y_min, x_min, y_max, x_max):
+def render_smooth(
+    locs, oversampling, y_min, x_min, y_max, x_max, parallel=False
+):
     image, n_pixel_y, n_pixel_x, x, y, in_view = _render_setup(
         locs, oversampling, y_min, x_min, y_max, x_max
     )
-    _fill(image, x, y)
+    if parallel:
+        _fill_parallel(image, x, y)
+    else:
+        _fill(image, x, y)
     n = len(x)
     if n == 0:
         return 0, image
     else:
-        return n, _fftconvolve(image, 1, 1)
+        return n, gaussian_filter(image, 1, 1, parallel=parallel)
+
+
+def gaussian_filter(image, sigma_y, sigma_x, recursive=None, parallel=True):
+    """
+    Blurs a 2D float32 image in place with a Gaussian of sigma_y, sigma_x
+    pixels, as separable 1D passes over the rows and the columns. By
+    default the kernel is truncated at 5 * round(sigma), with zeros beyond
+    the image border. With recursive=True, the recursive Young-van Vliet
+    filter is used instead, whose cost does not depend on sigma. This is
+    the default for sigmas above _RECURSIVE_MIN_SIGMA.
+    """
+    if image.dtype != _np.float32 or not image.flags.c_contiguous:
+        raise ValueError("image must be a C-contiguous float32 array.")
+    if recursive is None:
+        recursive = max(sigma_y, sigma_x) > _RECURSIVE_MIN_SIGMA
+    if parallel:
+        rows, columns = _filter_rows_parallel, _filter_columns_parallel
+    else:
+        rows, columns = _filter_rows, _filter_columns
+    for sigma, filter_ in [(sigma_x, rows), (sigma_y, columns)]:
+        if recursive:
+            if sigma >= 0.5:
+                filter_(image, _np.zeros(0), _recursive_coefficients(sigma))
+        else:
+            kernel = _gaussian_kernel(sigma)
+            if len(kernel) > 1:
+                filter_(image, kernel, _np.zeros(0))
+    return image
+
+
+def _gaussian_kernel(sigma):
+    """ The kernel of the former scipy.signal.fftconvolve based blur """
+    radius = 5 * int(_np.round(sigma))
+    k = _np.arange(-radius, radius + 1)
+    kernel = _np.exp(-0.5 * (k / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def _recursive_coefficients(sigma):
+    """
+    Coefficients of the recursive Gaussian filter of Young and van Vliet,
+    Signal Processing 44 (1995), normalized by b0 and with the gain first.
+    The last entry is the length of the zero padding that the filter runs
+    through at the end of each line.
+    """
+    if sigma >= 2.5:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * _np.sqrt(1 - 0.26891 * sigma)
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q ** 2 + 0.422205 * q ** 3
+    b1 = 2.44413 * q + 2.85619 * q ** 2 + 1.26661 * q ** 3
+    b2 = -(1.4281 * q ** 2 + 1.26661 * q ** 3)
+    b3 = 0.422205 * q ** 3
+    gain = 1 - (b1 + b2 + b3) / b0
+    tail = _np.ceil(_RECURSIVE_TAIL * sigma)
+    return _np.array([gain, b1 / b0, b2 / b0, b3 / b0, tail])
+
+
+def _filter_rows_py(image, kernel, coefficients):
+    """
+    Filters each row in place, with the kernel if it is given, or else
+    with the recursive filter of the coefficients
+    """
+    n_rows, n_cols = image.shape
+    radius = (len(kernel) - 1) // 2
+    for i in _numba.prange(n_rows):
+        if len(kernel) > 0:
+            row = _np.zeros(n_cols + 2 * radius, dtype=_np.float32)
+            row[radius : radius + n_cols] = image[i]
+            for j in range(n_cols):
+                value = 0.0
+                for k in range(len(kernel)):
+                    value += kernel[k] * row[j + k]
+                image[i, j] = value
+        else:
+            gain = coefficients[0]
+            b1 = coefficients[1]
+            b2 = coefficients[2]
+            b3 = coefficients[3]
+            # The forward pass runs into the zero padding beyond the row,
+            # where the backward pass starts
+            tail = _np.zeros(int(coefficients[4]))
+            w1 = w2 = w3 = 0.0
+            for j in range(n_cols):
+                w = gain * image[i, j] + b1 * w1 + b2 * w2 + b3 * w3
+                image[i, j] = w
+                w3, w2, w1 = w2, w1, w
+            for j in range(len(tail)):
+                w = b1 * w1 + b2 * w2 + b3 * w3
+                tail[j] = w
+                w3, w2, w1 = w2, w1, w
+            w1 = w2 = w3 = 0.0
+            for j in range(len(tail) - 1, -1, -1):
+                w = gain * tail[j] + b1 * w1 + b2 * w2 + b3 * w3
+                w3, w2, w1 = w2, w1, w
+            for j in range(n_cols - 1, -1, -1):
+                w = gain * image[i, j] + b1 * w1 + b2 * w2 + b3 * w3
+                image[i, j] = w
+                w3, w2, w1 = w2, w1, w
+
+
+_FILTER_BLOCK = 64
+
 
+def _filter_columns_py(image, kernel, coefficients):
+    """
+    Filters each column in place. The columns are processed in blocks,
+    so that the inner loops run along the contiguous rows.
+    """
+    n_rows, n_cols = image.shape
+    radius = (len(kernel) - 1) // 2
+    n_blocks = -(-n_cols // _FILTER_BLOCK)
+    for b in _numba.prange(n_blocks):
+        j_min = b * _FILTER_BLOCK
+        j_max = min(j_min + _FILTER_BLOCK, n_cols)
+        width = j_max - j_min
+        if len(kernel) > 0:
+            block = _np.zeros((n_rows + 2 * radius, width), dtype=_np.float32)
+            block[radius : radius + n_rows] = image[:, j_min:j_max]
+            value = _np.empty(width)
+            for i in range(n_rows):
+                value[:] = 0
+                for k in range(len(kernel)):
+                    for j in range(width):
+                        value[j] += kernel[k] * block[i + k, j]
+                for j in range(width):
+                    image[i, j_min + j] = value[j]
+        else:
+            gain = coefficients[0]
+            b1 = coefficients[1]
+            b2 = coefficients[2]
+            b3 = coefficients[3]
+            tail = _np.zeros((int(coefficients[4]), width))
+            w1 = _np.zeros(width)
+            w2 = _np.zeros(width)
+            w3 = _np.zeros(width)
+            for i in range(n_rows + len(tail)):
+                for j in range(width):
+                    if i < n_rows:
+                        x = image[i, j_min + j]
+                    else:
+                        x = 0.0
+                    w = gain * x + b1 * w1[j] + b2 * w2[j] + b3 * w3[j]
+                    if i < n_rows:
+                        image[i, j_min + j] = w
+                    else:
+                        tail[i - n_rows, j] = w
+                    w3[j] = w2[j]
+                    w2[j] = w1[j]
+                    w1[j] = w
+            w1[:] = 0
+            w2[:] = 0
+            w3[:] = 0
+            for i in range(n_rows + len(tail) - 1, -1, -1):
+                for j in range(width):
+                    if i < n_rows:
+                        x = image[i, j_min + j]
+                    else:
+                        x = tail[i - n_rows, j]
+                    w = gain * x + b1 * w1[j] + b2 * w2[j] + b3 * w3[j]
+                    if i < n_rows:
+                        image[i, j_min + j] = w
+                    w3[j] = w2[j]
+                    w2[j] = w1[j]
+                    w1[j] = w
 
-def _fftconvolve(image, blur_width, blur_height):
-    kernel_width = 10 * int(_np.round(blur_width)) + 1
-    kernel_height = 10 * int(_np.round(blur_height)) + 1
-    kernel_y = _signal.gaussian(kernel_height, blur_height)
-    kernel_x = _signal.gaussian(kernel_width, blur_width)
-    kernel = _np.outer(kernel_y, kernel_x)
-    kernel /= kernel.sum()
-    return _signal.fftconvolve(image, kernel, mode="same")
+
+_filter_rows = _numba.jit(nopython=True, nogil=True)(_filter_rows_py)
+_filter_rows_parallel = _numba.jit(nopython=True, nogil=True, parallel=True)(
+    _filter_rows_py
+)
+_filter_columns = _numba.jit(nopython=True, nogil=True)(_filter_columns_py)
+_filter_columns_parallel = _numba.jit(
+    nopython=True, nogil=True, parallel=True
+)(_filter_columns_py)
+
+
+def to_bgra(images, lower, upper, colors, out=None, invert=False):
+    """
+    Converts float images (C, Y, X) to a uint8 BGRA image for display, in
+    one pass. The images are scaled from [lower, upper] to [0, 1],
+    weighted with their (r, g, b) colors and summed, with the sum clipped
+    to 1. Non-finite pixels are black. With invert, the result is
+    inverted for a white background. The image is written into out if it
+    is a (Y, X, 4) uint8 array, so that a display buffer can be reused.
+    """
+    n_y, n_x = images.shape[1:]
+    out = _bgra_buffer(out, n_y, n_x)
+    weights = _np.array(colors, dtype=_np.float64)[:, ::-1].copy()
+    _to_bgra(images, float(lower), float(upper), weights, invert, out)
+    return out
+
+
+def to_bgra_lut(image, lower, upper, lut, out=None):
+    """
+    Converts a float image (Y, X) to a uint8 BGRA image for display, in
+    one pass. The image is scaled from [lower, upper] to the entries of
+    lut, a (256, 3) uint8 RGB colormap. out is reused as in to_bgra.
+    """
+    n_y, n_x = image.shape
+    out = _bgra_buffer(out, n_y, n_x)
+    lut = _np.ascontiguousarray(lut[:, 2::-1], dtype=_np.uint8)
+    _to_bgra_lut(image, float(lower), float(upper), lut, out)
+    return out
+
+
+def _bgra_buffer(out, n_y, n_x):
+    if (
+        out is None
+        or out.shape != (n_y, n_x, 4)
+        or out.dtype != _np.uint8
+        or not out.flags.c_contiguous
+    ):
+        out = _np.empty((n_y, n_x, 4), dtype=_np.uint8)
+    return out
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _scale(value, lower, scale):
+    value = (value - lower) * scale
+    if not _np.isfinite(value) or value < 0:
+        return 0.0
+    if value > 1:
+        return 1.0
+    return value
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _to_bgra(images, lower, upper, weights, invert, out):
+    n_channels, n_y, n_x = images.shape
+    scale = 1 / (upper - lower)
+    for i in _numba.prange(n_y):
+        pixel = _np.empty(3)
+        for j in range(n_x):
+            pixel[:] = 0
+            for c in range(n_channels):
+                value = _scale(images[c, i, j], lower, scale)
+                if value > 0:
+                    for k in range(3):
+                        pixel[k] += weights[c, k] * value
+            for k in range(3):
+                value = min(max(pixel[k], 0.0), 1.0)
+                if invert:
+                    value = 1 - value
+                out[i, j, k] = _np.uint8(255 * value + 0.5)
+            out[i, j, 3] = 255
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _to_bgra_lut(image, lower, upper, lut, out):
+    n_y, n_x = image.shape
+    scale = 1 / (upper - lower)
+    for i in _numba.prange(n_y):
+        for j in range(n_x):
+            k = _np.int64(255 * _scale(image[i, j], lower, scale) + 0.5)
+            out[i, j, 0] = lut[k, 0]
+            out[i, j, 1] = lut[k, 1]
+            out[i, j, 2] = lut[k, 2]
+            out[i, j, 3] = 255
+
+
+def image_shape(viewport, oversampling):
+    """ Returns the number of pixels of a rendering of viewport """
+    (y_min, x_min), (y_max, x_max) = viewport
+    n_pixel_y = int(_np.ceil(oversampling * (y_max - y_min)))
+    n_pixel_x = int(_np.ceil(oversampling * (x_max - x_min)))
+    return n_pixel_y, n_pixel_x
+
+
+def blur_halo(oversampling, blur_method, min_blur_width, max_blur_width):
+    """
+    Returns how many pixels the blur of a localization reaches beyond
+    its pixel, given the largest localization precision max_blur_width
+    """
+    max_blur = oversampling * max(max_blur_width, min_blur_width)
+    if blur_method in ["gaussian", "gaussian_iso"]:
+        return int(_np.ceil(_DRAW_MAX_SIGMA * max_blur)) + 2
+    elif blur_method == "convolve":
+        return 5 * int(_np.round(max_blur)) + 1
+    elif blur_method == "smooth":
+        return 6
+    return 0
+
+
+def tile_viewports(viewport, oversampling, tile_shape, halo):
+    """
+    Splits the rendering of viewport into square tiles of tile_shape
+    pixels. Yields the pixel bounds (i_min, i_max, j_min, j_max) of each
+    tile and the viewport of the tile, widened by halo pixels.
+    """
+    (y_min, x_min), (y_max, x_max) = viewport
+    n_pixel_y, n_pixel_x = image_shape(viewport, oversampling)
+    for i_min in range(0, n_pixel_y, tile_shape):
+        i_max = min(i_min + tile_shape, n_pixel_y)
+        for j_min in range(0, n_pixel_x, tile_shape):
+            j_max = min(j_min + tile_shape, n_pixel_x)
+            tile_viewport = [
+                (
+                    y_min + (i_min - halo) / oversampling,
+                    x_min + (j_min - halo) / oversampling,
+                ),
+                (
+                    y_min + (i_max + halo) / oversampling,
+                    x_min + (j_max + halo) / oversampling,
+                ),
+            ]
+            yield (i_min, i_max, j_min, j_max), tile_viewport
+
+
+def render_tiled(
+    locs,
+    info,
+    image,
+    oversampling=1,
+    viewport=None,
+    blur_method=None,
+    min_blur_width=0,
+    tile_shape=2048,
+    callback=None,
+):
+    """
+    Renders like render, but into image, a float32 array of
+    image_shape(viewport, oversampling) that can be a disk-backed
+    np.memmap, one tile at a time. Each tile is rendered with a halo of
+    the blur width and only the localizations in viewport, so that
+    blobs and blur continue across tile edges. The halo of Gaussian
+    blobs covers all but the widest _TILED_OUTLIER_FRACTION of them, and
+    at most half a tile; those widest blobs are drawn into each tile
+    separately. Returns the number of localizations and the largest
+    pixel value, to set the contrast.
+    """
+    if viewport is None:
+        viewport = [(0, 0), (info[0]["Height"], info[0]["Width"])]
+    tile_index = get_tile_index(locs, info)
+    in_view = _in_viewport(locs, viewport)
+    n_locs = int(_np.sum(in_view))
+    max_blur_width = 0
+    blur_widths = None
+    outliers = None
+    if n_locs > 0 and blur_method == "convolve":
+        # Blur widths that depend on all localizations in view
+        blur_widths = (
+            oversampling * max(_np.median(locs.lpy[in_view]), min_blur_width),
+            oversampling * max(_np.median(locs.lpx[in_view]), min_blur_width),
+        )
+        max_blur_width = max(blur_widths) / oversampling
+    elif n_locs > 0 and blur_method in ["gaussian", "gaussian_iso"]:
+        lp = _np.maximum(locs.lpx, locs.lpy)
+        max_blur_width = min(
+            _np.quantile(lp[in_view], 1 - _TILED_OUTLIER_FRACTION),
+            tile_shape / (2 * _DRAW_MAX_SIGMA * oversampling),
+        )
+        is_outlier = in_view & (lp > max_blur_width)
+        if _np.any(is_outlier):
+            outliers = locs[is_outlier]
+    halo = blur_halo(oversampling, blur_method, min_blur_width, max_blur_width)
+    image_max = 0
+    if callback is not None:
+        callback(0)
+    tiles = tile_viewports(viewport, oversampling, tile_shape, halo)
+    for k, (bounds, tile_viewport) in enumerate(tiles):
+        i_min, i_max, j_min, j_max = bounds
+        tile_locs = tile_index_locs(tile_index, tile_viewport)
+        tile_locs = tile_locs[_in_viewport(tile_locs, viewport)]
+        if outliers is not None:
+            is_inlier = _np.maximum(tile_locs.lpx, tile_locs.lpy) <= (
+                max_blur_width
+            )
+            tile_locs = tile_locs[is_inlier]
+        _, tile = render(
+            tile_locs,
+            viewport=tile_viewport,
+            oversampling=oversampling,
+            blur_method=blur_method,
+            min_blur_width=min_blur_width,
+            blur_widths=blur_widths,
+        )
+        if outliers is not None:
+            _draw_outliers(
+                tile,
+                outliers,
+                tile_viewport,
+                oversampling,
+                blur_method,
+                min_blur_width,
+            )
+        tile = tile[halo : halo + i_max - i_min, halo : halo + j_max - j_min]
+        image[i_min:i_max, j_min:j_max] = tile
+        image_max = max(image_max, float(tile.max()))
+        if callback is not None:
+            callback(k + 1)
+    return n_locs, image_max
+
+
+def _draw_outliers(
+    tile, locs, tile_viewport, oversampling, blur_method, min_blur_width
+):
+    """
+    Adds the Gaussian blobs of localizations to a tile, also of those
+    outside of it, with the coordinates and widths of render_gaussian
+    """
+    (y_min, x_min), (y_max, x_max) = tile_viewport
+    x = oversampling * (locs.x.astype(_np.float64) - x_min)
+    y = oversampling * (locs.y.astype(_np.float64) - y_min)
+    sx = oversampling * _np.maximum(locs.lpx.astype(_np.float64), min_blur_width)
+    sy = oversampling * _np.maximum(locs.lpy.astype(_np.float64), min_blur_width)
+    if blur_method == "gaussian_iso":
+        sx = sy = (sy + sx) / 2
+    n_pixel_y, n_pixel_x = tile.shape
+    _fill_gaussian(tile, x, y, sx, sy, n_pixel_x, n_pixel_y)
 
 
 def segment(locs, info, segmentation, kwargs={}, callback=None):
+    """
+    Renders the localizations of consecutive segments of segmentation
+    frames. Returns the frame bounds and a float32 stack of the segment
+    images.
+    """
     Y = info[0]["Height"]
     X = info[0]["Width"]
-    n_frames = info[0]["Frames"]
     n_seg = n_segments(info, segmentation)
-    bounds = _np.linspace(0, n_frames - 1, n_seg + 1, dtype=_np.uint32)
-    segments = _np.zeros((n_seg, Y, X))
+    segments = _np.zeros((n_seg, Y, X), dtype=_np.float32)
+    for i, image in enumerate(
+        iter_segments(locs, info, segmentation, kwargs, callback)
+    ):
+        segments[i] = image
+    return segment_bounds(info, segmentation), segments
+
+
+def iter_segments(locs, info, segmentation, kwargs={}, callback=None):
+    """
+    Yields the images of the segments in order, without keeping them.
+    The localizations are sorted by frame once and each segment is sliced
+    with searchsorted. Segments are rendered in a thread pool, a few
+    segments ahead of the consumer.
+    """
+    bounds = segment_bounds(info, segmentation)
+    n_seg = len(bounds) - 1
+    frame = locs.frame
+    if _np.any(frame[1:] < frame[:-1]):
+        locs = locs[_np.argsort(frame, kind="stable")]
+        frame = locs.frame
+    starts = _np.searchsorted(frame, bounds)
+    # The threads use the serial kernels, which release the GIL
+    kwargs = dict(kwargs, parallel=False)
+
+    def render_segment(i):
+        return render(locs[starts[i] : starts[i + 1]], info, **kwargs)[1]
+
+    return _iter_pool(
+        render_segment, n_seg, callback, "Generating segments", "segments"
+    )
+
+
+def iter_slices(locs, info, z_edges, kwargs={}, callback=None):
+    """
+    Yields the images of the z slices between consecutive z_edges in
+    order, where slice i holds the localizations with
+    z_edges[i] < z <= z_edges[i + 1], as in the slicer of Picasso Render.
+    The localizations are sorted by z once and each slice is cut out with
+    searchsorted. Slices are rendered in a thread pool. locs can also be
+    a list of channels, then each image is the (C, Y, X) stack of
+    render_multi.
+    """
+    channels = locs if isinstance(locs, list) else [locs]
+    sorted_channels = []
+    for locs_ in channels:
+        locs_ = locs_[_np.argsort(locs_.z, kind="stable")]
+        starts = _np.searchsorted(locs_.z, z_edges, side="right")
+        sorted_channels.append((locs_, starts))
+    kwargs = dict(kwargs, parallel=False)
+
+    def render_slice(i):
+        slice_locs = [_[0][_[1][i] : _[1][i + 1]] for _ in sorted_channels]
+        if isinstance(locs, list):
+            return render_multi(slice_locs, info, **kwargs)[1]
+        return render(slice_locs[0], info, **kwargs)[1]
+
+    return _iter_pool(
+        render_slice, len(z_edges) - 1, callback, "Rendering slices", "slices"
+    )
+
+
+def _iter_pool(function, n, callback, desc, unit):
+    """
+    Yields function(i) for i in range(n) in order. The results are
+    computed in a thread pool, a few items ahead of the consumer.
+    """
+    n_workers = _multiprocessing.cpu_count()
     if callback is not None:
         callback(0)
-    for i in _trange(n_seg, desc="Generating segments", unit="segments"):
-        segment_locs = locs[
-            (locs.frame >= bounds[i]) & (locs.frame < bounds[i + 1])
-        ]
-        _, segments[i] = render(segment_locs, info, **kwargs)
-        if callback is not None:
-            callback(i + 1)
-    return bounds, segments
+    with _futures.ThreadPoolExecutor(n_workers) as executor:
+        fs = _deque()
+        n_submitted = 0
+        for i in _trange(n, desc=desc, unit=unit):
+            while n_submitted < n and len(fs) < 2 * n_workers:
+                fs.append(executor.submit(function, n_submitted))
+                n_submitted += 1
+            result = fs.popleft().result()
+            if callback is not None:
+                callback(i + 1)
+            yield result
+
+
+def segment_bounds(info, segmentation):
+    """ Returns the first frame of each segment and the last frame """
+    n_frames = info[0]["Frames"]
+    n_seg = n_segments(info, segmentation)
+    return _np.linspace(0, n_frames - 1, n_seg + 1, dtype=_np.uint32)
 
 
 def n_segments(info, segmentation):
     n_frames = info[0]["Frames"]
     return int(_np.round(n_frames / segmentation))
+
+
+class ImagePyramid:
+    """
+    Cache of histogram renderings at power-of-two oversamplings, stored in
+    square tiles of tile_shape pixels. Tiles are rendered on demand or by
+    a background build, and the least recently used tiles are dropped
+    once the cache exceeds memory_limit bytes. Views up to
+    max_oversampling are composed from the tiles of the next finer level.
+    """
+
+    def __init__(
+        self,
+        tile_index,
+        tile_shape=256,
+        max_oversampling=8,
+        memory_limit=256e6,
+    ):
+        self.tile_index = tile_index
+        self.tile_shape = tile_shape
+        self.memory_limit = memory_limit
+        _, tile_size, n_tiles_y, n_tiles_x, _ = tile_index
+        self.height = n_tiles_y * tile_size
+        self.width = n_tiles_x * tile_size
+        self.max_level = int(_np.floor(_np.log2(max_oversampling)))
+        extent = max(self.height, self.width)
+        self.min_level = min(
+            int(_np.floor(_np.log2(tile_shape / extent))), self.max_level
+        )
+        self.nbytes = 0
+        self._tiles = _OrderedDict()
+        self._lock = _threading.Lock()
+        self._cancelled = False
+        self._thread = None
+
+    def level(self, oversampling):
+        """
+        Returns the coarsest level that is at least as fine as
+        oversampling, or None if oversampling is too high for the pyramid
+        """
+        level = int(_np.ceil(_np.log2(oversampling) - 1e-9))
+        if level > self.max_level:
+            return None
+        return max(level, self.min_level)
+
+    def n_tiles(self, level):
+        camera_size = self.tile_shape / 2.0 ** level
+        n_tiles_y = int(_np.ceil(self.height / camera_size))
+        n_tiles_x = int(_np.ceil(self.width / camera_size))
+        return n_tiles_y, n_tiles_x
+
+    def render(self, viewport, oversampling):
+        """
+        Returns (n_locs, image) like render with the histogram method,
+        or None if the view is too deeply zoomed for the pyramid. The
+        tiles are binned to the requested pixels by area, so n_locs is
+        only exact up to localizations in partially covered pixels.
+        """
+        level = self.level(oversampling)
+        if level is None:
+            return None
+        scale = 2.0 ** level
+        camera_size = self.tile_shape / scale
+        n_tiles_y, n_tiles_x = self.n_tiles(level)
+        (y_min, x_min), (y_max, x_max) = viewport
+        n_pixel_y = int(_np.ceil(oversampling * (y_max - y_min)))
+        n_pixel_x = int(_np.ceil(oversampling * (x_max - x_min)))
+        k_min, k_max = _np.clip(
+            _np.floor(_np.array([y_min, y_max]) / camera_size),
+            0,
+            n_tiles_y - 1,
+        ).astype(int)
+        l_min, l_max = _np.clip(
+            _np.floor(_np.array([x_min, x_max]) / camera_size),
+            0,
+            n_tiles_x - 1,
+        ).astype(int)
+        T = self.tile_shape
+        region = _np.zeros(
+            ((k_max - k_min + 1) * T, (l_max - l_min + 1) * T),
+            dtype=_np.float32,
+        )
+        for k in range(k_min, k_max + 1):
+            for l in range(l_min, l_max + 1):
+                region[
+                    (k - k_min) * T : (k - k_min + 1) * T,
+                    (l - l_min) * T : (l - l_min + 1) * T,
+                ] = self.get_tile(level, k, l)
+        edges_y = y_min + _np.arange(n_pixel_y + 1) / oversampling
+        edges_x = x_min + _np.arange(n_pixel_x + 1) / oversampling
+        edges_y = scale * (edges_y - k_min * camera_size)
+        edges_x = scale * (edges_x - l_min * camera_size)
+        image = _rebin(_rebin(region, edges_y, 0), edges_x, 1)
+        return int(_np.round(image.sum())), image
+
+    def get_tile(self, level, k, l, parallel=True):
+        key = (level, k, l)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+        tile = self._reduce_children(level, k, l)
+        if tile is None:
+            tile = self._render_tile(level, k, l, parallel)
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = tile
+                self.nbytes += tile.nbytes
+            while self.nbytes > self.memory_limit and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return tile
+
+    def _render_tile(self, level, k, l, parallel):
+        scale = 2.0 ** level
+        camera_size = self.tile_shape / scale
+        viewport = [
+            (k * camera_size, l * camera_size),
+            ((k + 1) * camera_size, (l + 1) * camera_size),
+        ]
+        locs = tile_index_locs(self.tile_index, viewport)
+        (y_min, x_min), (y_max, x_max) = viewport
+        if parallel:
+            _, tile = render_hist_parallel(
+                locs, scale, y_min, x_min, y_max, x_max
+            )
+        else:
+            _, tile = render_hist(locs, scale, y_min, x_min, y_max, x_max)
+        return tile
+
+    def _reduce_children(self, level, k, l):
+        """
+        Sums the 2x2 pixel blocks of the four tiles one level finer, if
+        they are all cached
+        """
+        if level >= self.max_level:
+            return None
+        n_tiles_y, n_tiles_x = self.n_tiles(level + 1)
+        children = []
+        with self._lock:
+            for i in range(2):
+                for j in range(2):
+                    key = (level + 1, 2 * k + i, 2 * l + j)
+                    if key in self._tiles:
+                        children.append(self._tiles[key])
+                    elif key[1] >= n_tiles_y or key[2] >= n_tiles_x:
+                        children.append(None)
+                    else:
+                        return None
+        T = self.tile_shape
+        h = T // 2
+        tile = _np.zeros((T, T), dtype=_np.float32)
+        for (i, j), child in zip(
+            [(0, 0), (0, 1), (1, 0), (1, 1)], children
+        ):
+            if child is not None:
+                tile[i * h : (i + 1) * h, j * h : (j + 1) * h] = child.reshape(
+                    h, 2, h, 2
+                ).sum(axis=(1, 3))
+        return tile
+
+    def build_async(self, oversampling):
+        """
+        Renders all tiles of the level for oversampling in a background
+        thread, then reduces them into the coarser levels. Levels whose
+        tiles would fill more than half of the memory limit are skipped.
+        """
+        level = self.level(oversampling)
+        if level is None:
+            level = self.max_level
+        while level > self.min_level:
+            n_tiles_y, n_tiles_x = self.n_tiles(level)
+            nbytes = n_tiles_y * n_tiles_x * self.tile_shape ** 2 * 4
+            if nbytes <= self.memory_limit / 2:
+                break
+            level -= 1
+        self._thread = _threading.Thread(
+            target=self._build, args=(level,), daemon=True
+        )
+        self._thread.start()
+
+    def _build(self, level):
+        # The background thread uses the serial kernels, because the
+        # parallel ones must not be entered from two threads at once.
+        for level_ in range(level, self.min_level - 1, -1):
+            n_tiles_y, n_tiles_x = self.n_tiles(level_)
+            for k in range(n_tiles_y):
+                for l in range(n_tiles_x):
+                    if self._cancelled:
+                        return
+                    self.get_tile(level_, k, l, parallel=False)
+
+    def cancel(self):
+        """ Stops the background build """
+        self._cancelled = True
+
+
+def _rebin(image, edges, axis):
+    """
+    Sums image into the bins between edges (in pixel units) along axis,
+    splitting partially covered pixels by area
+    """
+    n = image.shape[axis]
+    cumsum = _np.zeros(
+        image.shape[:axis] + (n + 1,) + image.shape[axis + 1 :]
+    )
+    cumsum_view = _np.moveaxis(cumsum, axis, 0)
+    _np.cumsum(_np.moveaxis(image, axis, 0), axis=0, out=cumsum_view[1:])
+    edges = _np.clip(edges, 0, n)
+    index = _np.minimum(_np.floor(edges).astype(int), n - 1)
+    fraction = edges - index
+    shape = [1] * image.ndim
+    shape[axis] = len(edges)
+    fraction = fraction.reshape(shape)
+    at_edges = _np.take(cumsum, index, axis=axis) + fraction * _np.take(
+        image, index, axis=axis
+    )
+    return _np.diff(at_edges, axis=axis).astype(_np.float32)
@@ -1,9 +1,8 @@
 import numpy as _np
 import numba as _numba
-import multiprocessing as _multiprocessing
 import concurrent.futures as _futures
-from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
 from scipy.optimize import minimize_scalar as _minimize_scalar
+from scipy.spatial import cKDTree as _cKDTree
 from tqdm import tqdm as _tqdm
 import yaml as _yaml
 import matplotlib.pyplot as _plt
@@ -23,6 +22,20 @@ def interpolate_nan(data):
     return data
 
 
+def _mean_by_frame(frame, values, n_frames):
+    """ Mean of values in each frame, nan for frames without values """
+    counts = _np.bincount(frame, minlength=n_frames)[:n_frames]
+    sums = _np.bincount(frame, weights=values, minlength=n_frames)[:n_frames]
+    with _np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def _mean_and_var_by_frame(frame, values, n_frames):
+    mean = _mean_by_frame(frame, values, n_frames)
+    var = _mean_by_frame(frame, (values - mean[frame]) ** 2, n_frames)
+    return mean, var
+
+
 def calibrate_z(locs, info, d, magnification_factor, path=None):
     n_frames = info[0]["Frames"]
     range = (n_frames - 1) * d
@@ -32,31 +45,22 @@ def calibrate_z(locs, info, d, magnification_factor, path=None):
     )  # negative so that the first frames of
     # a bottom-to-up scan are positive z coordinates.
 
-    mean_sx = _np.array(
-        [_np.mean(locs.sx[locs.frame == _]) for _ in frame_range]
-    )
-    mean_sy = _np.array(
-        [_np.mean(locs.sy[locs.frame == _]) for _ in frame_range]
-    )
-    var_sx = _np.array(
-        [_np.var(locs.sx[locs.frame == _]) for _ in frame_range]
-    )
-    var_sy = _np.array(
-        [_np.var(locs.sy[locs.frame == _]) for _ in frame_range]
-    )
+    # Per-frame statistics in one pass over the localizations
+    frame = locs.frame.astype(_np.int64)
+    sx = locs.sx.astype(_np.float64)
+    sy = locs.sy.astype(_np.float64)
+    mean_sx, var_sx = _mean_and_var_by_frame(frame, sx, n_frames)
+    mean_sy, var_sy = _mean_and_var_by_frame(frame, sy, n_frames)
 
-    keep_x = (locs.sx - mean_sx[locs.frame]) ** 2 < var_sx[locs.frame]
-    keep_y = (locs.sy - mean_sy[locs.frame]) ** 2 < var_sy[locs.frame]
+    keep_x = (sx - mean_sx[frame]) ** 2 < var_sx[frame]
+    keep_y = (sy - mean_sy[frame]) ** 2 < var_sy[frame]
     keep = keep_x & keep_y
     locs = locs[keep]
 
     # Fits calibration curve to the mean of each frame
-    mean_sx = _np.array(
-        [_np.mean(locs.sx[locs.frame == _]) for _ in frame_range]
-    )
-    mean_sy = _np.array(
-        [_np.mean(locs.sy[locs.frame == _]) for _ in frame_range]
-    )
+    frame = frame[keep]
+    mean_sx = _mean_by_frame(frame, sx[keep], n_frames)
+    mean_sy = _mean_by_frame(frame, sy[keep], n_frames)
 
     # Fix nan
     mean_sx = interpolate_nan(mean_sx)
@@ -148,9 +152,9 @@ def calibrate_z(locs, info, d, magnification_factor, path=None):
 
     ax = _plt.subplot(236)
     square_deviation = deviation ** 2
-    mean_square_deviation_frame = [
-        _np.mean(square_deviation[locs.frame == _]) for _ in frame_range
-    ]
+    mean_square_deviation_frame = _mean_by_frame(
+        locs.frame.astype(_np.int64), square_deviation, n_frames
+    )
     rmsd_frame = _np.sqrt(mean_square_deviation_frame)
     _plt.plot(z_range, rmsd_frame, ".-", color="0.3")
     _plt.xlim(z_range.min(), z_range.max())
@@ -222,61 +226,269 @@ def _fit_z_target(z, sx, sy, cx, cy):
     # return (sx-wx)**2 + (sy-wy)**2
 
 
-def fit_z(locs, info, calibration, magnification_factor, filter=2):
-    cx = _np.array(calibration["X Coefficients"])
-    cy = _np.array(calibration["Y Coefficients"])
-    z = _np.zeros_like(locs.x)
-    square_d_zcalib = _np.zeros_like(z)
-    sx = locs.sx
-    sy = locs.sy
-    for i in range(len(z)):
-        result = _minimize_scalar(_fit_z_target, args=(sx[i], sy[i], cx, cy))
-        z[i] = result.x
-        square_d_zcalib[i] = result.fun
+def calibration_z_range(
+    calibration, z_step=0.5, z_limit=10000.0, max_width_factor=10.0
+):
+    """
+    Returns the z range, (z_min, z_max), in which the calibration is
+    valid. The range is walked from the minimum of wx + wy nearest to
+    z = 0 in both directions, as long as both widths are positive, their
+    sum keeps increasing, so that it still determines z, and stays below
+    max_width_factor times its minimum, beyond which spots are too wide
+    to come from a fit. The walk stops at +/- z_limit.
+    """
+    cx = _np.array(calibration["X Coefficients"], dtype=_np.float64)
+    cy = _np.array(calibration["Y Coefficients"], dtype=_np.float64)
+    z_grid = _np.arange(-z_limit, z_limit + z_step / 2, z_step)
+    wx = _np.polyval(cx, z_grid)
+    wy = _np.polyval(cy, z_grid)
+    w = _np.where((wx > 0) & (wy > 0), wx + wy, _np.nan)
+    # Walk downhill from z = 0 to the nearest minimum
+    i0 = len(z_grid) // 2
+    while i0 > 0 and w[i0 - 1] < w[i0]:
+        i0 -= 1
+    while i0 < len(z_grid) - 1 and w[i0 + 1] < w[i0]:
+        i0 += 1
+    w_max = max_width_factor * w[i0]
+    i_min = i0
+    while i_min > 0 and w[i_min] < w[i_min - 1] < w_max:
+        i_min -= 1
+    i_max = i0
+    while i_max < len(z_grid) - 1 and w[i_max] < w[i_max + 1] < w_max:
+        i_max += 1
+    return float(z_grid[i_min]), float(z_grid[i_max])
+
+
+def z_lookup_table(calibration, z_range=None, z_step=0.5, n_cells=512):
+    """
+    Tabulates the square roots of the calibration widths wx(z), wy(z) on a
+    dense z grid within z_range, (z_min, z_max), and rasterizes the
+    (sqrt(sx), sqrt(sy)) plane into n_cells x n_cells cells that each
+    store the index of the nearest grid sample. z fitted with the table is
+    clipped to z_range. By default, the table covers
+    calibration_z_range(calibration) and z is not clipped: fits at its
+    ends are redone with the scalar minimization.
+    """
+    cx = _np.array(calibration["X Coefficients"], dtype=_np.float64)
+    cy = _np.array(calibration["Y Coefficients"], dtype=_np.float64)
+    if z_range is None:
+        z_min, z_max = calibration_z_range(calibration, z_step)
+        z_clip = (-_np.inf, _np.inf)
+    else:
+        z_min, z_max = z_range
+        z_clip = (float(z_min), float(z_max))
+    z_grid = _np.arange(z_min, z_max + z_step / 2, z_step)
+    wx = _np.polyval(cx, z_grid)
+    wy = _np.polyval(cy, z_grid)
+    valid = (wx > 0) & (wy > 0)
+    z_grid = z_grid[valid]
+    u_grid = _np.sqrt(wx[valid])
+    v_grid = _np.sqrt(wy[valid])
+    u0, u1 = u_grid.min(), u_grid.max()
+    v0, v1 = v_grid.min(), v_grid.max()
+    du = max(u1 - u0, 1e-6) / (n_cells - 1)
+    dv = max(v1 - v0, 1e-6) / (n_cells - 1)
+    cu, cv = _np.meshgrid(
+        u0 + du * _np.arange(n_cells),
+        v0 + dv * _np.arange(n_cells),
+        indexing="ij",
+    )
+    tree = _cKDTree(_np.stack((u_grid, v_grid), axis=1))
+    _, table = tree.query(_np.stack((cu.ravel(), cv.ravel()), axis=1))
+    table = table.reshape(n_cells, n_cells).astype(_np.int32)
+    return cx, cy, z_grid, u_grid, v_grid, u0, du, v0, dv, table, z_clip
+
+
+@_numba.jit(nopython=True, nogil=True)
+def _sqrt_width(c, z):
+    """ Square root of the calibration width and its first two derivatives """
+    w = 0.0
+    dw = 0.0
+    d2w = 0.0
+    for k in range(len(c)):
+        d2w = d2w * z + 2 * dw
+        dw = dw * z + w
+        w = w * z + c[k]
+    s = _np.sqrt(w)
+    ds = dw / (2 * s)
+    d2s = d2w / (2 * s) - dw * dw / (4 * s * w)
+    return s, ds, d2s
+
+
+@_numba.jit(nopython=True, nogil=True, parallel=True)
+def _fit_z_lut(
+    sx,
+    sy,
+    cx,
+    cy,
+    z_grid,
+    u_grid,
+    v_grid,
+    u0,
+    du,
+    v0,
+    dv,
+    table,
+    z_min,
+    z_max,
+    window,
+    n_newton,
+    z,
+    square_d_zcalib,
+):
+    n_cells = table.shape[0]
+    n_grid = len(z_grid)
+    for i in _numba.prange(len(sx)):
+        u = _np.sqrt(sx[i])
+        v = _np.sqrt(sy[i])
+        a = min(max(int(round((u - u0) / du)), 0), n_cells - 1)
+        b = min(max(int(round((v - v0) / dv)), 0), n_cells - 1)
+        k0 = table[a, b]
+        best = k0
+        best_d = (u - u_grid[k0]) ** 2 + (v - v_grid[k0]) ** 2
+        for k in range(max(k0 - window, 0), min(k0 + window + 1, n_grid)):
+            d = (u - u_grid[k]) ** 2 + (v - v_grid[k]) ** 2
+            if d < best_d:
+                best = k
+                best_d = d
+        zi = z_grid[best]
+        for it in range(n_newton):
+            su, dsu, d2su = _sqrt_width(cx, zi)
+            sv, dsv, d2sv = _sqrt_width(cy, zi)
+            grad = -2 * (u - su) * dsu - 2 * (v - sv) * dsv
+            curv = (
+                2 * dsu * dsu
+                - 2 * (u - su) * d2su
+                + 2 * dsv * dsv
+                - 2 * (v - sv) * d2sv
+            )
+            if curv <= 0:
+                break
+            z_new = min(max(zi - grad / curv, z_min), z_max)
+            wu = _sqrt_width(cx, z_new)[0]
+            wv = _sqrt_width(cy, z_new)[0]
+            d_new = (u - wu) ** 2 + (v - wv) ** 2
+            if not d_new < best_d:
+                break
+            zi = z_new
+            best_d = d_new
+        z[i] = zi
+        square_d_zcalib[i] = best_d
+
+
+def _fit_z_chunk(lut, sx, sy, z, square_d_zcalib, window=8, n_newton=4):
+    cx, cy, z_grid, u_grid, v_grid, u0, du, v0, dv, table, z_clip = lut
+    _fit_z_lut(
+        _np.asarray(sx, dtype=_np.float64),
+        _np.asarray(sy, dtype=_np.float64),
+        cx,
+        cy,
+        z_grid,
+        u_grid,
+        v_grid,
+        u0,
+        du,
+        v0,
+        dv,
+        table,
+        z_clip[0],
+        z_clip[1],
+        window,
+        n_newton,
+        z,
+        square_d_zcalib,
+    )
+    if not _np.isfinite(z_clip[0]):
+        # The minimum of fits at the ends of the table can lie beyond it
+        at_end = _np.flatnonzero((z <= z_grid[0]) | (z >= z_grid[-1]))
+        for i in at_end:
+            result = _minimize_scalar(
+                _fit_z_target, args=(sx[i], sy[i], cx, cy)
+            )
+            z[i] = result.x
+            square_d_zcalib[i] = result.fun
+
+
+def _locs_with_z(locs, info, magnification_factor, z, square_d_zcalib):
     z *= magnification_factor
     locs = _lib.append_to_rec(locs, z, "z")
     locs = _lib.append_to_rec(locs, _np.sqrt(square_d_zcalib), "d_zcalib")
-    locs = _lib.ensure_sanity(locs, info)
+    return _lib.ensure_sanity(locs, info)
+
+
+def fit_z(
+    locs, info, calibration, magnification_factor, filter=2, z_range=None
+):
+    """
+    Finds z for each localization by minimizing the distance of
+    (sqrt(sx), sqrt(sy)) to the calibration curve (Huang et al. '08): a
+    lookup table gives the nearest tabulated z, which is refined by Newton
+    steps. If z_range, (z_min, z_max), is given, z is clipped to it before
+    the magnification factor is applied.
+    """
+    lut = z_lookup_table(calibration, z_range)
+    z = _np.zeros_like(locs.x)
+    square_d_zcalib = _np.zeros_like(z)
+    _fit_z_chunk(lut, locs.sx, locs.sy, z, square_d_zcalib)
+    locs = _locs_with_z(locs, info, magnification_factor, z, square_d_zcalib)
     return filter_z_fits(locs, filter)
 
 
 def fit_z_parallel(
-    locs, info, calibration, magnification_factor, filter=2, asynch=False
+    locs,
+    info,
+    calibration,
+    magnification_factor,
+    filter=2,
+    asynch=False,
+    z_range=None,
 ):
-    n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
+    """
+    The lookup table fit is compiled and parallel, so the localizations are
+    processed in consecutive chunks by one background thread; the chunk
+    futures are only used for progress reporting. The last future returns
+    the localizations with z, as in fit_z.
+    """
+    lut = z_lookup_table(calibration, z_range)
     n_locs = len(locs)
-    n_tasks = 100 * n_workers
-    spots_per_task = [
-        int(n_locs / n_tasks + 1)
-        if _ < n_locs % n_tasks
-        else int(n_locs / n_tasks)
-        for _ in range(n_tasks)
+    z = _np.zeros(n_locs, dtype=_np.float32)
+    square_d_zcalib = _np.zeros(n_locs, dtype=_np.float32)
+    n_tasks = max(1, min(100, n_locs))
+    bounds = _np.linspace(0, n_locs, n_tasks + 1).astype(int)
+    executor = _futures.ThreadPoolExecutor(1)
+    fs = [
+        executor.submit(
+            _fit_z_chunk,
+            lut,
+            locs.sx[i:j],
+            locs.sy[i:j],
+            z[i:j],
+            square_d_zcalib[i:j],
+        )
+        for i, j in zip(bounds[:-1], bounds[1:])
     ]
-    start_indices = _np.cumsum([0] + spots_per_task[:-1])
-    fs = []
-    executor = _ProcessPoolExecutor(n_workers)
-    for i, n_locs_task in zip(start_indices, spots_per_task):
-        fs.append(
-            executor.submit(
-                fit_z,
-                locs[i: i + n_locs_task],
-                info,
-                calibration,
-                magnification_factor,
-                filter=0,
-            )
+    fs.append(
+        executor.submit(
+            _locs_with_z,
+            locs,
+            info,
+            magnification_factor,
+            z,
+            square_d_zcalib,
         )
+    )
+    executor.shutdown(wait=False)
     if asynch:
         return fs
-    with _tqdm(total=n_tasks, unit="task") as progress_bar:
+    with _tqdm(total=len(fs), unit="task") as progress_bar:
         for f in _futures.as_completed(fs):
             progress_bar.update()
     return locs_from_futures(fs, filter=filter)
 
 
 def locs_from_futures(futures, filter=2):
-    locs = [_.result() for _ in futures]
-    locs = _np.hstack(locs).view(_np.recarray)
+    """ Collects the locs of the futures returned by fit_z_parallel """
+    locs = futures[-1].result()
     return filter_z_fits(locs, filter)
 
 
@@ -0,0 +1,58 @@
+"""
+Tests for the ROI photometry of the avg fit method.
+"""
+import numpy as np
+
+from picasso import avgroi, localize
+
+
+CAMERA_INFO = {"baseline": 100.0, "gain": 2.0, "sensitivity": 0.5, "qe": 0.9}
+
+
+def _movie(n_frames=20, size=48, n_spots=6, seed=0):
+    """ Gaussian spots on a noisy background above the camera baseline """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:size, :size]
+    movie = np.empty((n_frames, size, size), dtype=np.uint16)
+    for i in range(n_frames):
+        frame = rng.normal(CAMERA_INFO["baseline"] + 20, 3, (size, size))
+        # Leave some frames without spots
+        for _ in range(n_spots if i % 4 else 0):
+            x0, y0 = rng.uniform(6, size - 6, 2)
+            frame += 2000 * np.exp(
+                -((x - x0) ** 2 + (y - y0) ** 2) / (2 * 1.2 ** 2)
+            )
+        movie[i] = frame
+    return movie
+
+
+def test_photometry_matches_fit_spots():
+    """
+    Photometry measured during identification should equal the sums of
+    the cut out spots, and the border mean of the spots as background
+    """
+    movie = _movie()
+    box = 7
+    current, futures = localize.identify_async(
+        movie, 2000, box, camera_info=CAMERA_INFO
+    )
+    ids = localize.identifications_from_futures(futures)
+    assert len(ids) > 50
+    spots = localize.get_spots(movie, ids, box, CAMERA_INFO)
+    theta = avgroi.fit_spots(spots)
+    border = np.ones((box, box), dtype=bool)
+    border[1:-1, 1:-1] = False
+    bg = spots[:, border].mean(axis=1)
+    assert np.allclose(ids.photons, theta[:, 2], rtol=1e-5)
+    assert np.allclose(ids.bg, bg, rtol=1e-4, atol=1e-3)
+    # The separate pass over the movie gives the same result
+    photons, bg_ = avgroi.photometry(movie, ids, box, CAMERA_INFO)
+    assert np.array_equal(photons, ids.photons)
+    assert np.array_equal(bg_, ids.bg)
+    # The locs equal those from the fits with the border background
+    theta[:, 3] = bg
+    expected = avgroi.locs_from_fits(ids, theta, box, True)
+    locs = avgroi.locs_from_photometry(ids, ids.photons, ids.bg, box, True)
+    assert locs.dtype.names == expected.dtype.names
+    for name in locs.dtype.names:
+        assert np.allclose(locs[name], expected[name], rtol=1e-4), name
@@ -0,0 +1,45 @@
+"""
+Tests for the compiled least squares fitter.
+"""
+import numpy as np
+
+from picasso import gausslq
+
+
+def _simulate_spots(n_spots, size=7, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = np.arange(size) - int(size / 2)
+    spots = np.empty((n_spots, size, size), dtype=np.float32)
+    for i in range(n_spots):
+        x, y = rng.uniform(-0.5, 0.5, 2)
+        sx, sy = rng.uniform(0.8, 1.6, 2)
+        gx = np.exp(-0.5 * ((grid - x) / sx) ** 2) / (np.sqrt(2 * np.pi) * sx)
+        gy = np.exp(-0.5 * ((grid - y) / sy) ** 2) / (np.sqrt(2 * np.pi) * sy)
+        spots[i] = rng.poisson(2000 * np.outer(gy, gx) + 10)
+    return spots
+
+
+def test_fit_spots_matches_leastsq():
+    """
+    The compiled solver should reproduce the scipy reference fit
+    """
+    spots = _simulate_spots(200)
+    theta = gausslq.fit_spots(spots)
+    reference = np.array([gausslq.fit_spot(spot) for spot in spots])
+    assert theta.shape == (200, 6)
+    assert np.all(np.isfinite(theta))
+    assert np.median(np.abs(theta[:, :2] - reference[:, :2])) < 1e-2
+    assert np.median(np.abs(theta[:, 4:] - reference[:, 4:])) < 1e-2
+
+
+def test_fit_spots_gpufit_cpu_backend():
+    """
+    The CPU implementation of the Gpufit batch fit returns the Gpufit
+    parameter layout [photons, x0, y0, sx, sy, bg]
+    """
+    spots = _simulate_spots(200)
+    theta = gausslq.fit_spots_gpufit(spots, backend="cpu")
+    assert theta.shape == (200, 6)
+    assert np.all(np.isfinite(theta))
+    assert np.all(np.abs(theta[:, 1:3] - 3) < 1)
+    assert 1500 < np.median(theta[:, 0]) < 2500
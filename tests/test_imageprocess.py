@@ -0,0 +1,81 @@
+"""
+Tests for the image correlation functions.
+"""
+import numpy as np
+
+from picasso import imageprocess, render
+
+
+def _shifted_images(shifts, size=128, seed=0):
+    """ Blurred random spots, with the pattern moved by each shift """
+    rng = np.random.default_rng(seed)
+    spots = rng.uniform(16, size - 16, (300, 2))
+    images = []
+    for dy, dx in shifts:
+        image = np.zeros((size, size), dtype=np.float32)
+        y = (spots[:, 0] + dy).astype(int)
+        x = (spots[:, 1] + dx).astype(int)
+        np.add.at(image, (y, x), 1)
+        images.append(render.gaussian_filter(image, 1.5, 1.5))
+    return np.array(images)
+
+
+def test_xcorr_fft():
+    """ The correlation from cached FFTs should equal xcorr """
+    imageA, imageB = _shifted_images([(0, 0), (3, -2)])
+    XCorr = imageprocess.xcorr_fft(
+        imageprocess.rfft2(imageA), imageprocess.rfft2(imageB), imageA.shape
+    )
+    expected = imageprocess.xcorr(imageA, imageB)
+    assert np.allclose(XCorr, expected, atol=1e-4 * expected.max())
+
+
+def test_rcc():
+    """ rcc should recover integer shifts between segments """
+    shifts = np.array([(0, 0), (3, -2), (5, 1), (-2, 4)])
+    segments = _shifted_images(shifts)
+    shift_y, shift_x = imageprocess.rcc(segments, max_shift=32)
+    expected = shifts - shifts.mean(axis=0)
+    assert np.allclose(shift_y - shift_y.mean(), expected[:, 0], atol=0.1)
+    assert np.allclose(shift_x - shift_x.mean(), expected[:, 1], atol=0.1)
+
+
+def _spot_image(spots, size, dy, dx, sigma=1.5):
+    """ A sum of Gaussian spots, moved by a sub-pixel shift """
+    y = np.arange(size)
+    gy = np.exp(-((y[None, :] - spots[:, :1] - dy) ** 2) / (2 * sigma ** 2))
+    gx = np.exp(-((y[None, :] - spots[:, 1:] - dx) ** 2) / (2 * sigma ** 2))
+    return (gy.T @ gx).astype(np.float32)
+
+
+def test_peak_methods():
+    """ All peak estimators should find a sub-pixel shift """
+    rng = np.random.default_rng(1)
+    spots = rng.uniform(16, 112, (300, 2))
+    imageA = _spot_image(spots, 128, 0, 0)
+    imageB = _spot_image(spots, 128, -0.62, 3.95)
+    for method in imageprocess.PEAK_METHODS:
+        dy, dx = imageprocess.get_image_shift(
+            imageA, imageB, 5, 32, method=method
+        )
+        assert abs(dy + 0.62) < 0.02 and abs(dx - 3.95) < 0.02
+    dy, dx = imageprocess.get_image_shift(
+        imageA, imageB, 5, 32, upsample_factor=20
+    )
+    assert abs(dy + 0.62) < 1e-3 and abs(dx - 3.95) < 1e-3
+
+
+def test_windowed_shift():
+    """ The windowed correlation should find the shifts of rcc """
+    rng = np.random.default_rng(2)
+    spots = rng.uniform(16, 240, (1000, 2))
+    shifts = np.array([(0, 0), (-3.3, 7.6), (5.2, 1.1), (9.8, -6.4)])
+    segments = np.array([_spot_image(spots, 256, *_) for _ in shifts])
+    dy, dx = imageprocess.get_image_shift(
+        segments[0], segments[1], 5, 32, windowed=True
+    )
+    assert abs(dy + 3.3) < 0.02 and abs(dx - 7.6) < 0.02
+    shift_y, shift_x = imageprocess.rcc(segments, 32, windowed=True)
+    expected = shifts - shifts.mean(axis=0)
+    assert np.allclose(shift_y - shift_y.mean(), expected[:, 0], atol=0.02)
+    assert np.allclose(shift_x - shift_x.mean(), expected[:, 1], atol=0.02)
@@ -0,0 +1,156 @@
+"""
+Tests for the spatial index and pick functions.
+"""
+import numpy as np
+
+from picasso import postprocess
+
+
+def _random_locs(n_locs, size=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.rec.array(
+        (
+            np.arange(n_locs, dtype=np.uint32),
+            rng.uniform(0, size, n_locs),
+            rng.uniform(0, size, n_locs),
+            rng.uniform(0.02, 0.1, n_locs),
+            rng.uniform(0.02, 0.1, n_locs),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+
+
+def test_get_index_blocks():
+    """
+    The blocks should hold the localizations sorted by block row and
+    column, in their original order within each block
+    """
+    locs = _random_locs(5000)
+    info = [{"Width": 32, "Height": 32}]
+    size = 1.5
+    progress = []
+    index_blocks = postprocess.get_index_blocks(
+        locs, info, size, progress.append
+    )
+    locs_, size_, x_index, y_index, starts, ends, K, L = index_blocks
+    assert (K, L) == (22, 22)
+    assert progress[0] == 0 and progress[-1] == K
+    expected = np.lexsort(
+        [np.uint32(locs.x / size), np.uint32(locs.y / size)]
+    )
+    assert np.array_equal(locs_.frame, expected)
+    for k in range(K):
+        for l in range(L):
+            block = slice(starts[k, l], ends[k, l])
+            assert np.all(y_index[block] == k)
+            assert np.all(x_index[block] == l)
+    assert ends[-1, -1] == len(locs)
+
+
+def test_pick_locs_circle():
+    """ Circle picks should return the localizations within the radius """
+    locs = _random_locs(5000)
+    picks = [(5.0, 5.0), (5.5, 5.0), (20.0, 12.0), (-10.0, 3.0)]
+    picked_locs = postprocess.pick_locs(locs, picks, "Circle", 2.0)
+    assert np.all(np.diff(picked_locs.group) >= 0)
+    for i, (x, y) in enumerate(picks):
+        group_locs = picked_locs[picked_locs.group == i]
+        expected = locs[(locs.x - x) ** 2 + (locs.y - y) ** 2 < 1]
+        assert np.array_equal(group_locs.frame, expected.frame)
+
+
+def test_pick_locs_rectangle():
+    """
+    Rectangle picks should return the localizations within the rotated
+    rectangle, with their coordinates along and across its axis
+    """
+    locs = _random_locs(5000)
+    picks = [((4.0, 4.0), (12.0, 10.0)), ((20.0, 25.0), (20.0, 15.0))]
+    width = 1.5
+    picked_locs = postprocess.pick_locs(locs, picks, "Rectangle", width)
+    for i, ((xs, ys), (xe, ye)) in enumerate(picks):
+        group_locs = picked_locs[picked_locs.group == i]
+        length = np.hypot(xe - xs, ye - ys)
+        # Unit vectors along and across the pick axis
+        ux, uy = (xe - xs) / length, (ye - ys) / length
+        along = (locs.x - xs) * ux + (locs.y - ys) * uy
+        across = (locs.x - xs) * uy - (locs.y - ys) * ux
+        is_picked = (np.abs(across) < width / 2) & (along > 0)
+        is_picked &= along < length
+        assert np.array_equal(group_locs.frame, locs.frame[is_picked])
+        assert np.allclose(group_locs.y_pick_rot, along[is_picked], atol=1e-5)
+        assert np.allclose(
+            np.abs(group_locs.x_pick_rot), np.abs(across[is_picked]), atol=1e-5
+        )
+
+
+def test_pick_similar():
+    """
+    Starting from a few picks, pick similar should find all clusters of
+    similar size, and no overlapping picks
+    """
+    rng = np.random.default_rng(1)
+    grid = range(4, 30, 5)
+    centers = np.array([(x, y) for x in grid for y in grid], dtype=float)
+    centers = centers + rng.uniform(-1, 1, centers.shape)
+    locs = _random_locs(50 * len(centers) + 200, seed=1)
+    cluster_x = centers[:, :1] + rng.normal(0, 0.1, (len(centers), 50))
+    cluster_y = centers[:, 1:] + rng.normal(0, 0.1, (len(centers), 50))
+    locs.x[: cluster_x.size] = cluster_x.ravel()
+    locs.y[: cluster_y.size] = cluster_y.ravel()
+    info = [{"Width": 32, "Height": 32}]
+    picks = [tuple(_) for _ in centers[:4]]
+    similar = postprocess.pick_similar(locs, info, picks, 1.0, 10.0)
+    assert np.array_equal(similar[:4], centers[:4])
+    assert len(similar) == len(centers)
+    d2 = ((centers[:, np.newaxis] - similar[np.newaxis]) ** 2).sum(axis=2)
+    assert np.all(d2.min(axis=1) < 0.05 ** 2)
+
+
+def test_pick_similar_far_from_origin():
+    """
+    The rmsd of picks far from the origin should keep its precision, so
+    that pick similar tells apart clusters of different widths there
+    """
+    rng = np.random.default_rng(2)
+    grid = np.arange(1004, 1030, 5)
+    centers = np.array([(x, y) for x in grid for y in grid], dtype=float)
+    centers = centers + rng.uniform(-1, 1, centers.shape)
+    n_locs = rng.integers(50, 70, len(centers))
+    locs = _random_locs(n_locs.sum(), size=1034, seed=2)
+    sigma = np.where(np.arange(len(centers)) % 2, 0.01, 0.03)
+    group = np.repeat(np.arange(len(centers)), n_locs)
+    x = centers[group, 0] + sigma[group] * rng.normal(size=len(group))
+    y = centers[group, 1] + sigma[group] * rng.normal(size=len(group))
+    locs.x[:] = x
+    locs.y[:] = y
+    info = [{"Width": 1034, "Height": 1034}]
+    index_blocks = postprocess.get_index_blocks(locs, info, 0.5)
+    locs_, size, _, _, starts, ends, _, _ = index_blocks
+    # The exact rmsd of the float32 coordinates
+    x = locs.x.astype(float)
+    y = locs.y.astype(float)
+    x_mean = np.bincount(group, x) / n_locs
+    y_mean = np.bincount(group, y) / n_locs
+    d2 = (x - x_mean[group]) ** 2 + (y - y_mean[group]) ** 2
+    rmsd = np.sqrt(np.bincount(group, d2) / n_locs)
+    for (x_pick, y_pick), n, expected in zip(centers, n_locs, rmsd):
+        n_, _, _, rmsd_ = postprocess._pick_moments(
+            x_pick, y_pick, locs_.x, locs_.y, starts, ends, size
+        )
+        assert n_ == n
+        assert abs(rmsd_ - expected) < 1e-3 * expected
+    # Starting from narrow clusters, only the narrow ones should be found
+    picks = [tuple(_) for _ in centers[1:16:2]]
+    similar = postprocess.pick_similar(
+        locs, info, picks, 1.0, 5.0, index_blocks
+    )
+    assert len(similar) == len(centers) // 2
+    d2 = ((centers[1::2, np.newaxis] - similar[np.newaxis]) ** 2).sum(axis=2)
+    assert np.all(d2.min(axis=1) < 0.05 ** 2)
@@ -0,0 +1,446 @@
+"""
+Tests for the rendering kernels.
+"""
+import warnings
+
+import numpy as np
+
+from picasso import render
+
+
+def _random_locs(n_locs, size=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.rec.array(
+        (
+            np.sort(rng.integers(0, 1000, n_locs)),
+            rng.uniform(0, size, n_locs),
+            rng.uniform(0, size, n_locs),
+            rng.uniform(-100, 100, n_locs),
+            rng.uniform(0.02, 0.1, n_locs),
+            rng.uniform(0.02, 0.1, n_locs),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("z", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+
+
+def test_render_gaussian_separable():
+    """
+    The separable kernel should draw the same blobs as evaluating the 2D
+    Gaussian at every pixel
+    """
+    locs = _random_locs(20)
+    oversampling = 10
+    n, image = render.render_gaussian(locs, oversampling, 0, 0, 32, 32, 0)
+    expected = np.zeros_like(image)
+    i, j = np.indices(image.shape)
+    for loc in locs:
+        x = oversampling * loc.x
+        y = oversampling * loc.y
+        sx = oversampling * loc.lpx
+        sy = oversampling * loc.lpy
+        blob = np.exp(
+            -(
+                (j - x + 0.5) ** 2 / (2 * sx ** 2)
+                + (i - y + 0.5) ** 2 / (2 * sy ** 2)
+            )
+        ) / (2 * np.pi * sx * sy)
+        in_box = (
+            (i >= int(y - 3 * sy))
+            & (i < int(y + 3 * sy + 1))
+            & (j >= int(x - 3 * sx))
+            & (j < int(x + 3 * sx) + 1)
+        )
+        expected += np.where(in_box, blob, 0)
+    assert n == 20
+    assert np.allclose(image, expected, rtol=1e-4, atol=1e-6)
+
+
+def test_parallel_kernels_match_serial():
+    """
+    The band-parallel kernels should give exactly the serial images
+    """
+    locs = _random_locs(5000)
+    cases = [
+        ("render_hist", (locs, 10, 0, 0, 32, 32)),
+        ("render_gaussian", (locs, 10, 0, 0, 32, 32, 0.0)),
+        ("render_gaussian_iso", (locs, 10, 2, 3, 30, 25, 0.0)),
+        ("render_histz", (locs, 10, 0, -100, 32, 100, 130.0)),
+        ("render_hist3d", (locs, 5, 0, 0, 32, 32, -100, 100, 130.0)),
+    ]
+    for name, args in cases:
+        n, image = getattr(render, name)(*args)
+        n_parallel, image_parallel = getattr(render, name + "_parallel")(*args)
+        assert n == n_parallel
+        assert np.array_equal(image, image_parallel)
+
+
+def test_render_multi():
+    """
+    Rendering all channels in one pass should give the images of the
+    single channel renderings, stacked or blended with the colors
+    """
+    channels = [_random_locs(2000 * (i + 1), seed=i) for i in range(3)]
+    colors = [(1, 0, 0), (0, 1, 0), (0.5, 0.5, 1)]
+    viewport = [(2.3, 1.7), (30.1, 28.9)]
+    for blur_method in [None, "gaussian", "convolve"]:
+        for parallel in [True, False]:
+            kwargs = {
+                "viewport": viewport,
+                "oversampling": 5,
+                "blur_method": blur_method,
+                "min_blur_width": 0.03,
+                "parallel": parallel,
+            }
+            renderings = [render.render(_, **kwargs) for _ in channels]
+            n_locs, image = render.render_multi(channels, **kwargs)
+            assert list(n_locs) == [_[0] for _ in renderings]
+            for i, (n, image_) in enumerate(renderings):
+                assert np.array_equal(image[i], image_)
+            _, bgra = render.render_multi(channels, colors=colors, **kwargs)
+            for i in range(3):
+                assert np.allclose(
+                    bgra[:, :, 2 - i],
+                    sum([c[i] * _ for c, _ in zip(colors, image)]),
+                    rtol=1e-5,
+                    atol=1e-6,
+                )
+            assert np.all(bgra[:, :, 3] == 1)
+
+
+def test_render_colormap():
+    """
+    Coloring by a property should blend the renderings of the
+    localizations in each value bin with the colors of the LUT
+    """
+    locs = _random_locs(5000)
+    lut = np.random.default_rng(1).uniform(0, 1, (7, 3))
+    for blur_method in [None, "gaussian", "smooth"]:
+        kwargs = {
+            "viewport": [(0, 0), (32, 32)],
+            "oversampling": 5,
+            "blur_method": blur_method,
+            "min_blur_width": 0.03,
+        }
+        n_locs, bgra = render.render_colormap(
+            locs, locs.z, (-70, 70), lut, **kwargs
+        )
+        bins = np.clip(np.floor(7 * (locs.z + 70) / 140), 0, 6)
+        n_locs_bins, image = render.render_multi(
+            [locs[bins == _] for _ in range(7)], **kwargs
+        )
+        assert n_locs == n_locs_bins.sum()
+        for i in range(3):
+            assert np.allclose(
+                bgra[:, :, 2 - i],
+                np.tensordot(lut[:, i], image, 1),
+                rtol=1e-5,
+                atol=1e-5,
+            )
+
+
+
+def test_render_colormap_empty_range():
+    """
+    Values of a single frame give an empty range, which should color all
+    localizations with the first color without warnings
+    """
+    locs = _random_locs(500)
+    lut = np.random.default_rng(1).uniform(0, 1, (7, 3))
+    values = np.full(len(locs), 3.0)
+    kwargs = {"viewport": [(0, 0), (32, 32)], "oversampling": 5}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        n_locs, bgra = render.render_colormap(
+            locs, values, (3, 3), lut, **kwargs
+        )
+    n, image = render.render(locs, **kwargs)
+    assert n_locs == n
+    for i in range(3):
+        assert np.allclose(bgra[:, :, 2 - i], lut[0, i] * image, rtol=1e-5)
+
+def test_render_hist3d_sparse():
+    """
+    Projections, slices and binned volumes of the sparse histogram should
+    equal those of the dense one
+    """
+    locs = _random_locs(5000)
+    args = (locs, 5, 1.2, 0.3, 30.1, 31.7, -90, 95, 130.0)
+    n, dense = render.render_hist3d(*args)
+    n_sparse, volume = render.render_hist3d_sparse(*args)
+    assert n_sparse == n
+    assert volume.shape == dense.shape
+    assert len(volume.keys) == np.count_nonzero(dense)
+    for axis in range(3):
+        assert np.array_equal(volume.project(axis), dense.sum(axis=axis))
+    assert np.array_equal(volume.slice(3), dense[:, :, 3])
+    assert np.array_equal(volume.slice(7, axis=0), dense[7])
+    assert np.array_equal(volume.dense(), dense)
+    Y, X, Z = dense.shape
+    padded = np.zeros((-(-Y // 2) * 2, X, -(-Z // 3) * 3), dtype=np.float32)
+    padded[:Y, :, :Z] = dense
+    binned = padded.reshape(padded.shape[0] // 2, 2, X, -1, 3).sum((1, 4))
+    assert np.array_equal(volume.dense((2, 1, 3)), binned)
+
+
+def test_render_tile_index():
+    """
+    Rendering through the tile index should give the same image as
+    rendering all localizations, for viewports anywhere in the movie
+    """
+    locs = _random_locs(5000)
+    info = [{"Height": 32, "Width": 32}]
+    tile_index = render.get_tile_index(locs, info, tile_size=4)
+    viewports = [
+        [(0, 0), (32, 32)],
+        [(5.3, 7.1), (9.7, 20.2)],
+        [(-3, 28), (6, 40)],
+    ]
+    for viewport in viewports:
+        for blur_method in [None, "gaussian"]:
+            n, image = render.render(
+                locs,
+                viewport=viewport,
+                oversampling=5,
+                blur_method=blur_method,
+            )
+            n_tiles, image_tiles = render.render(
+                None,
+                viewport=viewport,
+                oversampling=5,
+                blur_method=blur_method,
+                tile_index=tile_index,
+            )
+            assert n_tiles == n
+            assert np.allclose(image_tiles, image, rtol=1e-5, atol=1e-7)
+
+
+def test_image_pyramid():
+    """
+    Views at power-of-two oversamplings should be composed exactly from
+    the pyramid tiles, and other oversamplings should keep all counts
+    """
+    locs = _random_locs(5000)
+    info = [{"Height": 32, "Width": 32}]
+    tile_index = render.get_tile_index(locs, info, tile_size=4)
+    pyramid = render.ImagePyramid(tile_index, tile_shape=16)
+    pyramid.build_async(2)
+    pyramid._thread.join()
+    viewport = [(4, 8), (20, 28)]
+    for oversampling in [0.5, 2, 4]:
+        n, image = render.render(
+            locs, viewport=viewport, oversampling=oversampling
+        )
+        n_pyramid, image_pyramid = pyramid.render(viewport, oversampling)
+        assert n_pyramid == n
+        assert np.array_equal(image_pyramid, image)
+    viewport = [(0, 0), (32, 32)]
+    n_pyramid, image_pyramid = pyramid.render(viewport, 1.7)
+    assert n_pyramid == len(locs)
+    assert pyramid.render(viewport, 100) is None
+
+
+def test_render_pan():
+    """
+    Shifting a rendering and rendering the exposed strips should give the
+    same image as rendering the panned viewport
+    """
+    locs = _random_locs(5000)
+    info = [{"Height": 32, "Width": 32}]
+    tile_index = render.get_tile_index(locs, info, tile_size=4)
+    max_blur_width = max(locs.lpx.max(), locs.lpy.max())
+    oversampling = 8
+    last_viewport = [(4.0, 6.0), (20.0, 22.0)]
+    for blur_method in [None, "gaussian"]:
+        n, image = render.render(
+            locs,
+            viewport=last_viewport,
+            oversampling=oversampling,
+            blur_method=blur_method,
+        )
+        for dy, dx in [(0, 10), (-7, 0), (12, -9)]:
+            viewport = [
+                (y + dy / oversampling, x + dx / oversampling)
+                for y, x in last_viewport
+            ]
+            n_pan, image_pan = render.render_pan(
+                image,
+                n,
+                tile_index,
+                last_viewport,
+                viewport,
+                oversampling,
+                blur_method=blur_method,
+                max_blur_width=max_blur_width,
+            )
+            n_full, image_full = render.render(
+                locs,
+                viewport=viewport,
+                oversampling=oversampling,
+                blur_method=blur_method,
+            )
+            assert n_pan == n_full
+            assert np.allclose(image_pan, image_full, rtol=1e-5, atol=1e-6)
+
+
+def test_gaussian_filter():
+    """
+    The separable filter should match the full 2D convolution, and the
+    recursive filter should approximate it
+    """
+    rng = np.random.default_rng(0)
+    image = np.zeros((60, 90), dtype=np.float32)
+    image[rng.integers(0, 60, 40), rng.integers(0, 90, 40)] = 1
+    for sigma_y, sigma_x in [(1, 1), (2.3, 1.4)]:
+        kernel = np.outer(
+            render._gaussian_kernel(sigma_y), render._gaussian_kernel(sigma_x)
+        )
+        radius_y, radius_x = [(_ - 1) // 2 for _ in kernel.shape]
+        padded = np.pad(image, [(radius_y,), (radius_x,)])
+        expected = np.zeros(image.shape)
+        for i in range(kernel.shape[0]):
+            for j in range(kernel.shape[1]):
+                expected += (
+                    kernel[i, j]
+                    * padded[i : i + image.shape[0], j : j + image.shape[1]]
+                )
+        for parallel in [True, False]:
+            blurred = render.gaussian_filter(
+                image.copy(), sigma_y, sigma_x, parallel=parallel
+            )
+            assert np.allclose(blurred, expected, atol=1e-6)
+    blurred = render.gaussian_filter(image.copy(), 3, 3, recursive=True)
+    expected = render.gaussian_filter(image.copy(), 3, 3, recursive=False)
+    assert np.abs(blurred - expected).max() < 0.1 * expected.max()
+
+
+def test_segment():
+    """
+    Segments sliced from the frame-sorted localizations should match
+    rendering each frame range separately
+    """
+    locs = _random_locs(5000)
+    locs = locs[np.random.default_rng(1).permutation(len(locs))]
+    info = [{"Height": 32, "Width": 32, "Frames": 1000}]
+    bounds, segments = render.segment(locs, info, 100)
+    assert segments.dtype == np.float32
+    assert segments.shape == (10, 32, 32)
+    for i, segment in enumerate(segments):
+        in_segment = (locs.frame >= bounds[i]) & (locs.frame < bounds[i + 1])
+        _, expected = render.render(locs[in_segment], info)
+        assert np.array_equal(segment, expected)
+    streamed = list(render.iter_segments(locs, info, 100))
+    assert np.array_equal(np.array(streamed), segments)
+
+
+def test_iter_slices():
+    """
+    Each z slice should render the localizations between its edges, like
+    filtering them with the slicer's mask
+    """
+    locs = _random_locs(5000)
+    z_edges = np.arange(-100, 101, 20.0)
+    kwargs = {"oversampling": 2, "viewport": [(0, 0), (32, 32)]}
+    slices = list(render.iter_slices(locs, None, z_edges, kwargs))
+    stacks = list(render.iter_slices([locs, locs], None, z_edges, kwargs))
+    assert len(slices) == len(stacks) == len(z_edges) - 1
+    for image, stack, z_min, z_max in zip(
+        slices, stacks, z_edges[:-1], z_edges[1:]
+    ):
+        in_slice = (locs.z > z_min) & (locs.z <= z_max)
+        _, expected = render.render(locs[in_slice], **kwargs)
+        assert np.array_equal(image, expected)
+        assert np.array_equal(stack, [expected, expected])
+
+
+def test_render_tiled():
+    """
+    Rendering tile by tile with a halo should give the same image as
+    rendering at once
+    """
+    locs = _random_locs(5000)
+    info = [{"Height": 32, "Width": 32}]
+    for blur_method in [None, "gaussian", "smooth"]:
+        n, expected = render.render(
+            locs, info, oversampling=8, blur_method=blur_method
+        )
+        image = np.zeros_like(expected)
+        n_tiled, image_max = render.render_tiled(
+            locs,
+            info,
+            image,
+            oversampling=8,
+            blur_method=blur_method,
+            tile_shape=48,
+        )
+        assert n_tiled == n
+        assert image_max == expected.max()
+        assert np.allclose(image, expected, rtol=1e-5, atol=1e-6)
+
+
+
+def test_render_tiled_outlier(monkeypatch):
+    """
+    A localization with a large precision should neither grow the halo
+    of all tiles nor be missing from the tiled image
+    """
+    locs = _random_locs(5000)
+    locs.lpx[0] = locs.lpy[0] = 50
+    info = [{"Height": 32, "Width": 32}]
+    tile_shapes = []
+    render_ = render.render
+
+    def render_tile(*args, **kwargs):
+        n, tile = render_(*args, **kwargs)
+        tile_shapes.append(tile.shape)
+        return n, tile
+
+    for blur_method in ["gaussian", "gaussian_iso", "convolve"]:
+        n, expected = render.render(
+            locs, info, oversampling=8, blur_method=blur_method
+        )
+        image = np.zeros_like(expected)
+        tile_shapes.clear()
+        monkeypatch.setattr(render, "render", render_tile)
+        n_tiled, image_max = render.render_tiled(
+            locs,
+            info,
+            image,
+            oversampling=8,
+            blur_method=blur_method,
+            tile_shape=48,
+        )
+        monkeypatch.undo()
+        assert max(max(shape) for shape in tile_shapes) <= 2 * 48
+        assert n_tiled == n
+        assert np.isclose(image_max, expected.max(), rtol=1e-5)
+        assert np.allclose(image, expected, rtol=1e-5, atol=1e-6)
+
+def test_to_bgra():
+    """
+    The display kernels should scale, color and blend like the former
+    numpy code, and draw into the given buffer
+    """
+    rng = np.random.default_rng(0)
+    images = rng.uniform(0, 3, (3, 40, 50)).astype(np.float32)
+    images[0, 5, 5] = np.nan
+    colors = [(1, 0, 0), (0, 0.5, 1), (1, 1, 0)]
+    scaled = np.clip(np.nan_to_num((images - 0.5) / 1.5), 0, 1)
+    rgb = np.minimum(np.tensordot(scaled, colors, (0, 0)), 1)
+    out = np.zeros((40, 50, 4), dtype=np.uint8)
+    for invert in [False, True]:
+        bgra = render.to_bgra(images, 0.5, 2, colors, out, invert=invert)
+        expected = 1 - rgb if invert else rgb
+        assert bgra is out
+        assert np.all(bgra[:, :, 3] == 255)
+        assert np.abs(bgra[:, :, 2::-1] - 255 * expected).max() <= 0.5 + 1e-3
+    lut = rng.integers(0, 256, (256, 3)).astype(np.uint8)
+    bgra = render.to_bgra_lut(images[1], 0.5, 2, lut)
+    index = np.round(255 * scaled[1]).astype(int)
+    assert np.all(bgra[:, :, 2::-1] == lut[index])
@@ -0,0 +1,157 @@
+"""
+Tests for the lookup table z fit.
+"""
+import warnings
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+from scipy.optimize import minimize_scalar  # noqa: E402
+
+from picasso import zfit  # noqa: E402
+
+
+CALIBRATION = {
+    "X Coefficients": [
+        3.16e-17, -2.21e-14, -9.78e-12, 8.22e-09, 4.91e-06, -2.88e-03, 1.18
+    ],
+    "Y Coefficients": [
+        1.71e-17, -2.50e-15, -8.41e-12, 1.15e-11, 5.43e-06, 1.82e-03, 1.01
+    ],
+}
+
+
+def _locs(z, frame=None, noise=0.0, rng=None):
+    """
+    Localizations with the calibration widths at z, scattered by the
+    relative noise
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+    n = len(z)
+    if frame is None:
+        frame = np.zeros(n)
+    cx = np.array(CALIBRATION["X Coefficients"])
+    cy = np.array(CALIBRATION["Y Coefficients"])
+    return np.rec.array(
+        (
+            frame,
+            rng.uniform(0, 10, n),
+            rng.uniform(0, 10, n),
+            np.polyval(cx, z) * (1 + noise * rng.standard_normal(n)),
+            np.polyval(cy, z) * (1 + noise * rng.standard_normal(n)),
+            0.1 * np.ones(n),
+            0.1 * np.ones(n),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("sx", "f4"),
+            ("sy", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+
+
+def test_fit_z_matches_minimize_scalar():
+    """
+    The lookup table with Newton refinement should find the same minimum
+    as the per-localization scalar minimization
+    """
+    rng = np.random.default_rng(0)
+    z_true = rng.uniform(-400, 400, 500)
+    locs = _locs(z_true, noise=0.05, rng=rng)
+    cx = np.array(CALIBRATION["X Coefficients"])
+    cy = np.array(CALIBRATION["Y Coefficients"])
+    info = [{"Frames": 1, "Width": 10, "Height": 10}]
+    fitted = zfit.fit_z(locs, info, CALIBRATION, 1.0, filter=0)
+    reference = [
+        minimize_scalar(zfit._fit_z_target, args=(sx, sy, cx, cy))
+        for sx, sy in zip(locs.sx, locs.sy)
+    ]
+    z_reference = np.array([_.x for _ in reference])
+    d_reference = np.sqrt([_.fun for _ in reference])
+    assert np.max(np.abs(fitted.z - z_reference)) < 0.1
+    assert np.allclose(fitted.d_zcalib, d_reference, atol=1e-4)
+
+
+def _bead_locs(n_frames, d, empty_frames, seed=0):
+    """ Localizations of a bead z stack, with some frames left empty """
+    rng = np.random.default_rng(seed)
+    frames = np.setdiff1d(np.arange(n_frames), empty_frames)
+    frame = np.repeat(frames, rng.integers(5, 30, len(frames)))
+    z = -(frame * d - (n_frames - 1) * d / 2)
+    return _locs(z, frame=frame, noise=0.1, rng=rng)
+
+
+def _by_frame_masks(function, values, frame, n_frames):
+    """ The statistic of each frame from a mask per frame, nan if empty """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.array(
+            [function(values[frame == _]) for _ in range(n_frames)]
+        )
+
+
+def test_calibrate_z_matches_frame_masks():
+    """
+    The frame statistics from bincount and the fitted coefficients should
+    equal those computed with a mask per frame, also for empty frames
+    """
+    n_frames, d = 41, 20
+    locs = _bead_locs(n_frames, d, [0, 7, 8, 30])
+    info = [{"Frames": n_frames, "Width": 10, "Height": 10}]
+    mean_sx = _by_frame_masks(np.mean, locs.sx, locs.frame, n_frames)
+    var_sx = _by_frame_masks(np.var, locs.sx, locs.frame, n_frames)
+    mean_sy = _by_frame_masks(np.mean, locs.sy, locs.frame, n_frames)
+    var_sy = _by_frame_masks(np.var, locs.sy, locs.frame, n_frames)
+    mean, var = zfit._mean_and_var_by_frame(
+        locs.frame.astype(np.int64), locs.sx.astype(np.float64), n_frames
+    )
+    assert np.array_equal(np.isnan(mean), np.isnan(mean_sx))
+    assert np.allclose(mean, mean_sx, rtol=1e-6, equal_nan=True)
+    assert np.allclose(var, var_sx, rtol=1e-5, equal_nan=True)
+    # The calibration with the outlier rejection by frame masks
+    with np.errstate(invalid="ignore"):
+        keep_x = (locs.sx - mean_sx[locs.frame]) ** 2 < var_sx[locs.frame]
+        keep_y = (locs.sy - mean_sy[locs.frame]) ** 2 < var_sy[locs.frame]
+    kept = locs[keep_x & keep_y]
+    mean_sx = _by_frame_masks(np.mean, kept.sx, kept.frame, n_frames)
+    mean_sy = _by_frame_masks(np.mean, kept.sy, kept.frame, n_frames)
+    z_range = -(np.arange(n_frames) * d - (n_frames - 1) * d / 2)
+    cx = np.polyfit(z_range, zfit.interpolate_nan(mean_sx), 6)
+    cy = np.polyfit(z_range, zfit.interpolate_nan(mean_sy), 6)
+    calibration = zfit.calibrate_z(locs, info, d, 1.0)
+    plt.close("all")
+    assert np.allclose(calibration["X Coefficients"], cx, rtol=1e-4)
+    assert np.allclose(calibration["Y Coefficients"], cy, rtol=1e-4)
+
+
+def test_fit_z_range():
+    """
+    By default, z should not be clipped and match the scalar minimization
+    also below the range of the lookup table, (-823.5, 969), and only be
+    clipped to the range passed to fit_z
+    """
+    z_true = np.linspace(-1000, 900, 200)
+    locs = _locs(z_true)
+    cx = np.array(CALIBRATION["X Coefficients"])
+    cy = np.array(CALIBRATION["Y Coefficients"])
+    info = [{"Frames": 1, "Width": 10, "Height": 10}]
+    fitted = zfit.fit_z(locs, info, CALIBRATION, 1.0, filter=0)
+    z_reference = [
+        minimize_scalar(zfit._fit_z_target, args=(sx, sy, cx, cy)).x
+        for sx, sy in zip(locs.sx, locs.sy)
+    ]
+    assert np.max(np.abs(fitted.z - z_reference)) < 0.1
+    fitted = zfit.fit_z(
+        locs, info, CALIBRATION, 1.0, filter=0, z_range=(-300, 300)
+    )
+    assert fitted.z.min() == -300 and fitted.z.max() == 300
+    inside = np.abs(z_true) < 290
+    assert np.allclose(fitted.z[inside], z_true[inside], atol=0.1)